@@ -1,9 +1,20 @@
 import streamlit as st
+import logging
+import logging.config
 import os
 import random
-import google.generativeai as genai
+import time
+import uuid
 from dotenv import load_dotenv
-from mental_health_bot.ml_model.inference import SGDInference
+from mental_health_bot.companion.admission import ADMITTED, make_admission
+from mental_health_bot.companion.context import make_context
+from mental_health_bot.companion.llm import make_gateway
+from mental_health_bot.companion.logs import logging_config
+from mental_health_bot.companion import metrics
+from mental_health_bot.companion.metrics import StageTimer
+from mental_health_bot.companion.policy import BYPASS, ESCALATE, make_policy
+from mental_health_bot.companion.response_cache import make_cache
+from mental_health_bot.companion.safety import default_matcher as safety_matcher, needs_escalation
 
 # Page Config
 st.set_page_config(
@@ -15,14 +26,27 @@ st.set_page_config(
 # Load Environment Variables
 load_dotenv()
 
+# JSON logs written off the script thread, with user text redacted and
+# per-turn events sampled (same setup as the Django site)
+@st.cache_resource
+def configure_logging():
+    logging.config.dictConfig(logging_config(
+        level=os.getenv('LUMA_LOG_LEVEL', 'INFO'),
+        sample_rates={'luma.requests': float(os.getenv('LUMA_LOG_SAMPLE_RATE', '0.1'))},
+        redact_mode=os.getenv('LUMA_LOG_REDACT', 'length'),
+    ))
+    return True
+
+configure_logging()
+logger = logging.getLogger('luma.app')
+request_log = logging.getLogger('luma.requests')
+
 # Configure Gemini
 api_key = os.getenv("GOOGLE_API_KEY")
 if not api_key:
     st.error("⚠️ GOOGLE_API_KEY not found in environment variables. Please set it to use the chatbot.")
     st.stop()
 
-genai.configure(api_key=api_key)
-
 # Initialize Session State
 if "messages" not in st.session_state:
     st.session_state.messages = [{
@@ -31,20 +55,100 @@ if "messages" not in st.session_state:
     }]
 if "last_emotion" not in st.session_state:
     st.session_state.last_emotion = None
+# What the LLM sees: recent turns plus a summary of older ones, kept under a
+# token budget (LUMA_CONTEXT_TOKENS) however long the chat gets
+if "context" not in st.session_state:
+    st.session_state.context = make_context({
+        'MAX_TOKENS': int(os.getenv("LUMA_CONTEXT_TOKENS", "600")),
+        'SUMMARY_TOKENS': int(os.getenv("LUMA_CONTEXT_SUMMARY_TOKENS", "150")),
+    })
+if "client_id" not in st.session_state:
+    st.session_state.client_id = uuid.uuid4().hex
+# Chat history shown on the page is capped too
+MAX_DISPLAYED_MESSAGES = int(os.getenv("LUMA_MAX_DISPLAYED_MESSAGES", "200"))
+
+# Heavy resources are cached per process and built on first use (the first
+# message), not on every script run, so the page renders without waiting
+# for numpy, the model or the Gemini client.
 
-# Load ML Model (Cached Resource)
+# Load ML Model (Cached Resource): a registry that watches the artifact
+# (LUMA_MODEL_PATH, default the bundled one) and hot-swaps a retrained,
+# canary-checked model without restarting the app
 @st.cache_resource
-def load_model():
+def load_model_registry():
     try:
-        # Construct path relative to this file
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(current_dir, 'mental_health_bot', 'ml_model', 'model_params.json')
-        return SGDInference(model_path)
+        from mental_health_bot.ml_model.registry import make_registry
+        poll_interval = os.getenv('LUMA_MODEL_POLL_INTERVAL', '10')
+        registry = make_registry({
+            'PATH': os.getenv('LUMA_MODEL_PATH') or None,
+            'POLL_INTERVAL': float(poll_interval) if poll_interval else None,
+        })
+        metrics.registry.add_collector(lambda: [
+            ('luma_model_info', 'gauge', {'version': registry.current.version}, 1),
+        ] + [('luma_model_reloads_total', 'counter', {'result': r}, n) for r, n in sorted(registry.reloads.items())])
+        return registry
     except Exception as e:
         st.error(f"Error loading ML model: {e}")
         return None
 
-emotion_model = load_model()
+# Gemini reply cache shared by every Streamlit session in this process
+@st.cache_resource
+def load_response_cache():
+    return make_cache({'BACKEND': os.getenv('LUMA_RESPONSE_CACHE', 'memory')})
+
+# Long-lived LLM gateway (Gemini client, deadline, circuit breaker, request coalescing)
+@st.cache_resource
+def load_llm():
+    hedge_after = os.getenv('LUMA_GEMINI_HEDGE_AFTER')
+    return make_gateway({
+        'BACKEND': os.getenv('LUMA_LLM_BACKEND', 'gemini'),
+        'API_KEY': api_key,
+        'DEADLINE': float(os.getenv('LUMA_GEMINI_DEADLINE', '6')),
+        'HEDGE_AFTER': float(hedge_after) if hedge_after else None,
+        'BREAKER_FAILURES': int(os.getenv('LUMA_GEMINI_BREAKER_FAILURES', '3')),
+        'BREAKER_COOLDOWN': float(os.getenv('LUMA_GEMINI_BREAKER_COOLDOWN', '30')),
+    })
+
+# Vetted replies served by TF-IDF similarity before calling Gemini, built
+# once per model version (the index depends on its vocabulary)
+def load_retrieval(version):
+    from mental_health_bot.ml_model.retrieval import load_reply_index
+    threshold = float(os.getenv('LUMA_RETRIEVAL_THRESHOLD', '0.7'))
+
+    def build(model):
+        index = load_reply_index(model, threshold=threshold)
+        metrics.registry.inc('luma_retrieval_index_loads_total', source=index.source if index else 'none')
+        return index
+
+    return version.resource('reply_index', build) if version else None
+
+# Confidence-gated LLM bypass: short, confidently classified, low-risk
+# messages get a local template reply (thresholds as in LUMA_BYPASS)
+@st.cache_resource
+def load_policy():
+    return make_policy({
+        'ENABLED': os.getenv('LUMA_BYPASS', '1') not in ('', '0', 'false', 'False'),
+        'MIN_CONFIDENCE': float(os.getenv('LUMA_BYPASS_MIN_CONFIDENCE', '0.38')),
+        'MIN_MARGIN': float(os.getenv('LUMA_BYPASS_MIN_MARGIN', '0.12')),
+    })
+
+# Per-session token bucket and a process-wide cap on in-flight Gemini calls;
+# over-limit messages get a local reply instead of waiting
+@st.cache_resource
+def load_admission():
+    max_llm = os.getenv('LUMA_MAX_CONCURRENT_LLM', '8')
+    return make_admission({
+        'SESSION_RATE': float(os.getenv('LUMA_SESSION_RATE', '0.5')),
+        'SESSION_BURST': float(os.getenv('LUMA_SESSION_BURST', '5')),
+        'MAX_CONCURRENT_LLM': int(max_llm) if max_llm else None,
+    })
+
+# Per-stage timings and counters; set LUMA_METRICS_PORT to serve them in
+# Prometheus text format (Streamlit has no routes of its own)
+@st.cache_resource
+def start_metrics_server():
+    port = os.getenv('LUMA_METRICS_PORT')
+    return metrics.serve(metrics.registry, int(port)) if port else None
 
 # Constants
 EMOTION_MAP = {
@@ -103,32 +207,51 @@ DEFAULT_RESPONSES = [
 ]
 
 def get_bot_response(user_input):
+    timer = StageTimer()
+    start_metrics_server()
+    with timer.stage('load'):
+        model_registry = load_model_registry()
+        if model_registry:
+            model_registry.watch()
+        # One version for the whole reply, even if a reload lands meanwhile
+        version = model_registry.current if model_registry else None
+        emotion_model = version.model if version else None
+        response_cache = load_response_cache()
+        reply_index = load_retrieval(version)
+    admission = load_admission()
+    decision, _ = admission.check({'session': st.session_state.client_id})
     detected_emotion_label = "Unknown"
+    confidence = margin = 0.0
     
     # 1. ML Prediction
     if emotion_model:
         try:
-            detected_emotion_id = emotion_model.predict(user_input)
+            with timer.stage('tokenize'):
+                counts = emotion_model.accumulate(user_input)
+            with timer.stage('predict'):
+                detected_emotion_id, proba, margin = emotion_model.classify_counts(counts)
             detected_emotion_label = EMOTION_MAP.get(detected_emotion_id, "Unknown")
+            confidence = float(proba.max())
         except Exception:
             pass
+    model_emotion_label = detected_emotion_label
+
+    # 2. Safety Logic (one keyword pass returns every flag)
+    safety_started = time.perf_counter()
+    safety_flags = safety_matcher.scan(user_input)
 
-    # 2. Safety Logic
     # Negative Keyword Safety Net
-    negative_keywords = ['demote', 'fire', 'hate', 'stupid', 'idiot', 'kill', 'die', 'angry', 'furious', 'mad', 'boss', 'bad', 'terrible', 'hit', 'punch', 'hurt', 'hell', 'damn', 'wtf']
-    if any(keyword in user_input.lower() for keyword in negative_keywords):
+    if 'negative' in safety_flags:
         if detected_emotion_label in ['Joy', 'Love', 'Surprise']:
             detected_emotion_label = 'Anger'
 
     # Question/Neutral Safety Net
-    question_keywords = ['what', 'how', 'why', 'when', 'where', 'who', '?']
-    is_question = any(k in user_input.lower() for k in question_keywords)
+    is_question = 'question' in safety_flags
     # Only treat as "too short to be meaningful" if it's REALLY short (e.g., 1-2 words) AND not a clear strong emotion
     is_short = len(user_input.split()) < 3
     
     # Check for strong positive keywords that should override "shortness"
-    positive_keywords = ['happy', 'good', 'great', 'love', 'excellent', 'amazing', 'wonderful', 'joy', 'excited', 'better', 'fine', 'ok', 'okay']
-    has_positive = any(k in user_input.lower() for k in positive_keywords)
+    has_positive = 'positive' in safety_flags
 
     if (is_question or (is_short and not has_positive)) and detected_emotion_label in ['Joy', 'Surprise']:
         if st.session_state.last_emotion in ['Anger', 'Sadness', 'Fear']:
@@ -141,32 +264,67 @@ def get_bot_response(user_input):
     # Update Session State
     if detected_emotion_label != 'Neutral':
         st.session_state.last_emotion = detected_emotion_label
+    timer.add('safety', time.perf_counter() - safety_started)
 
     # 3. Generate Response (Gemini -> Local Fallback)
-    bot_response = ""
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = (
-            f"You are a compassionate mental health companion named Luma. "
-            f"The user says: '{user_input}'. "
-            f"My internal emotion detection model has identified the user's emotion as '{detected_emotion_label}'. "
-            f"Please analyze the text yourself. If the text clearly conveys a different emotion "
-            f"that contradicts the internal label, prioritize your own analysis. "
-            f"Provide a supportive, empathetic response (max 2-3 sentences) appropriate for the user's actual emotion. "
-            f"Do not explicitly mention the internal label."
-        )
-        response = model.generate_content(prompt)
-        if response and response.text:
-            bot_response = response.text
-    except Exception as e:
-        print(f"Gemini API Error: {e}")
+    # (rate-limited messages skip straight to the local replies)
+    bot_response, source = "", None
+    # Negative/crisis messages skip every prebuilt reply (retrieval, cache, templates)
+    instant = decision == ADMITTED and not needs_escalation(safety_flags)
+    if decision == ADMITTED and not instant:
+        metrics.registry.inc('luma_bypass_decisions_total', decision=ESCALATE, reason='safety_flag')
+    if instant and reply_index:
+        with timer.stage('retrieval'):
+            retrieved = reply_index.query(user_input, detected_emotion_label)
+        if retrieved:
+            bot_response, source = retrieved[0], 'retrieval'
+    if instant and not bot_response and response_cache:
+        with timer.stage('cache'):
+            bot_response = response_cache.get(user_input, detected_emotion_label) or ""
+        if bot_response:
+            source = 'cache'
+    if instant and not bot_response:
+        bypass, reason = load_policy().decide(
+            user_input, detected_emotion_label, model_emotion_label, confidence, margin, safety_flags)
+        metrics.registry.inc('luma_bypass_decisions_total', decision=bypass, reason=reason)
+        if bypass == BYPASS:
+            bot_response, source = random.choice(RESPONSES[detected_emotion_label]), 'template'
+    if decision == ADMITTED and not bot_response and admission.acquire_llm():
+        source = 'llm'
+        try:
+            rendered = st.session_state.context.render()
+            with timer.stage('llm'):
+                bot_response = load_llm().reply(user_input, detected_emotion_label, rendered)
+            metrics.registry.inc('luma_llm_requests_total', outcome='success' if bot_response else 'empty')
+            if bot_response and response_cache:
+                response_cache.put(user_input, detected_emotion_label, bot_response, rendered)
+        except Exception as e:
+            metrics.registry.inc('luma_llm_requests_total', outcome='error')
+            logger.warning("LLM request failed", extra={'error': repr(e)})
+        finally:
+            admission.release_llm()
 
     if not bot_response:
+        source = 'fallback'
         if detected_emotion_label in RESPONSES:
             bot_response = random.choice(RESPONSES[detected_emotion_label])
         else:
             bot_response = random.choice(DEFAULT_RESPONSES)
-            
+
+    st.session_state.context.add_turn('user', user_input, detected_emotion_label)
+    st.session_state.context.add_turn('assistant', bot_response)
+    metrics.registry.inc('luma_replies_total', source=source)
+    timer.commit(metrics.registry)
+    request_log.info("reply", extra={
+        'emotion': detected_emotion_label,
+        'source': source,
+        'model_version': version.version if version else None,
+        'user_input': user_input,
+        'reply': bot_response,
+        'timings': timer.server_timing(),
+    })
+    if os.getenv('LUMA_SHOW_TIMINGS'):
+        st.caption(timer.server_timing())
     return bot_response, detected_emotion_label
 
 # UI Layout
@@ -194,3 +352,4 @@ if prompt := st.chat_input("How are you feeling?"):
                 st.caption(f"Mood detected: {emotion}")
     
     st.session_state.messages.append({"role": "assistant", "content": response_text})
+    del st.session_state.messages[:-MAX_DISPLAYED_MESSAGES]
@@ -1,3 +1,26 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ChatSession, ChatTurn, EmotionRollup
+
+
+@admin.register(ChatSession)
+class ChatSessionAdmin(admin.ModelAdmin):
+    list_display = ('conversation_id', 'started_at')
+    search_fields = ('conversation_id',)
+
+
+@admin.register(ChatTurn)
+class ChatTurnAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'session', 'emotion', 'source', 'latency_ms')
+    list_filter = ('emotion', 'source', 'cache_hit')
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('session',)
+    # Counting millions of rows on every page load is slow
+    show_full_result_count = False
+
+
+@admin.register(EmotionRollup)
+class EmotionRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'emotion', 'source', 'count')
+    list_filter = ('emotion', 'source')
+    date_hierarchy = 'bucket'
@@ -0,0 +1,170 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Write-behind log of chat turns. Views call record() which only puts a
+# dict on an in-process queue; a background thread drains it every
+# FLUSH_INTERVAL seconds (or as soon as BATCH_SIZE turns are waiting) and
+# writes each batch with bulk_create, plus one increment per hourly rollup
+# bucket. If the database is slow or down the queue fills up and new turns
+# are dropped (and counted) rather than slowing down replies.
+
+logger = logging.getLogger(__name__)
+
+
+class TurnLog:
+    def __init__(self, batch_size=200, flush_interval=2.0, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def record(self, conversation_id, emotion, source, latency_ms, scores=None, message_words=0):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait({
+                'conversation_id': conversation_id,
+                'created_at': timezone.now(),
+                'emotion': emotion,
+                'scores': scores,
+                'source': source,
+                'cache_hit': source in ('retrieval', 'cache'),
+                'latency_ms': latency_ms,
+                'message_words': message_words,
+            })
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # Started lazily, and again in each forked worker (threads don't
+        # survive fork, e.g. gunicorn with preload_app)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='luma-turn-log', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._take(timeout=self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _take(self, timeout):
+        # Collects up to batch_size items, waiting at most timeout seconds
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        # Synchronously write everything queued so far (shutdown, tests),
+        # including a batch the background thread is holding
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self._write(batch)
+        self._queue.join()
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            write_turns(batch)
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Error writing chat turns", extra={'turns': len(batch)})
+        finally:
+            close_old_connections()
+            for _ in batch:
+                self._queue.task_done()
+
+
+def write_turns(batch):
+    from .models import ChatSession, ChatTurn
+
+    # Sessions: create the missing ones in one statement, then map ids
+    started = {}
+    for row in batch:
+        started.setdefault(row['conversation_id'], row['created_at'])
+    conversation_ids = list(started)
+    ChatSession.objects.bulk_create(
+        [ChatSession(conversation_id=cid, started_at=at) for cid, at in started.items()],
+        ignore_conflicts=True,
+    )
+    session_ids = dict(ChatSession.objects.filter(conversation_id__in=conversation_ids)
+                       .values_list('conversation_id', 'id'))
+
+    turns = []
+    for row in batch:
+        fields = dict(row)
+        turns.append(ChatTurn(session_id=session_ids[fields.pop('conversation_id')], **fields))
+    with transaction.atomic():
+        ChatTurn.objects.bulk_create(turns)
+        update_rollups(batch)
+
+
+def update_rollups(batch):
+    from .models import EmotionRollup
+
+    buckets = defaultdict(lambda: [0, 0.0])
+    for row in batch:
+        hour = row['created_at'].replace(minute=0, second=0, microsecond=0)
+        totals = buckets[(hour, row['emotion'], row['source'])]
+        totals[0] += 1
+        totals[1] += row['latency_ms']
+    for (hour, emotion, source), (count, latency) in buckets.items():
+        key = {'bucket': hour, 'emotion': emotion, 'source': source}
+        updated = EmotionRollup.objects.filter(**key).update(
+            count=F('count') + count, latency_ms_total=F('latency_ms_total') + latency)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    EmotionRollup.objects.create(count=count, latency_ms_total=latency, **key)
+            except IntegrityError:
+                # Another process created the bucket first
+                EmotionRollup.objects.filter(**key).update(
+                    count=F('count') + count, latency_ms_total=F('latency_ms_total') + latency)
+
+
+def make_turn_log(config=None):
+    # config: {'ENABLED': bool, 'BATCH_SIZE': int, 'FLUSH_INTERVAL': seconds,
+    #          'MAX_QUEUE': int}; returns None when disabled
+    config = config or {}
+    if not config.get('ENABLED', True):
+        return None
+    turn_log = TurnLog(
+        batch_size=config.get('BATCH_SIZE', 200),
+        flush_interval=config.get('FLUSH_INTERVAL', 2.0),
+        max_queue=config.get('MAX_QUEUE', 10000),
+    )
+    atexit.register(turn_log.flush)
+    return turn_log
@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatbotConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatbot'
+
+    def ready(self):
+        # Opt-in warm-up: load the model and LLM client at startup instead of
+        # on the first chat message.
+        if getattr(settings, 'LUMA_WARMUP', False):
+            from . import views
+            views.warm_up()
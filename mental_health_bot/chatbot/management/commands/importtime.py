@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Cold-start import budget: imports the chat views in a fresh interpreter
+# under `python -X importtime` and reports where the time goes.
+TARGET = (
+    "import django; django.setup(); "
+    "import mental_health_site.urls; import chatbot.views"
+)
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Report import time of the chat views and fail if it exceeds LUMA_IMPORT_BUDGET_MS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=None)
+        parser.add_argument('--top', type=int, default=15, help="Number of slowest top-level imports to list")
+
+    def handle(self, *args, **options):
+        budget_ms = options['budget_ms']
+        if budget_ms is None:
+            budget_ms = getattr(settings, 'LUMA_IMPORT_BUDGET_MS', 500)
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'mental_health_site.settings'))
+        env.pop('LUMA_WARMUP', None)
+        def run(code):
+            proc = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', code],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(f"Importing the views failed:\n{proc.stderr[-2000:]}")
+            return parse_importtime(proc.stderr)
+
+        # Modules the bare interpreter imports at startup (site, encodings...)
+        # are not part of the app's cold-start cost
+        startup = {r[0] for r in run('pass')}
+        rows = run(TARGET)
+        # Depth-0 entries are the imports triggered directly by the target
+        # statement; their cumulative times add up to the total
+        top_level = [r for r in rows if r[3] == 0 and r[0] not in startup]
+        total_ms = sum(r[2] for r in top_level) / 1000
+
+        self.stdout.write(f"{'cumulative ms':>14}  {'self ms':>8}  module")
+        for name, self_us, cumulative_us, _ in sorted(top_level, key=lambda r: -r[2])[:options['top']]:
+            self.stdout.write(f"{cumulative_us / 1000:14.1f}  {self_us / 1000:8.1f}  {name}")
+        views_ms = next((r[2] / 1000 for r in rows if r[0] == 'chatbot.views'), 0.0)
+        self.stdout.write(f"\nchatbot.views: {views_ms:.1f} ms")
+        self.stdout.write(f"Total import time: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+
+        if total_ms > budget_ms:
+            raise CommandError(f"Import time {total_ms:.1f} ms exceeds budget of {budget_ms:.0f} ms")
+        self.stdout.write(self.style.SUCCESS("Within budget"))
@@ -0,0 +1,256 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+# End-to-end load test of a running site: simulated users hold concurrent
+# conversations against /get_response/, each in its own cookie jar (session
+# and CSRF cookies from the chat page, token sent back in X-CSRFToken), with
+# think time between turns. Reports throughput, latency percentiles and the
+# share of replies by source (X-Reply-Source), fallbacks included.
+#
+# --stream drives /stream_response/ instead, as the chat page does: the
+# Server-Sent Events are read as they arrive, and each turn records the time
+# to the first token as well as the time to the "done" event, which carries
+# the reply source.
+#
+# Run the server against the local LLM stand-in so no quota is spent, e.g.
+#   LUMA_LLM_BACKEND=fake LUMA_FAKE_LLM_MEDIAN_MS=800 LUMA_FAKE_LLM_P95_MS=2500 \
+#   LUMA_FAKE_LLM_ERROR_RATE=0.02 gunicorn -c gunicorn.conf.py mental_health_site.wsgi
+#   python manage.py loadtest --users 50 --turns 8
+#
+# Every user sends its own X-Forwarded-For address; start the server with
+# LUMA_TRUST_X_FORWARDED_FOR=1 to rate-limit them as separate clients, or
+# LUMA_ADMISSION=0 to switch admission control off.
+
+# Openers that make up the realistic bulk of traffic, followed by messages
+# with more to say. "hey how are you" and "good morning" are in the vetted
+# replies; "hi" and "hello" are not (they carry no term the classifier
+# knows), so they go to the LLM and then come from the response cache.
+OPENERS = ["hi", "hello", "hey how are you", "good morning", "i need to talk"]
+MESSAGES = [
+    "I feel so alone and sad lately",
+    "I have no friends at my new school",
+    "I am super excited about the news!",
+    "I love spending time with my family",
+    "I am so angry at my boss for what he said",
+    "I am really worried about the exam tomorrow",
+    "I'm scared I will fail and disappoint everyone",
+    "I was so shocked and amazed by the news",
+    "I can't sleep and my mind keeps racing",
+    "Why does everything feel so pointless?",
+    "Today was actually a pretty good day",
+    "My partner and I had a big fight last night",
+    "I don't know what to do anymore",
+    "thanks, that helps a bit",
+    "ok",
+]
+
+
+class User:
+    def __init__(self, base_url, address, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.address = address
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def _cookie(self, name):
+        for cookie in self.cookies:
+            if cookie.name == name:
+                return cookie.value
+        return None
+
+    def open_chat(self):
+        # The chat page sets the CSRF cookie (and, on first message, the
+        # session cookie follows)
+        request = Request(self.base_url + '/', headers={'X-Forwarded-For': self.address})
+        self.opener.open(request, timeout=self.timeout).read()
+        if not self._cookie('csrftoken'):
+            raise CommandError(f"No csrftoken cookie from {self.base_url}/")
+
+    def _post(self, path, message):
+        return Request(
+            self.base_url + path,
+            data=urlencode({'message': message}).encode(),
+            headers={
+                'X-CSRFToken': self._cookie('csrftoken'),
+                'Referer': self.base_url + '/',
+                'X-Forwarded-For': self.address,
+            },
+        )
+
+    def send(self, message):
+        # -> (status, seconds, reply source or None)
+        request = self._post('/get_response/', message)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                json.loads(response.read())
+                return response.status, time.perf_counter() - started, response.headers.get('X-Reply-Source')
+        except HTTPError as e:
+            return e.code, time.perf_counter() - started, None
+        except (URLError, OSError):
+            return 0, time.perf_counter() - started, None
+
+    def stream(self, message):
+        # -> (status, seconds to the "done" event, reply source or None,
+        #     seconds to the first token or None)
+        request = self._post('/stream_response/', message)
+        started = time.perf_counter()
+        first_token = None
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                    # Errors before the stream starts come back as JSON
+                    json.loads(response.read())
+                    return response.status, time.perf_counter() - started, None, None
+                event, data = 'message', ''
+                for line in response:
+                    line = line.decode('utf-8').rstrip('\r\n')
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data += line[5:].strip()
+                    elif not line and data:
+                        if event == 'message' and first_token is None:
+                            first_token = time.perf_counter() - started
+                        elif event == 'done':
+                            source = json.loads(data).get('source')
+                            return response.status, time.perf_counter() - started, source, first_token
+                        event, data = 'message', ''
+                # Stream closed without a "done" event
+                return 0, time.perf_counter() - started, None, first_token
+        except HTTPError as e:
+            return e.code, time.perf_counter() - started, None, None
+        except (URLError, OSError):
+            return 0, time.perf_counter() - started, None, None
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.first_tokens = []
+        self.sources = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def add(self, status, seconds, source, first_token=None):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(seconds)
+                if first_token is not None:
+                    self.first_tokens.append(first_token)
+                key = source or 'unknown'
+                self.sources.setdefault(key, []).append(seconds)
+
+
+def run_user(index, options, results, rng):
+    user = User(options['url'], f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}", options['timeout'])
+    try:
+        user.open_chat()
+    except (URLError, OSError) as e:
+        results.add(0, 0.0, None)
+        return str(e)
+    for turn in range(options['turns']):
+        message = rng.choice(OPENERS) if turn == 0 else rng.choice(MESSAGES)
+        results.add(*(user.stream(message) if options['stream'] else user.send(message)))
+        if options['think'] and turn < options['turns'] - 1:
+            time.sleep(rng.expovariate(1.0 / options['think']))
+    return None
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000
+    result = {f'p{q}': round(float(np.percentile(ms, q)), 1) for q in (50, 90, 95, 99)}
+    result['max'] = round(float(ms.max()), 1)
+    return result
+
+
+class Command(BaseCommand):
+    help = ("Drive /get_response/ (or /stream_response/ with --stream) with concurrent simulated "
+            "conversations and report throughput and latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the running site")
+        parser.add_argument('--users', type=int, default=20, help="Conversations in total")
+        parser.add_argument('--concurrency', type=int, default=None, help="Conversations at once (default: all)")
+        parser.add_argument('--turns', type=int, default=6, help="Messages per conversation")
+        parser.add_argument('--think', type=float, default=1.0, help="Mean seconds between a user's messages")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Client timeout per request (s)")
+        parser.add_argument('--ramp', type=float, default=0.0, help="Seconds over which to start the users")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--stream', action='store_true',
+                            help="Use /stream_response/ (SSE) and measure time to first token")
+        parser.add_argument('--out', default=None, help="Write the report as JSON")
+
+    def handle(self, *args, **options):
+        users = options['users']
+        concurrency = options['concurrency'] or users
+        results = Results()
+        rng = random.Random(options['seed'])
+        seeds = [rng.random() for _ in range(users)]
+
+        def start(index):
+            if options['ramp']:
+                time.sleep(options['ramp'] * index / users)
+            return run_user(index, options, results, random.Random(seeds[index]))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            errors = [e for e in pool.map(start, range(users)) if e]
+        elapsed = time.perf_counter() - started
+
+        ok = len(results.latencies)
+        total = sum(results.statuses.values())
+        report = {
+            'url': options['url'],
+            'endpoint': '/stream_response/' if options['stream'] else '/get_response/',
+            'users': users,
+            'concurrency': concurrency,
+            'requests': total,
+            'ok': ok,
+            'errors': total - ok,
+            'statuses': {str(k): v for k, v in sorted(results.statuses.items())},
+            'seconds': round(elapsed, 2),
+            'throughput_rps': round(ok / elapsed, 2) if elapsed else 0.0,
+            'latency_ms': percentiles(results.latencies),
+            'first_token_ms': percentiles(results.first_tokens),
+            'sources': {
+                source: {
+                    'share': round(len(values) / ok, 4),
+                    'latency_ms': percentiles(values),
+                }
+                for source, values in sorted(results.sources.items())
+            },
+            'fallback_rate': round(len(results.sources.get('fallback', [])) / ok, 4) if ok else 0.0,
+        }
+        if errors:
+            report['connection_errors'] = errors[:5]
+
+        self.stdout.write(
+            f"{report['requests']} requests ({report['errors']} errors) in {report['seconds']}s: "
+            f"{report['throughput_rps']} req/s"
+        )
+        latency = report['latency_ms']
+        if latency:
+            self.stdout.write("latency ms  " + "  ".join(f"{k} {v}" for k, v in latency.items()))
+        if report['first_token_ms']:
+            self.stdout.write("first token ms  " + "  ".join(f"{k} {v}" for k, v in report['first_token_ms'].items()))
+        for source, entry in report['sources'].items():
+            self.stdout.write(f"  {source:10s} {entry['share']:7.1%}  p50 {entry['latency_ms']['p50']} ms  p95 {entry['latency_ms']['p95']} ms")
+        self.stdout.write(f"fallback rate {report['fallback_rate']:.1%}")
+        if options['out']:
+            with open(options['out'], 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation_id', models.CharField(max_length=32, unique=True)),
+                ('started_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EmotionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('emotion', models.CharField(max_length=16)),
+                ('source', models.CharField(choices=[('retrieval', 'Vetted reply'), ('cache', 'Cached reply'), ('llm', 'LLM'), ('fallback', 'Local fallback')], max_length=16)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('latency_ms_total', models.FloatField(default=0.0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'emotion', 'source'), name='emotionrollup_unique_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChatTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('emotion', models.CharField(max_length=16)),
+                ('scores', models.JSONField(blank=True, null=True)),
+                ('source', models.CharField(choices=[('retrieval', 'Vetted reply'), ('cache', 'Cached reply'), ('llm', 'LLM'), ('fallback', 'Local fallback')], max_length=16)),
+                ('cache_hit', models.BooleanField(default=False)),
+                ('latency_ms', models.FloatField()),
+                ('message_words', models.PositiveIntegerField(default=0)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='chatbot.chatsession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'emotion'], name='chatturn_time_emotion'), models.Index(fields=['session', 'created_at'], name='chatturn_session_time')],
+            },
+        ),
+    ]
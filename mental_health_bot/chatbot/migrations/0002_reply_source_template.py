@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatturn',
+            name='source',
+            field=models.CharField(choices=[('retrieval', 'Vetted reply'), ('cache', 'Cached reply'), ('template', 'Template (LLM bypassed)'), ('llm', 'LLM'), ('fallback', 'Local fallback')], max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='emotionrollup',
+            name='source',
+            field=models.CharField(choices=[('retrieval', 'Vetted reply'), ('cache', 'Cached reply'), ('template', 'Template (LLM bypassed)'), ('llm', 'LLM'), ('fallback', 'Local fallback')], max_length=16),
+        ),
+    ]
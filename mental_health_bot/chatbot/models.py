@@ -1,3 +1,60 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+# Per-turn emotion history for analytics. Rows are written in batches by
+# chatbot/analytics.py, never from the request path, and message text is
+# not stored. Dashboards read EmotionRollup, which is kept up to date at
+# flush time, so their queries stay small however many turns are logged.
+
+SOURCE_CHOICES = [
+    ('retrieval', 'Vetted reply'),
+    ('cache', 'Cached reply'),
+    ('template', 'Template (LLM bypassed)'),
+    ('llm', 'LLM'),
+    ('fallback', 'Local fallback'),
+]
+
+
+class ChatSession(models.Model):
+    conversation_id = models.CharField(max_length=32, unique=True)
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.conversation_id
+
+
+class ChatTurn(models.Model):
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='turns')
+    created_at = models.DateTimeField(default=timezone.now)
+    emotion = models.CharField(max_length=16)
+    scores = models.JSONField(null=True, blank=True)  # {label: probability} from the ML model
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES)
+    cache_hit = models.BooleanField(default=False)
+    latency_ms = models.FloatField()
+    message_words = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'emotion'], name='chatturn_time_emotion'),
+            models.Index(fields=['session', 'created_at'], name='chatturn_session_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id} {self.emotion} ({self.source})"
+
+
+class EmotionRollup(models.Model):
+    # Hourly counts per (emotion, source), incremented on every flush
+    bucket = models.DateTimeField()
+    emotion = models.CharField(max_length=16)
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    latency_ms_total = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'emotion', 'source'], name='emotionrollup_unique_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.emotion} {self.source}: {self.count}"
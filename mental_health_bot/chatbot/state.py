@@ -0,0 +1,166 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+# Per-conversation state (last_emotion and future context) kept in a cache
+# backend instead of the DB session. The session only carries a conversation
+# id, set once per conversation, so with the signed-cookie session engine a
+# chat turn never touches SQLite. State is read once per request and written
+# at most once, and only when something actually changed.
+#
+# With LUMA_CONVERSATION_WRITE_BEHIND set (the default for the database
+# cache), saves go to a StateWriter instead: the latest state of each
+# conversation is held in the worker and written every few seconds, so a
+# conversation costs one write per interval rather than one per turn.
+
+CONVERSATION_ID_KEY = 'conversation_id'
+
+logger = logging.getLogger(__name__)
+
+
+def _cache():
+    return caches[getattr(settings, 'LUMA_CONVERSATION_CACHE', 'default')]
+
+
+class StateWriter:
+    # Write-behind for conversation state. put() only replaces the pending
+    # entry for the key, so turns arriving within one flush interval are
+    # coalesced into a single write; a background thread writes the pending
+    # entries with set_many. This worker reads its own pending writes back;
+    # other workers see them after the next flush. A failed write is logged
+    # and dropped (the conversation just loses the turns since the last one).
+    def __init__(self, cache=_cache, flush_interval=2.0):
+        self._cache = cache
+        self.flush_interval = flush_interval
+        self._pending = {}   # key -> (data, timeout)
+        self._flushing = {}  # taken by a flush that hasn't finished yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def put(self, key, data, timeout):
+        self._ensure_thread()
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (dict(data), timeout)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._pending.get(key) or self._flushing.get(key)
+        return dict(entry[0]) if entry else None
+
+    def _ensure_thread(self):
+        # Started lazily, and again in each forked worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='luma-state-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            if not self._flushing:
+                return
+            by_timeout = {}
+            for key, (data, timeout) in self._flushing.items():
+                by_timeout.setdefault(timeout, {})[key] = data
+            close_old_connections()
+            try:
+                for timeout, batch in by_timeout.items():
+                    self._cache().set_many(batch, timeout)
+                self.written += len(self._flushing)
+            except Exception:
+                self.failed += len(self._flushing)
+                logger.exception("Error writing conversation state", extra={'conversations': len(self._flushing)})
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self._flushing = {}
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def state_writer():
+    # The process's StateWriter, or None when state is written through
+    global _writer
+    interval = getattr(settings, 'LUMA_CONVERSATION_WRITE_BEHIND', 0)
+    if not interval:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = StateWriter(flush_interval=interval)
+                atexit.register(_writer.flush)
+    return _writer
+
+
+class ConversationState:
+    def __init__(self, conversation_id, data=None):
+        self.conversation_id = conversation_id
+        self._data = dict(data or {})
+        self._dirty = False
+
+    @classmethod
+    def for_request(cls, request):
+        conversation_id = request.session.get(CONVERSATION_ID_KEY)
+        if conversation_id is None:
+            conversation_id = uuid.uuid4().hex
+            request.session[CONVERSATION_ID_KEY] = conversation_id
+            return cls(conversation_id)
+        key = cls.cache_key(conversation_id)
+        writer = state_writer()
+        data = writer.get(key) if writer else None
+        if data is None:
+            data = _cache().get(key)
+        return cls(conversation_id, data)
+
+    @staticmethod
+    def cache_key(conversation_id):
+        return f"luma:conversation:{conversation_id}"
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        if self._data.get(key) != value or key not in self._data:
+            self._data[key] = value
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return False
+        timeout = getattr(settings, 'LUMA_CONVERSATION_TTL', 24 * 60 * 60)
+        writer = state_writer()
+        if writer:
+            writer.put(self.cache_key(self.conversation_id), self._data, timeout)
+        else:
+            _cache().set(self.cache_key(self.conversation_id), self._data, timeout)
+        self._dirty = False
+        return True
@@ -1,3 +1,312 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from companion.admission import make_admission
+from companion.lazy import Lazy
+from companion.llm import FakeBackend, LLMGateway
+from companion.logs import AsyncJsonHandler
+from companion.policy import make_policy
+from companion.response_cache import MemoryBackend, ResponseCache, SQLiteBackend
+
+from . import views
+from .analytics import TurnLog, write_turns
+from .models import ChatSession, ChatTurn, EmotionRollup
+from .state import ConversationState, StateWriter
+
+real_current_reply_index = views.current_reply_index
+
+
+class EchoBackend(FakeBackend):
+    # Replies with the prompt itself, so a reply shows which conversation
+    # it was written for
+    def generate(self, prompt, timeout=None):
+        return f"Reply to: {prompt}"
+
+
+@override_settings(LUMA_CONVERSATION_WRITE_BEHIND=0)
+class ChatTestCase(TestCase):
+    def setUp(self):
+        # Every message goes to the (fake) LLM: no retrieval, bypass,
+        # rate limits, analytics or deferred state writes
+        self.cache = ResponseCache(MemoryBackend(), candidates=1)
+        self.gateway = LLMGateway(EchoBackend())
+        patches = [
+            mock.patch.object(views, 'llm', Lazy(lambda: self.gateway)),
+            mock.patch.object(views, 'response_cache', self.cache),
+            mock.patch.object(views, 'bypass_policy', make_policy({'ENABLED': False})),
+            mock.patch.object(views, 'admission', make_admission({'ENABLED': False})),
+            mock.patch.object(views, 'current_reply_index', lambda version: None),
+            mock.patch.object(views, 'turn_log', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def send(self, client, message):
+        response = client.post('/get_response/', {'message': message})
+        self.assertEqual(response.status_code, 200)
+        return response['X-Reply-Source'], response.json()['response']
+
+
+class ResponseCacheTests(ChatTestCase):
+    def test_context_free_replies_are_shared(self):
+        first = self.client_class()
+        second = self.client_class()
+        source, reply = self.send(first, "hello there")
+        self.assertEqual(source, 'llm')
+        self.assertEqual(self.send(second, "hello there"), ('cache', reply))
+
+    def test_conversations_never_share_replies(self):
+        alice = self.client_class()
+        bob = self.client_class()
+        self.send(alice, "I feel so sad since I lost my job at Acme")
+        self.send(bob, "I feel so sad since my cat Whiskers died")
+        _, alice_reply = self.send(alice, "ok")
+        bob_source, bob_reply = self.send(bob, "ok")
+        self.assertIn("Acme", alice_reply)
+        self.assertEqual(bob_source, 'llm')
+        self.assertIn("Whiskers", bob_reply)
+        self.assertNotIn("Acme", bob_reply)
+
+
+class ResponseCacheBackendTests(TestCase):
+    def setUp(self):
+        self.now = 1_000_000.0
+        patch = mock.patch('companion.response_cache.time.time', lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def sqlite_backend(self, **kwargs):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return SQLiteBackend(os.path.join(tmp.name, 'cache.sqlite3'), **kwargs)
+
+    def check_lru_eviction(self, backend):
+        backend.set('a', ["A"])
+        self.now += 1
+        backend.set('b', ["B"])
+        self.now += 1
+        self.assertEqual(backend.get('a'), ["A"])  # now the most recent
+        self.now += 1
+        backend.set('c', ["C"])
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual((backend.get('a'), backend.get('c')), (["A"], ["C"]))
+
+    def check_ttl(self, backend):
+        backend.set('a', ["A"])
+        self.now += 59
+        self.assertEqual(backend.get('a'), ["A"])
+        self.now += 2
+        self.assertIsNone(backend.get('a'))
+        # An expired entry is gone, not just hidden
+        self.now -= 10
+        self.assertIsNone(backend.get('a'))
+
+    def test_memory_lru_eviction(self):
+        self.check_lru_eviction(MemoryBackend(max_entries=2))
+
+    def test_memory_ttl(self):
+        self.check_ttl(MemoryBackend(ttl=60))
+
+    def test_sqlite_lru_eviction(self):
+        self.check_lru_eviction(self.sqlite_backend(max_entries=2))
+
+    def test_sqlite_ttl(self):
+        self.check_ttl(self.sqlite_backend(ttl=60))
+
+    def test_expired_key_collects_candidates_again(self):
+        cache = ResponseCache(MemoryBackend(ttl=60), candidates=2)
+        cache.put("hello", 'Joy', "Hi!")
+        cache.put("hello", 'Joy', "Hey!")
+        self.assertIn(cache.get("hello", 'Joy'), ("Hi!", "Hey!"))
+        self.now += 61
+        self.assertIsNone(cache.get("hello", 'Joy'))
+        cache.put("hello", 'Joy', "Hello!")
+        self.assertIsNone(cache.get("hello", 'Joy'))
+
+
+class RequestLogTests(ChatTestCase):
+    def test_message_and_reply_never_reach_the_log(self):
+        stream = io.StringIO()
+        handler = AsyncJsonHandler(stream=stream)
+        logger = logging.getLogger('luma.requests')
+        logger.addHandler(handler)
+        try:
+            _, reply = self.send(self.client, "I told Marguerite about the panic attacks")
+        finally:
+            logger.removeHandler(handler)
+            handler.stop()
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['source'], 'llm')
+        self.assertIn("Marguerite", reply)
+        self.assertNotIn("Marguerite", stream.getvalue())
+        self.assertEqual(entry['user_input'], "[redacted 41 chars]")
+        self.assertEqual(entry['reply'], f"[redacted {len(reply)} chars]")
+
+
+class SafetyEscalationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(views, 'current_reply_index', real_current_reply_index)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_close_match_is_retrieved(self):
+        self.assertEqual(self.send(self.client, "i am so tired of everything")[0], 'retrieval')
+
+    def test_crisis_messages_skip_retrieval_and_cache(self):
+        for message in ("i am so tired of everything, i want to kill myself", "i feel sad kill", "i want to end my life"):
+            with self.subTest(message=message):
+                emotion = views.detect_emotion(mock.Mock(get=lambda key: None), message, version=views.current_model())[0]
+                self.cache.put(message, emotion, "A cached reply")
+                source, reply = self.send(self.client_class(), message)
+                self.assertEqual(source, 'llm')
+                self.assertNotEqual(reply, "A cached reply")
+
+
+class StateWriterTests(TestCase):
+    def setUp(self):
+        patch = mock.patch.object(StateWriter, '_ensure_thread')
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.cache = caches['conversations']
+        self.writer = StateWriter(lambda: self.cache)
+
+    def test_turns_are_coalesced_into_one_write(self):
+        key = ConversationState.cache_key('e' * 32)
+        with mock.patch.object(self.cache, 'set_many', wraps=self.cache.set_many) as set_many:
+            for turn in range(3):
+                self.writer.put(key, {'turn': turn}, 60)
+            # Read back from memory before the flush
+            self.assertEqual(self.writer.get(key), {'turn': 2})
+            self.assertIsNone(self.cache.get(key))
+            self.writer.flush()
+            self.writer.flush()
+        self.assertEqual(set_many.call_count, 1)
+        self.assertEqual((self.writer.written, self.writer.coalesced), (1, 2))
+        self.assertIsNone(self.writer.get(key))
+        self.assertEqual(self.cache.get(key), {'turn': 2})
+
+    def test_state_reads_pending_writes(self):
+        with override_settings(LUMA_CONVERSATION_WRITE_BEHIND=2.0), \
+                mock.patch('chatbot.state._writer', self.writer):
+            request = mock.Mock(session={})
+            state = ConversationState.for_request(request)
+            state.set('last_emotion', 'Fear')
+            state.save()
+            self.assertEqual(ConversationState.for_request(request).get('last_emotion'), 'Fear')
+            self.writer.flush()
+            self.assertEqual(self.cache.get(state.cache_key(state.conversation_id)), {'last_emotion': 'Fear'})
+
+
+def parse_events(content):
+    # SSE body -> [(event, data)]
+    events = []
+    for block in content.split('\n\n'):
+        if not block.strip():
+            continue
+        event, data = 'message', ''
+        for line in block.split('\n'):
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data += line[5:].strip()
+        events.append((event, json.loads(data)))
+    return events
+
+
+class StreamResponseTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = LLMGateway(FakeBackend("One two three."))
+
+    def test_streams_tokens_under_wsgi(self):
+        response = self.client.post('/stream_response/', {'message': "I am worried about tomorrow"})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        # A synchronous iterator: WSGI sends each event as it is produced
+        # instead of collecting an async one first
+        self.assertFalse(response.is_async)
+        events = parse_events(b''.join(response.streaming_content).decode())
+        self.assertEqual(events[0][0], 'meta')
+        self.assertEqual([data['token'] for event, data in events if event == 'message'], ["One", " two", " three."])
+        self.assertEqual(events[-1], ('done', {'response': "One two three.", 'emotion': events[0][1]['emotion'], 'source': 'llm'}))
+
+    async def test_streams_tokens_under_asgi(self):
+        response = await self.async_client.post('/stream_response/', {'message': "I am worried about tomorrow"})
+        self.assertTrue(response.is_async)
+        content = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        events = parse_events(content)
+        self.assertEqual([data['token'] for event, data in events if event == 'message'], ["One", " two", " three."])
+        self.assertEqual(events[-1][1]['response'], "One two three.")
+
+    def test_falls_back_when_the_llm_fails(self):
+        self.gateway = LLMGateway(FakeBackend(error_rate=1.0))
+        response = self.client.post('/stream_response/', {'message': "I am worried about tomorrow"})
+        events = parse_events(b''.join(response.streaming_content).decode())
+        done = events[-1][1]
+        self.assertIn(done['response'], views.RESPONSES.get(done['emotion'], views.DEFAULT_RESPONSES))
+        self.assertEqual(done['source'], 'fallback')
+        self.assertEqual([data['token'] for event, data in events if event == 'message'], [done['response']])
+
+    def test_invalid_request_is_json(self):
+        response = self.client.get('/stream_response/')
+        self.assertEqual(response.json(), {'response': 'Invalid request', 'emotion': 'Neutral'})
+
+
+class TurnLogTests(TestCase):
+    def setUp(self):
+        # Flushed by the test itself rather than the background thread
+        patch = mock.patch.object(TurnLog, '_ensure_thread')
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def rollups(self):
+        return {(r.emotion, r.source): (r.count, r.latency_ms_total) for r in EmotionRollup.objects.all()}
+
+    def test_flush_writes_turns_and_rollups(self):
+        turn_log = TurnLog(batch_size=2)
+        turn_log.record('a' * 32, 'Sadness', 'llm', latency_ms=100.0, scores={'Sadness': 0.9}, message_words=5)
+        turn_log.record('a' * 32, 'Sadness', 'llm', latency_ms=300.0)
+        turn_log.record('b' * 32, 'Joy', 'cache', latency_ms=5.0)
+        self.assertEqual(ChatTurn.objects.count(), 0)
+        turn_log.flush()
+        self.assertEqual(turn_log.written, 3)
+        self.assertEqual(ChatSession.objects.count(), 2)
+        self.assertEqual(ChatTurn.objects.filter(session__conversation_id='a' * 32).count(), 2)
+        self.assertTrue(ChatTurn.objects.get(source='cache').cache_hit)
+        self.assertEqual(self.rollups(), {('Sadness', 'llm'): (2, 400.0), ('Joy', 'cache'): (1, 5.0)})
+
+        # Later flushes add to the same hourly buckets
+        turn_log.record('b' * 32, 'Sadness', 'llm', latency_ms=50.0)
+        turn_log.flush()
+        self.assertEqual(ChatSession.objects.count(), 2)
+        self.assertEqual(self.rollups(), {('Sadness', 'llm'): (3, 450.0), ('Joy', 'cache'): (1, 5.0)})
+
+    def test_rollups_are_hourly(self):
+        def row(hour, minute, latency):
+            return {
+                'conversation_id': 'c' * 32,
+                'created_at': datetime(2026, 1, 1, hour, minute, tzinfo=dt_timezone.utc),
+                'emotion': 'Fear', 'scores': None, 'source': 'llm', 'cache_hit': False,
+                'latency_ms': latency, 'message_words': 3,
+            }
+
+        write_turns([row(9, 5, 10.0), row(9, 55, 20.0), row(10, 0, 40.0)])
+        buckets = {r.bucket.hour: (r.count, r.latency_ms_total) for r in EmotionRollup.objects.all()}
+        self.assertEqual(buckets, {9: (2, 30.0), 10: (1, 40.0)})
+
+    def test_full_queue_drops_turns(self):
+        turn_log = TurnLog(max_queue=2)
+        for _ in range(3):
+            turn_log.record('d' * 32, 'Joy', 'template', latency_ms=1.0)
+        self.assertEqual(turn_log.dropped, 1)
+        turn_log.flush()
+        self.assertEqual((turn_log.written, ChatTurn.objects.count()), (2, 2))
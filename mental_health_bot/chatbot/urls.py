@@ -4,4 +4,9 @@ from . import views
 urlpatterns = [
     path('', views.chat_view, name='chat'),
     path('get_response/', views.get_response, name='get_response'),
+    path('stream_response/', views.stream_response, name='stream_response'),
+    path('stats/emotions/', views.emotion_stats, name='emotion_stats'),
+    path('stats/sources/', views.source_stats, name='source_stats'),
+    path('model/', views.model_admin, name='model_admin'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,26 +1,144 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.utils import timezone
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
+import json
+import logging
 import os
 import random
-import google.generativeai as genai
-from dotenv import load_dotenv
-from ml_model.inference import SGDInference
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from companion.admission import ADMITTED, make_admission
+from companion.context import make_context
+from companion.lazy import Lazy
+from companion.logs import AsyncJsonHandler
+from companion.llm import make_gateway
+from companion.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer, registry as metrics
+from companion.policy import BYPASS, ESCALATE, make_policy
+from companion.response_cache import make_cache
+from companion.safety import KeywordMatcher, needs_escalation
+from .analytics import make_turn_log
+from .models import EmotionRollup
+from .state import ConversationState
 
-# Load Environment Variables
-# Assuming .env is in the project root (one level up from manage.py, or two levels up from here)
-dotenv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
-load_dotenv(dotenv_path)
+logger = logging.getLogger(__name__)
+# One event per chat turn, sampled (see LOGGING in settings)
+request_log = logging.getLogger('luma.requests')
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# Heavy resources (numpy + the emotion model, the Gemini client, the
+# retrieval index) are built on first use, not at import, so serving the
+# chat page on a cold start doesn't pay for them. warm_up() builds them all.
 
-# Load ML Model
-try:
-    emotion_model = SGDInference()
-    print("ML Model loaded successfully")
-except Exception as e:
-    print(f"Error loading ML model: {e}")
-    emotion_model = None
+def _load_model_registry():
+    # Process-wide registry holding the active emotion model, preloaded
+    # before fork under gunicorn (see LUMA_MODEL in settings)
+    from ml_model import shared
+    config = getattr(settings, 'LUMA_MODEL', None) or {}
+    try:
+        registry = shared.get_registry(config, _CacheStore(config.get('CONTROL_CACHE', 'default')))
+        logger.info("ML model loaded", extra=registry.current.describe())
+        return registry
+    except Exception:
+        logger.exception("Error loading ML model")
+        return None
+
+def _load_llm():
+    from dotenv import load_dotenv
+    # Load Environment Variables
+    # Assuming .env is in the project root (one level up from manage.py, or two levels up from here)
+    dotenv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
+    load_dotenv(dotenv_path)
+    # Long-lived LLM client with deadline, breaker and request coalescing (see LUMA_LLM in settings)
+    return make_gateway(getattr(settings, 'LUMA_LLM', None))
+
+def _load_reply_index(model):
+    # Vetted replies retrieved by TF-IDF similarity (see LUMA_RETRIEVAL in settings)
+    retrieval_config = getattr(settings, 'LUMA_RETRIEVAL', {})
+    if not retrieval_config.get('ENABLED', True):
+        return None
+    from ml_model.retrieval import load_reply_index
+    index = load_reply_index(model, threshold=retrieval_config.get('THRESHOLD', 0.7))
+    # source 'seed': rebuilt for a new model vocabulary; 'none': no retrieval
+    metrics.inc('luma_retrieval_index_loads_total', source=index.source if index else 'none')
+    return index
+
+model_registry = Lazy(_load_model_registry)
+llm = Lazy(_load_llm)
+
+def current_model():
+    # The active ModelVersion (None without a model). Read once per request
+    # and passed along, so a hot reload never switches models mid-reply.
+    registry = model_registry.get()
+    if registry is None:
+        return None
+    registry.watch()
+    return registry.current
+
+def current_reply_index(version):
+    # Built per model version, as the index vectors depend on its vocabulary
+    return version.resource('reply_index', _load_reply_index) if version else None
+
+# Cache of Gemini replies for common messages (see LUMA_RESPONSE_CACHE in settings)
+response_cache = make_cache(getattr(settings, 'LUMA_RESPONSE_CACHE', None))
+
+# Confidence-gated LLM bypass (see LUMA_BYPASS in settings)
+bypass_policy = make_policy(getattr(settings, 'LUMA_BYPASS', None))
+
+# Per-client token buckets and a cap on in-flight LLM calls (see
+# LUMA_ADMISSION in settings); over-limit requests get a local reply at once
+class _CacheStore:
+    # Resolves the Django cache per call, as cache connections are per thread
+    def __init__(self, alias):
+        self.alias = alias
+
+    def get(self, key, default=None):
+        return caches[self.alias].get(key, default)
+
+    def set(self, key, value, timeout=None):
+        caches[self.alias].set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return caches[self.alias].add(key, value, timeout)
+
+    def incr(self, key):
+        return caches[self.alias].incr(key)
+
+    def decr(self, key):
+        return caches[self.alias].decr(key)
+
+_admission_config = getattr(settings, 'LUMA_ADMISSION', None) or {}
+admission = make_admission(_admission_config, _CacheStore(_admission_config.get('CACHE', 'default')))
+
+def client_keys(request, state):
+    # Rate-limit keys: the conversation, and the client address
+    address = request.META.get('REMOTE_ADDR', '')
+    if _admission_config.get('TRUST_X_FORWARDED_FOR'):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        address = forwarded.split(',')[0].strip() or address
+    return {'session': state.conversation_id, 'ip': address}
+
+# Write-behind per-turn analytics log (see LUMA_ANALYTICS in settings)
+turn_log = make_turn_log(getattr(settings, 'LUMA_ANALYTICS', None))
+
+# Keyword safety nets, one pass per message (see LUMA_SAFETY_KEYWORDS in settings)
+safety_matcher = KeywordMatcher(getattr(settings, 'LUMA_SAFETY_KEYWORDS', None))
+
+def warm_up(include_llm=True):
+    # Optional: build everything ahead of the first chat message (called
+    # from ChatbotConfig.ready() when LUMA_WARMUP is set, and by gunicorn.conf.py
+    # without the LLM client, which must not be created before fork)
+    registry = model_registry.get()
+    if registry is not None:
+        current_reply_index(registry.current)
+    if include_llm:
+        llm.get()
 
 # Emotion Labels Mapping (nelgiriyewithana/emotions)
 EMOTION_MAP = {
@@ -89,83 +207,463 @@ DEFAULT_RESPONSES = [
 def chat_view(request):
     return render(request, 'chatbot/index.html')
 
+def detect_emotion(state, user_input, timer=None, version=None):
+    # Returns (label after the safety rules, prediction) where prediction
+    # holds the model's own label, its confidence and margin, the class
+    # probabilities, the model version and the safety flags
+    timer = timer or StageTimer()
+    # Predict Emotion using ML Model
+    detected_emotion_label = "Unknown"
+    prediction = {'emotion': "Unknown", 'confidence': 0.0, 'margin': 0.0, 'scores': None, 'model_version': None}
+
+    model = version.model if version else None
+    if model:
+        if model.compiled:
+            with timer.stage('tokenize'):
+                counts = model.accumulate(user_input)
+            with timer.stage('predict'):
+                detected_emotion_id, proba, margin = model.classify_counts(counts)
+        else:
+            with timer.stage('predict'):
+                detected_emotion_id, proba, margin = model.classify(user_input)
+        # detected_emotion_id is already an integer (0-5)
+        detected_emotion_label = EMOTION_MAP.get(detected_emotion_id, "Unknown")
+        prediction = {
+            'emotion': detected_emotion_label,
+            'confidence': float(proba.max()),
+            'margin': margin,
+            'scores': {EMOTION_MAP.get(int(c), str(c)): round(float(p), 4) for c, p in zip(model.classes, proba)},
+            'model_version': version.version,
+        }
+
+    safety_started = time.perf_counter()
+
+    # --- CONTEXT & SAFETY LOGIC START ---
+
+    # 1. Retrieve previous emotion from the conversation state
+    last_emotion = state.get('last_emotion')
+
+    safety_flags = safety_matcher.scan(user_input)
+
+    # 2. Negative Keyword Safety Net (Overrides ML)
+    if 'negative' in safety_flags:
+        if detected_emotion_label in ['Joy', 'Love', 'Surprise']:
+            detected_emotion_label = 'Anger' # Force Anger for negative keywords
+
+    # 3. Question/Neutral Safety Net (Overrides Joy/Surprise for short questions)
+    is_question = 'question' in safety_flags
+    is_short = len(user_input.split()) < 8
+
+    if (is_question or is_short) and detected_emotion_label in ['Joy', 'Surprise']:
+        # If we were previously talking about something negative, assume we still are
+        if last_emotion in ['Anger', 'Sadness', 'Fear']:
+            detected_emotion_label = last_emotion
+        else:
+            # Otherwise, treat as Neutral (force fallback)
+            detected_emotion_label = 'Neutral'
+
+    # 4. Save current emotion for next turn (only written if it changed)
+    if detected_emotion_label != 'Neutral':
+        state.set('last_emotion', detected_emotion_label)
+
+    # --- CONTEXT & SAFETY LOGIC END ---
+    prediction['flags'] = safety_flags
+    timer.add('safety', time.perf_counter() - safety_started)
+    return detected_emotion_label, prediction
+
+def instant_reply(user_input, detected_emotion_label, prediction, timer=None, version=None):
+    # Vetted, cached or (for confident low-risk messages) template reply as
+    # (reply, source), with reply "" when the LLM is needed
+    timer = timer or StageTimer()
+    if needs_escalation(prediction.get('flags', ())):
+        # Distress is never answered with a canned or another user's reply,
+        # however close the message is to one
+        metrics.inc('luma_bypass_decisions_total', decision=ESCALATE, reason='safety_flag')
+        return "", None
+    with timer.stage('retrieval'):
+        index = current_reply_index(version)
+        retrieved = index.query(user_input, detected_emotion_label) if index else None
+    if retrieved:
+        return retrieved[0], 'retrieval'
+    if response_cache:
+        with timer.stage('cache'):
+            cached = response_cache.get(user_input, detected_emotion_label)
+        if cached:
+            return cached, 'cache'
+    decision, reason = bypass_policy.decide(
+        user_input, detected_emotion_label, prediction['emotion'],
+        prediction['confidence'], prediction['margin'], prediction.get('flags', ()))
+    metrics.inc('luma_bypass_decisions_total', decision=decision, reason=reason)
+    if decision == BYPASS:
+        return fallback_reply(detected_emotion_label), 'template'
+    return "", None
+
+def llm_reply(user_input, detected_emotion_label, context, timer):
+    # Gemini reply, or "" when it fails or every LLM slot is taken (the
+    # request is shed to the local replies rather than queued)
+    if not admission.acquire_llm():
+        return ""
+    try:
+        rendered = context.render()
+        with timer.stage('llm'):
+            bot_response = llm.get().reply(user_input, detected_emotion_label, rendered)
+        metrics.inc('luma_llm_requests_total', outcome='success' if bot_response else 'empty')
+        if bot_response and response_cache:
+            response_cache.put(user_input, detected_emotion_label, bot_response, rendered)
+        return bot_response
+    except Exception as e:
+        metrics.inc('luma_llm_requests_total', outcome='error')
+        logger.warning("LLM request failed", extra={'error': repr(e)})
+        return ""
+    finally:
+        admission.release_llm()
+
+def fallback_reply(detected_emotion_label):
+    # Local Responses if Gemini fails or returns empty
+    if detected_emotion_label in RESPONSES:
+        return random.choice(RESPONSES[detected_emotion_label])
+    return random.choice(DEFAULT_RESPONSES)
+
+def load_context(state):
+    # Bounded recent turns + summary of older ones (see LUMA_CONTEXT in settings)
+    return make_context(getattr(settings, 'LUMA_CONTEXT', None), state.get('context'))
+
+def record_turn(state, context, user_input, bot_response, detected_emotion_label, prediction, source, timer):
+    with timer.stage('session_save'):
+        context.add_turn('user', user_input, detected_emotion_label)
+        context.add_turn('assistant', bot_response)
+        state.set('context', context.to_dict())
+        state.save()
+    if turn_log:
+        # Queued only; written in batches off the request path
+        with timer.stage('analytics'):
+            turn_log.record(
+                state.conversation_id, detected_emotion_label, source,
+                latency_ms=timer.elapsed() * 1000,
+                scores=prediction['scores'],
+                message_words=len(user_input.split()),
+            )
+    metrics.inc('luma_replies_total', source=source)
+    timer.commit(metrics)
+    request_log.info("reply", extra={
+        'conversation_id': state.conversation_id,
+        'emotion': detected_emotion_label,
+        'source': source,
+        'model_version': prediction.get('model_version'),
+        'user_input': user_input,
+        'reply': bot_response,
+        'timings': timer.server_timing(),
+    })
+
 def get_response(request):
     if request.method == 'POST':
         user_input = request.POST.get('message')
-        
+        timer = StageTimer()
+
         try:
-            # Predict Emotion using ML Model
-            detected_emotion_label = "Unknown"
-            detected_emotion_id = -1
-            
-            if emotion_model:
-                detected_emotion_id = emotion_model.predict(user_input)
-                # detected_emotion_id is already an integer (0-5)
-                detected_emotion_label = EMOTION_MAP.get(detected_emotion_id, "Unknown")
+            with timer.stage('session_load'):
+                state = ConversationState.for_request(request)
+                context = load_context(state)
+            decision, _ = admission.check(client_keys(request, state))
+            version = current_model()
+            detected_emotion_label, prediction = detect_emotion(state, user_input, timer, version)
 
-            # --- CONTEXT & SAFETY LOGIC START ---
-            
-            # 1. Retrieve previous emotion from session
-            last_emotion = request.session.get('last_emotion', None)
-
-            # 2. Negative Keyword Safety Net (Overrides ML)
-            negative_keywords = ['demote', 'fire', 'hate', 'stupid', 'idiot', 'kill', 'die', 'angry', 'furious', 'mad', 'boss', 'bad', 'terrible', 'hit', 'punch', 'hurt', 'hell', 'damn', 'wtf']
-            if any(keyword in user_input.lower() for keyword in negative_keywords):
-                if detected_emotion_label in ['Joy', 'Love', 'Surprise']:
-                    detected_emotion_label = 'Anger' # Force Anger for negative keywords
-
-            # 3. Question/Neutral Safety Net (Overrides Joy/Surprise for short questions)
-            question_keywords = ['what', 'how', 'why', 'when', 'where', 'who', '?']
-            is_question = any(k in user_input.lower() for k in question_keywords)
-            is_short = len(user_input.split()) < 8
-            
-            if (is_question or is_short) and detected_emotion_label in ['Joy', 'Surprise']:
-                # If we were previously talking about something negative, assume we still are
-                if last_emotion in ['Anger', 'Sadness', 'Fear']:
-                    detected_emotion_label = last_emotion
-                else:
-                    # Otherwise, treat as Neutral (force fallback)
-                    detected_emotion_label = 'Neutral'
-
-            # 4. Save current emotion to session for next turn
-            if detected_emotion_label != 'Neutral':
-                 request.session['last_emotion'] = detected_emotion_label
+            # Serve a vetted, cached or template reply when one will do, otherwise try
+            # Gemini; rate-limited requests go straight to the local replies
+            bot_response, source = "", None
+            if decision == ADMITTED:
+                bot_response, source = instant_reply(user_input, detected_emotion_label, prediction, timer, version)
+                if not bot_response:
+                    source = 'llm'
+                    bot_response = llm_reply(user_input, detected_emotion_label, context, timer)
+
+            if not bot_response:
+                source = 'fallback'
+                bot_response = fallback_reply(detected_emotion_label)
+
+            record_turn(state, context, user_input, bot_response, detected_emotion_label, prediction, source, timer)
+            response = JsonResponse({'response': bot_response, 'emotion': detected_emotion_label})
+            response['Server-Timing'] = timer.server_timing()
+            response['X-Reply-Source'] = source
+            if prediction['model_version']:
+                response['X-Model-Version'] = prediction['model_version']
+            return response
             
-            # --- CONTEXT & SAFETY LOGIC END ---
+        except Exception:
+            logger.exception("Error processing request")
+            return JsonResponse({'response': "I'm having trouble processing that right now. Can we try again?", 'emotion': 'Neutral'})
+
+    return JsonResponse({'response': 'Invalid request', 'emotion': 'Neutral'})
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+class ReplyStream:
+    # The Server-Sent Events of one streamed reply: "meta" with the emotion,
+    # "data" events with {"token": ...} as the LLM produces text, then
+    # "done" with the full reply and its source (X-Reply-Source of
+    # get_response, which is only known by then); the turn is recorded when
+    # the stream ends.
+    # aevents() streams from the async gateway (ASGI); events() from the
+    # blocking one, as WSGI servers can only send a synchronous iterator.
+    def __init__(self, state, context, user_input, label, prediction, decision, reply, source, timer):
+        self.state = state
+        self.context = context
+        self.user_input = user_input
+        self.label = label
+        self.prediction = prediction
+        self.decision = decision
+        self.reply = reply
+        self.source = source
+        self.timer = timer
+        self.streamed = False
+        self.parts = []
+        self.rendered = ""
+        self.llm_started = None
+
+    def _meta(self):
+        return sse_event({'emotion': self.label, 'model_version': self.prediction['model_version']}, event='meta')
+
+    def _start_llm(self):
+        # True when the reply is to come from the LLM; pair with _end_llm()
+        if self.reply or self.decision != ADMITTED or not admission.acquire_llm():
+            return False
+        self.source = 'llm'
+        self.rendered = self.context.render()
+        self.llm_started = time.perf_counter()
+        return True
+
+    def _token(self, chunk):
+        if not self.parts:
+            self.timer.add('llm_first_token', time.perf_counter() - self.llm_started)
+        self.parts.append(chunk)
+        self.streamed = True
+        return sse_event({'token': chunk})
+
+    def _llm_done(self, error=None):
+        self.reply = ''.join(self.parts)
+        if error is not None:
+            metrics.inc('luma_llm_requests_total', outcome='error')
+            logger.warning("LLM request failed", extra={'error': repr(error)})
+            return
+        metrics.inc('luma_llm_requests_total', outcome='success' if self.reply else 'empty')
+        if self.reply and response_cache:
+            response_cache.put(self.user_input, self.label, self.reply, self.rendered)
+
+    def _end_llm(self):
+        admission.release_llm()
+        self.timer.add('llm', time.perf_counter() - self.llm_started)
+
+    def _finish(self):
+        if not self.reply:
+            self.source = 'fallback'
+            self.reply = fallback_reply(self.label)
+            self.streamed = False
+        if not self.streamed:
+            yield sse_event({'token': self.reply})
+        yield sse_event({'response': self.reply, 'emotion': self.label, 'source': self.source}, event='done')
+
+    def _record(self):
+        try:
+            record_turn(self.state, self.context, self.user_input, self.reply, self.label,
+                        self.prediction, self.source, self.timer)
+        except Exception:
+            logger.exception("Error saving conversation state")
 
-            # Try Gemini API First
-            bot_response = ""
+    def events(self):
+        yield self._meta()
+        if self._start_llm():
             try:
-                # Using gemini-1.5-flash for better stability/quota
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                prompt = (
-                    f"You are a compassionate mental health companion. "
-                    f"The user says: '{user_input}'. "
-                    f"My internal emotion detection model has identified the user's emotion as '{detected_emotion_label}'. "
-                    f"However, please analyze the text yourself. If the text clearly conveys a different emotion "
-                    f"(especially negative ones like anger or sadness) that contradicts the internal label, "
-                    f"prioritize your own analysis and provide a supportive, empathetic response (max 2-3 sentences) "
-                    f"appropriate for the actual emotion."
-                )
-                response = model.generate_content(prompt)
-                if response and response.text:
-                    bot_response = response.text
-                    print(f"Gemini Response Generated: {bot_response}")
+                for chunk in llm.get().stream_reply(self.user_input, self.label, self.rendered):
+                    yield self._token(chunk)
             except Exception as e:
-                print(f"Gemini API Error: {e}")
-                bot_response = ""
+                self._llm_done(e)
+            else:
+                self._llm_done()
+            finally:
+                self._end_llm()
+        yield from self._finish()
+        self._record()
 
-            # Fallback to Local Responses if Gemini fails or returns empty
-            if not bot_response:
-                if detected_emotion_label in RESPONSES:
-                    bot_response = random.choice(RESPONSES[detected_emotion_label])
-                else:
-                    bot_response = random.choice(DEFAULT_RESPONSES)
+    async def aevents(self):
+        yield self._meta()
+        if self._start_llm():
+            try:
+                gateway = await sync_to_async(llm.get)()
+                async for chunk in gateway.astream_reply(self.user_input, self.label, self.rendered):
+                    yield self._token(chunk)
+            except Exception as e:
+                self._llm_done(e)
+            else:
+                await sync_to_async(self._llm_done)()
+            finally:
+                self._end_llm()
+        for event in self._finish():
+            yield event
+        await sync_to_async(self._record)()
 
-            return JsonResponse({'response': bot_response, 'emotion': detected_emotion_label})
-            
+async def stream_response(request):
+    # Streaming variant of get_response (see ReplyStream). Under ASGI the
+    # worker is free while waiting on Gemini; under WSGI it is held for the
+    # reply, as with get_response, but tokens still go out as they arrive.
+    if request.method != 'POST':
+        return JsonResponse({'response': 'Invalid request', 'emotion': 'Neutral'})
+
+    user_input = request.POST.get('message') or ''
+    timer = StageTimer()
+    try:
+        with timer.stage('session_load'):
+            state = await sync_to_async(ConversationState.for_request)(request)
+            context = load_context(state)
+        decision, _ = await sync_to_async(admission.check)(client_keys(request, state))
+        version = await sync_to_async(current_model)()
+        detected_emotion_label, prediction = await sync_to_async(detect_emotion)(state, user_input, timer, version)
+        bot_response, source = "", None
+        if decision == ADMITTED:
+            bot_response, source = await sync_to_async(instant_reply)(user_input, detected_emotion_label, prediction, timer, version)
+    except Exception:
+        logger.exception("Error processing request")
+        return JsonResponse({'response': "I'm having trouble processing that right now. Can we try again?", 'emotion': 'Neutral'})
+
+    stream = ReplyStream(state, context, user_input, detected_emotion_label, prediction,
+                         decision, bot_response, source, timer)
+    events = stream.aevents() if isinstance(request, ASGIRequest) else stream.events()
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    # Headers go out before the reply is generated, so only the stages up
+    # to here are in Server-Timing; the LLM stages are in /metrics
+    response['Server-Timing'] = timer.server_timing()
+    if prediction['model_version']:
+        response['X-Model-Version'] = prediction['model_version']
+    return response
+
+def _stats_since(request, default_days=7):
+    try:
+        days = max(1, min(int(request.GET.get('days', default_days)), 366))
+    except ValueError:
+        days = default_days
+    return timezone.now() - timedelta(days=days)
+
+@staff_member_required
+def emotion_stats(request):
+    # Emotion distribution over time from the hourly rollups:
+    # /stats/emotions/?days=7&bucket=day|hour
+    since = _stats_since(request)
+    bucket = 'hour' if request.GET.get('bucket') == 'hour' else 'day'
+    rows = EmotionRollup.objects.filter(bucket__gte=since)
+    if bucket == 'day':
+        rows = rows.annotate(time=TruncDay('bucket'))
+    else:
+        rows = rows.annotate(time=F('bucket'))
+    rows = rows.values('time', 'emotion').annotate(turns=Sum('count')).order_by('time')
+
+    series = {}
+    totals = {}
+    for row in rows:
+        series.setdefault(row['time'].isoformat(), {})[row['emotion']] = row['turns']
+        totals[row['emotion']] = totals.get(row['emotion'], 0) + row['turns']
+    return JsonResponse({
+        'since': since.isoformat(),
+        'bucket': bucket,
+        'series': [{'time': t, 'counts': counts} for t, counts in series.items()],
+        'totals': totals,
+    })
+
+@staff_member_required
+def source_stats(request):
+    # Where replies came from (vetted, cache, template, LLM, fallback) with mean
+    # latency and the cache hit rate: /stats/sources/?days=7
+    since = _stats_since(request)
+    rows = (EmotionRollup.objects.filter(bucket__gte=since).values('source')
+            .annotate(turns=Sum('count'), latency=Sum('latency_ms_total')))
+    total = sum(row['turns'] for row in rows)
+    sources = {
+        row['source']: {
+            'turns': row['turns'],
+            'share': round(row['turns'] / total, 4) if total else 0.0,
+            'mean_latency_ms': round(row['latency'] / row['turns'], 2) if row['turns'] else 0.0,
+        }
+        for row in rows
+    }
+    hits = sum(sources.get(s, {}).get('turns', 0) for s in ('retrieval', 'cache'))
+    return JsonResponse({
+        'since': since.isoformat(),
+        'turns': total,
+        'cache_hit_rate': round(hits / total, 4) if total else 0.0,
+        'bypass_rate': round(sources.get('template', {}).get('turns', 0) / total, 4) if total else 0.0,
+        'sources': sources,
+    })
+
+def _collect_metrics():
+    # Counters kept by the shared components themselves, read at scrape time
+    samples = []
+    if response_cache:
+        samples.append(('luma_response_cache_lookups_total', 'counter', {'result': 'hit'}, response_cache.hits))
+        samples.append(('luma_response_cache_lookups_total', 'counter', {'result': 'miss'}, response_cache.misses))
+    registry = model_registry.get() if model_registry.loaded else None
+    version = registry.current if registry else None
+    index = version.cached('reply_index') if version else None
+    if version:
+        samples.append(('luma_model_info', 'gauge', {'version': version.version}, 1))
+        for result, count in sorted(registry.reloads.items()):
+            samples.append(('luma_model_reloads_total', 'counter', {'result': result}, count))
+    if index:
+        samples.append(('luma_retrieval_lookups_total', 'counter', {'result': 'hit'}, index.hits))
+        samples.append(('luma_retrieval_lookups_total', 'counter', {'result': 'miss'}, index.misses))
+    if llm.loaded and llm.get():
+        gateway = llm.get()
+        samples.append(('luma_llm_upstream_calls_total', 'counter', {}, gateway.calls))
+        samples.append(('luma_llm_coalesced_total', 'counter', {}, gateway.coalesced))
+        breaker = gateway.caller.breaker
+        for state in (breaker.CLOSED, breaker.OPEN, breaker.HALF_OPEN):
+            samples.append(('luma_llm_breaker_state', 'gauge', {'state': state}, int(breaker.state == state)))
+    samples.append(('luma_bypass_rate', 'gauge', {}, round(bypass_policy.bypass_rate, 4)))
+    for (decision, kind), count in sorted(admission.results.items()):
+        labels = {'decision': decision, 'limit': kind} if kind else {'decision': decision}
+        samples.append(('luma_admission_total', 'counter', labels, count))
+    samples.append(('luma_llm_in_flight', 'gauge', {}, admission.llm.in_flight))
+    if turn_log:
+        samples.append(('luma_analytics_turns_total', 'counter', {'result': 'written'}, turn_log.written))
+        samples.append(('luma_analytics_turns_total', 'counter', {'result': 'dropped'}, turn_log.dropped))
+        samples.append(('luma_analytics_turns_total', 'counter', {'result': 'failed'}, turn_log.failed))
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, AsyncJsonHandler):
+            samples.append(('luma_log_records_dropped_total', 'counter', {}, handler.dropped))
+    return samples
+
+metrics.add_collector(_collect_metrics)
+
+@staff_member_required
+def model_admin(request):
+    # Active and previous model versions. POST action=reload (optionally
+    # with path=...) to load, validate and swap in a new version, or
+    # action=rollback to go back one; applied in this process at once and
+    # picked up by the other workers on their next poll
+    registry = model_registry.get()
+    if registry is None:
+        raise Http404("No model loaded")
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action not in ('reload', 'rollback'):
+            return JsonResponse({'error': "action must be 'reload' or 'rollback'"}, status=400)
+        try:
+            if action == 'reload':
+                registry.load(request.POST.get('path') or None)
+            else:
+                registry.rollback()
+            registry.publish()
         except Exception as e:
-            print(f"Error processing request: {e}")
-            return JsonResponse({'response': "I'm having trouble processing that right now. Can we try again?", 'emotion': 'Neutral'})
+            return JsonResponse(dict(registry.status(), error=str(e)), status=409)
+    return JsonResponse(registry.status())
 
-    return JsonResponse({'response': 'Invalid request', 'emotion': 'Neutral'})
+def metrics_view(request):
+    # Prometheus text format, per process (see LUMA_METRICS in settings)
+    config = getattr(settings, 'LUMA_METRICS', {})
+    if not config.get('ENABLED', True):
+        raise Http404("Metrics are disabled")
+    token = config.get('TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponseForbidden("Invalid metrics token")
+    return HttpResponse(metrics.render(), content_type=METRICS_CONTENT_TYPE)
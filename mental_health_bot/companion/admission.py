@@ -0,0 +1,185 @@
+import math
+import threading
+import time
+
+# Admission control in front of the LLM. Each client (conversation and IP
+# address) has a token bucket refilled at RATE requests per second up to
+# BURST, and at most MAX_CONCURRENT_LLM calls are in flight. Requests over
+# either limit are not queued: the caller answers them at once from the
+# local replies, so one busy client can't exhaust the Gemini quota or tie up
+# every worker while others wait.
+#
+# With a store shared by the worker processes (SHARED, e.g. Redis) the
+# buckets and the in-flight count are site-wide, the count kept with atomic
+# incr/decr. Without one both are per process: a client may get up to
+# WORKERS times its bucket, and the LLM cap is split between the WORKERS
+# processes, so a sync worker (one request at a time) can never reach it.
+
+ADMITTED = 'admitted'
+RATE_LIMITED = 'rate_limited'
+AT_CAPACITY = 'at_capacity'
+
+
+class MemoryStore:
+    # Minimal stand-in for a Django cache (get/set with a timeout), used
+    # when no cache is configured, e.g. in the Streamlit app
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + (timeout or 3600), value)
+
+
+class TokenBucket:
+    # Buckets live in `store` as (tokens, updated_at). Reads and writes are
+    # serialised per process; with a cache shared between processes the
+    # limit is approximate, which is fine for shedding load.
+    def __init__(self, rate, burst, store=None, prefix='luma:bucket'):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.store = store if store is not None else MemoryStore()
+        self.prefix = prefix
+        # Idle buckets are full again after burst / rate seconds
+        self.ttl = int(self.burst / self.rate) + 1 if self.rate > 0 else None
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        now = time.time() if now is None else now
+        cache_key = f"{self.prefix}:{key}"
+        with self._lock:
+            tokens, updated_at = self.store.get(cache_key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self.store.set(cache_key, (tokens, now), self.ttl)
+        return allowed
+
+
+class ConcurrencyLimiter:
+    # Non-blocking counting semaphore: acquire() returns False at capacity
+    # instead of waiting. With a shared store (a Django cache with atomic
+    # incr/decr, such as Redis) the count is kept there, across processes;
+    # in_flight is always this process's share. The shared count expires
+    # `lease` seconds after it was started, so slots held by a worker that
+    # died are not lost for good.
+    def __init__(self, limit, store=None, key='luma:llm:in_flight', lease=300):
+        self.limit = limit
+        self.store = store
+        self.key = key
+        self.lease = lease
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _incr(self):
+        try:
+            return self.store.incr(self.key)
+        except ValueError:
+            # No count yet (or it expired): start one, unless another
+            # process just did
+            if self.store.add(self.key, 1, self.lease):
+                return 1
+            return self.store.incr(self.key)
+
+    def _decr(self):
+        try:
+            self.store.decr(self.key)
+        except ValueError:
+            pass  # expired meanwhile
+
+    def acquire(self):
+        if self.limit is not None and self.store is not None:
+            if self._incr() > self.limit:
+                self._decr()
+                return False
+            with self._lock:
+                self.in_flight += 1
+            return True
+        with self._lock:
+            if self.limit is not None and self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            if self.in_flight == 0:
+                return
+            self.in_flight -= 1
+        if self.limit is not None and self.store is not None:
+            self._decr()
+
+
+class Admission:
+    def __init__(self, buckets=(), llm_limit=None, enabled=True, llm_store=None):
+        self.enabled = enabled
+        self.buckets = dict(buckets)  # kind ('session', 'ip') -> TokenBucket
+        self.llm = ConcurrencyLimiter(llm_limit, llm_store)
+        self.results = {}  # (decision, kind) -> count
+        self._lock = threading.Lock()
+
+    def _count(self, decision, kind):
+        with self._lock:
+            self.results[(decision, kind)] = self.results.get((decision, kind), 0) + 1
+
+    def check(self, keys):
+        # keys: {kind: client key}, e.g. {'session': id, 'ip': addr}. Returns
+        # (decision, kind) where kind is the bucket that ran out, if any
+        if self.enabled:
+            for kind, key in keys.items():
+                bucket = self.buckets.get(kind)
+                if bucket and key and not bucket.take(key):
+                    self._count(RATE_LIMITED, kind)
+                    return RATE_LIMITED, kind
+        self._count(ADMITTED, '')
+        return ADMITTED, ''
+
+    def acquire_llm(self):
+        # Pair every successful call with release_llm()
+        if not self.enabled or self.llm.acquire():
+            return True
+        self._count(AT_CAPACITY, 'llm')
+        return False
+
+    def release_llm(self):
+        if self.enabled:
+            self.llm.release()
+
+
+def make_admission(config=None, store=None):
+    # config: {'ENABLED', 'SESSION_RATE', 'SESSION_BURST', 'IP_RATE',
+    #          'IP_BURST', 'MAX_CONCURRENT_LLM', 'SHARED', 'WORKERS'}; a rate
+    # of None disables that bucket, MAX_CONCURRENT_LLM None disables the
+    # cap. With SHARED the store (which must then support add/incr/decr) is
+    # used by every worker; otherwise each of the WORKERS processes gets its
+    # share of MAX_CONCURRENT_LLM and its own buckets.
+    config = config or {}
+    store = store if store is not None else MemoryStore()
+    shared = bool(config.get('SHARED'))
+    workers = 1 if shared else max(1, int(config.get('WORKERS') or 1))
+    buckets = {}
+    for kind in ('session', 'ip'):
+        rate = config.get(f'{kind.upper()}_RATE')
+        if rate:
+            burst = config.get(f'{kind.upper()}_BURST') or max(1, rate)
+            buckets[kind] = TokenBucket(rate, burst, store, prefix=f'luma:bucket:{kind}')
+    llm_limit = config.get('MAX_CONCURRENT_LLM')
+    if llm_limit is not None:
+        llm_limit = max(1, math.ceil(llm_limit / workers))
+    return Admission(buckets, llm_limit, enabled=config.get('ENABLED', True),
+                     llm_store=store if shared else None)
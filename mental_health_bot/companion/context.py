@@ -0,0 +1,114 @@
+import re
+
+# Bounded conversation context for the LLM prompt: a rolling window of the
+# most recent turns plus a compact summary of everything older, kept under
+# a fixed token budget so the prompt (and LLM latency/cost) stays flat no
+# matter how long the conversation runs. Turns that fall out of the window
+# are folded into the summary one at a time, without another LLM call.
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English; cheap and good enough for budgeting
+    return (len(text) + 3) // 4
+
+
+def _gist(text, max_words=12):
+    # First sentence, clipped: what an older user turn was about
+    first = _SENTENCE_END.split(text.strip(), 1)[0]
+    words = first.split()
+    return ' '.join(words[:max_words]) + ('...' if len(words) > max_words else '')
+
+
+class ConversationContext:
+    def __init__(self, max_tokens=600, summary_tokens=150, turns=None, gists=None, emotions=None, folded=0):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.turns = list(turns or [])        # [{'role', 'text', 'emotion'}], oldest first
+        self.gists = list(gists or [])        # short notes on folded user turns, oldest first
+        self.emotions = dict(emotions or {})  # emotion -> count over folded turns
+        self.folded = folded                  # number of turns folded into the summary
+
+    def add_turn(self, role, text, emotion=None):
+        # A single very long message is clipped so it can't blow the budget alone
+        limit = max(self.max_tokens - self.summary_tokens, 1) * 4
+        if len(text) > limit:
+            text = text[:limit] + '...'
+        self.turns.append({'role': role, 'text': text, 'emotion': emotion})
+        self._compact()
+
+    def _turn_tokens(self, turn):
+        return estimate_tokens(turn['text']) + 2
+
+    def _compact(self):
+        # Fold the oldest turns until window + summary fit the budget; the
+        # latest turn always stays verbatim
+        window = sum(self._turn_tokens(t) for t in self.turns)
+        while len(self.turns) > 1 and window + estimate_tokens(self.summary()) > self.max_tokens:
+            turn = self.turns.pop(0)
+            window -= self._turn_tokens(turn)
+            self._fold(turn)
+
+    def _fold(self, turn):
+        self.folded += 1
+        if turn['role'] != 'user':
+            return
+        if turn.get('emotion'):
+            self.emotions[turn['emotion']] = self.emotions.get(turn['emotion'], 0) + 1
+        self.gists.append(_gist(turn['text']))
+        # Oldest notes go first when the summary outgrows its share
+        while len(self.gists) > 1 and estimate_tokens(self.summary()) > self.summary_tokens:
+            self.gists.pop(0)
+
+    def summary(self):
+        if not self.folded:
+            return ""
+        parts = [f"{self.folded} earlier messages."]
+        if self.emotions:
+            moods = ', '.join(f"{e} x{n}" for e, n in sorted(self.emotions.items(), key=lambda kv: -kv[1]))
+            parts.append(f"User's mood so far: {moods}.")
+        if self.gists:
+            parts.append("User mentioned: " + '; '.join(f'"{g}"' for g in self.gists) + '.')
+        return ' '.join(parts)
+
+    def render(self):
+        # Text block for the prompt; empty for a new conversation
+        lines = []
+        summary = self.summary()
+        if summary:
+            lines.append(f"Summary of earlier conversation: {summary}")
+        for turn in self.turns:
+            speaker = 'User' if turn['role'] == 'user' else 'Luma'
+            lines.append(f"{speaker}: {turn['text']}")
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        return {
+            'turns': self.turns,
+            'gists': self.gists,
+            'emotions': self.emotions,
+            'folded': self.folded,
+        }
+
+    @classmethod
+    def from_dict(cls, data, max_tokens=600, summary_tokens=150):
+        data = data or {}
+        context = cls(
+            max_tokens, summary_tokens,
+            turns=data.get('turns'), gists=data.get('gists'),
+            emotions=data.get('emotions'), folded=data.get('folded', 0),
+        )
+        # Re-apply in case the budget was lowered since the state was stored
+        context._compact()
+        return context
+
+
+def make_context(config=None, data=None):
+    # config: {'MAX_TOKENS': int, 'SUMMARY_TOKENS': int}; data: a to_dict() snapshot
+    config = config or {}
+    return ConversationContext.from_dict(
+        data,
+        max_tokens=config.get('MAX_TOKENS', 600),
+        summary_tokens=config.get('SUMMARY_TOKENS', 150),
+    )
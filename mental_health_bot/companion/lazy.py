@@ -0,0 +1,31 @@
+import threading
+
+# Thread-safe build-on-first-use holder. Heavy objects (the emotion model,
+# the LLM client) are created by the first request that needs them rather
+# than at import, so cold starts that only serve the chat page never pay
+# for them.
+
+
+class Lazy:
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+    def reset(self):
+        with self._lock:
+            self._value = None
+            self._loaded = False
@@ -0,0 +1,268 @@
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from .resilience import CircuitOpenError, DeadlineExceeded, make_caller
+
+# Single entry point to the LLM for both frontends: one long-lived backend
+# client per process, the shared prompt, the deadline/breaker policy from
+# resilience.py, and coalescing of identical in-flight prompts so concurrent
+# duplicate requests share one upstream call.
+
+DEFAULT_MODEL = 'gemini-1.5-flash'
+
+
+def build_prompt(user_input, emotion, context=""):
+    # context: rendered ConversationContext (recent turns + summary), if any
+    history = f"Conversation so far:\n{context}\n\n" if context else ""
+    return (
+        f"You are a compassionate mental health companion named Luma. "
+        f"{history}"
+        f"The user now says: '{user_input}'. "
+        f"My internal emotion detection model has identified the user's emotion as '{emotion}'. "
+        f"However, please analyze the text yourself. If the text clearly conveys a different emotion "
+        f"(especially negative ones like anger or sadness) that contradicts the internal label, "
+        f"prioritize your own analysis and provide a supportive, empathetic response (max 2-3 sentences) "
+        f"appropriate for the actual emotion. Do not explicitly mention the internal label."
+    )
+
+
+class LLMBackend:
+    # Interface every backend implements
+    name = 'base'
+
+    def generate(self, prompt, timeout=None):
+        raise NotImplementedError
+
+    def stream(self, prompt, timeout=None):
+        # Blocking iterator of text chunks (WSGI); backends without native
+        # streaming yield the whole completion as one chunk
+        yield self.generate(prompt, timeout)
+
+    async def astream(self, prompt, timeout=None):
+        # Async iterator of text chunks (ASGI)
+        yield await asyncio.to_thread(self.generate, prompt, timeout)
+
+
+class GeminiBackend(LLMBackend):
+    name = 'gemini'
+
+    def __init__(self, model_name=DEFAULT_MODEL, api_key=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        # Kept for the life of the process so its client/channel is reused
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, timeout=None):
+        request_options = {'timeout': timeout} if timeout else None
+        return self.model.generate_content(prompt, request_options=request_options).text
+
+    def stream(self, prompt, timeout=None):
+        request_options = {'timeout': timeout} if timeout else None
+        for chunk in self.model.generate_content(prompt, stream=True, request_options=request_options):
+            if chunk.text:
+                yield chunk.text
+
+    async def astream(self, prompt, timeout=None):
+        request_options = {'timeout': timeout} if timeout else None
+        response = await self.model.generate_content_async(prompt, stream=True, request_options=request_options)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend(LLMBackend):
+    # Local stand-in for tests, offline runs and load tests; never leaves
+    # the process. By default it answers at once. For load tests it can
+    # behave like the real API: log-normal latency with the given median
+    # and p95, a share of failed calls, and streaming at chunk_ms per word
+    # after the first token.
+    name = 'fake'
+
+    def __init__(self, reply="I'm here with you. Tell me more about how you're feeling.",
+                 median_ms=0.0, p95_ms=None, error_rate=0.0, chunk_ms=0.0, seed=None):
+        self.reply = reply
+        self.median = median_ms / 1000
+        # p95 of a log-normal is median * exp(1.645 * sigma)
+        self.sigma = math.log(p95_ms / median_ms) / 1.645 if median_ms and p95_ms and p95_ms > median_ms else 0.0
+        self.error_rate = error_rate
+        self.chunk = chunk_ms / 1000
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        # (latency in seconds, whether the call fails)
+        with self._lock:
+            latency = self.median * math.exp(self._random.gauss(0.0, self.sigma)) if self.median else 0.0
+            return latency, self._random.random() < self.error_rate
+
+    def _wait(self, latency, timeout):
+        # Like a real client, give up at the timeout instead of lingering
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake LLM took longer than {timeout:.1f}s")
+        if latency:
+            time.sleep(latency)
+
+    def generate(self, prompt, timeout=None):
+        latency, fails = self._sample()
+        self._wait(latency, timeout)
+        if fails:
+            raise RuntimeError("Fake LLM error")
+        return self.reply
+
+    def stream(self, prompt, timeout=None):
+        latency, fails = self._sample()
+        self._wait(latency, timeout)
+        if fails:
+            raise RuntimeError("Fake LLM error")
+        for i, word in enumerate(self.reply.split(' ')):
+            if i and self.chunk:
+                time.sleep(self.chunk)
+            yield word if i == 0 else ' ' + word
+
+    async def astream(self, prompt, timeout=None):
+        latency, fails = self._sample()
+        if latency:
+            await asyncio.sleep(latency)
+        if fails:
+            raise RuntimeError("Fake LLM error")
+        for i, word in enumerate(self.reply.split(' ')):
+            if i and self.chunk:
+                await asyncio.sleep(self.chunk)
+            yield word if i == 0 else ' ' + word
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'fake': FakeBackend,
+}
+
+
+class LLMGateway:
+    def __init__(self, backend, caller=None):
+        self.backend = backend
+        self.caller = caller if caller is not None else make_caller()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def generate(self, prompt):
+        # Identical prompts already in flight wait on the leader's result
+        # (or exception) instead of issuing their own upstream call
+        with self._lock:
+            future = self._inflight.get(prompt)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[prompt] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(timeout=self.caller.deadline)
+
+        try:
+            text = self.caller.call(lambda: self.backend.generate(prompt, timeout=self.caller.deadline))
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(text)
+            return text
+        finally:
+            with self._lock:
+                self._inflight.pop(prompt, None)
+
+    def reply(self, user_input, emotion, context=""):
+        return self.generate(build_prompt(user_input, emotion, context))
+
+    async def astream(self, prompt):
+        # Streams text chunks as they arrive. The deadline applies to the
+        # gap before each chunk (so time-to-first-token is bounded) and the
+        # breaker sees the outcome of the whole stream. Not coalesced:
+        # every stream belongs to one client connection.
+        breaker = self.caller.breaker
+        if not breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline = self.caller.deadline
+        chunks = self.backend.astream(prompt, timeout=deadline).__aiter__()
+        with self._lock:
+            self.calls += 1
+        received = False
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded(f"No LLM output within {deadline:.1f}s")
+                received = True
+                yield chunk
+        except GeneratorExit:
+            # Client went away mid-stream; upstream was fine if it had
+            # produced anything
+            if received:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+
+    def astream_reply(self, user_input, emotion, context=""):
+        return self.astream(build_prompt(user_input, emotion, context))
+
+    def stream(self, prompt):
+        # Blocking counterpart of astream() for WSGI servers. The deadline
+        # is passed to the backend as its request timeout, as for
+        # generate(); breaker bookkeeping is the same.
+        breaker = self.caller.breaker
+        if not breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        with self._lock:
+            self.calls += 1
+        received = False
+        try:
+            for chunk in self.backend.stream(prompt, timeout=self.caller.deadline):
+                received = True
+                yield chunk
+        except GeneratorExit:
+            if received:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+
+    def stream_reply(self, user_input, emotion, context=""):
+        return self.stream(build_prompt(user_input, emotion, context))
+
+
+def make_gateway(config=None):
+    # config: {'BACKEND': 'gemini' | 'fake', 'MODEL': name, 'FAKE': {...}
+    #          (FakeBackend keyword arguments), plus the resilience keys
+    #          read by make_caller()}
+    config = config or {}
+    kind = config.get('BACKEND', 'gemini')
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{kind}', expected one of {sorted(BACKENDS)}")
+    if kind == 'gemini':
+        backend = GeminiBackend(config.get('MODEL', DEFAULT_MODEL), config.get('API_KEY'))
+    else:
+        backend = BACKENDS[kind](**{k.lower(): v for k, v in (config.get('FAKE') or {}).items()})
+    return LLMGateway(backend, make_caller(config))
@@ -0,0 +1,143 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# Structured logging shared by both frontends. Records are put on an
+# in-memory queue by the request thread and formatted/written as one JSON
+# object per line by a background QueueListener, so a slow log pipe never
+# adds to reply latency (when the queue is full, records are dropped and
+# counted instead of blocking). User text must only be passed in extra
+# fields (user_input=..., reply=...), never in the message itself: those
+# fields are redacted to their length before anything is written, and
+# chatty loggers can be sampled.
+
+REDACTED_FIELDS = ('user_input', 'reply', 'prompt', 'text')
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def redact(value, mode='length'):
+    if value is None or mode == 'none':
+        return value
+    if mode == 'drop':
+        return '[redacted]'
+    return f"[redacted {len(str(value))} chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact_fields=REDACTED_FIELDS, redact_mode='length'):
+        super().__init__()
+        self.redact_fields = set(redact_fields)
+        self.redact_mode = redact_mode
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRS or key.startswith('_'):
+                continue
+            if key in self.redact_fields:
+                value = redact(value, self.redact_mode)
+            entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # rates: {logger name prefix: fraction of records kept}; WARNING and
+    # above are always kept
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda kv: -len(kv[0]))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return random.random() < rate
+        return True
+
+
+class AsyncJsonHandler(QueueHandler):
+    def __init__(self, stream=None, max_queue=10000, redact_mode='length', redact_fields=REDACTED_FIELDS):
+        super().__init__(queue.Queue(maxsize=max_queue))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.target.setFormatter(JsonFormatter(redact_fields, redact_mode))
+        self.max_queue = max_queue
+        self.listener = None
+        self._pid = None
+        self.dropped = 0
+        atexit.register(self.stop)
+
+    def _ensure_listener(self):
+        # Started lazily and again after fork: the listener thread doesn't
+        # survive into gunicorn workers forked from a preloaded master
+        if self._pid == os.getpid():
+            return
+        self.acquire()
+        try:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.queue = queue.Queue(maxsize=self.max_queue)
+                self.listener = QueueListener(self.queue, self.target)
+                self.listener.start()
+        finally:
+            self.release()
+
+    def prepare(self, record):
+        # Only merge args on the request thread; JSON encoding and traceback
+        # formatting happen in the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+
+def logging_config(level='INFO', sample_rates=None, redact_mode='length', max_queue=10000):
+    # dictConfig for Django's LOGGING setting and for the Streamlit app
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'filters': {
+            'sampling': {'()': SamplingFilter, 'rates': sample_rates or {}},
+        },
+        'handlers': {
+            'json': {
+                '()': AsyncJsonHandler,
+                'max_queue': max_queue,
+                'redact_mode': redact_mode,
+                'filters': ['sampling'],
+            },
+        },
+        'loggers': {
+            # Django's own loggers go through the same handler, once
+            'django': {'handlers': ['json'], 'level': level, 'propagate': False},
+        },
+        'root': {'handlers': ['json'], 'level': level},
+    }
+
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import deque
+
+# Lightweight in-process metrics shared by both frontends. A StageTimer
+# times the stages of one request (tokenize, predict, safety, llm, ...) and
+# renders them as a Server-Timing header; committing it feeds per-stage
+# summaries (p50/p95/p99 over a sliding window of recent requests, plus sum
+# and count) in a Registry, which also holds counters and renders everything
+# in the Prometheus text format. Values are per process.
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = []  # [(name, seconds)] in the order they ran
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, include_total=True):
+        # "predict;dur=0.41, llm;dur=812.3, total;dur=815.0" (milliseconds)
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages]
+        if include_total:
+            parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ', '.join(parts)
+
+    def commit(self, registry, include_total=True):
+        for name, seconds in self.stages:
+            registry.observe('luma_stage_seconds', seconds, stage=name)
+        if include_total:
+            registry.observe('luma_stage_seconds', self.elapsed(), stage='total')
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Summary:
+    def __init__(self, window=1024):
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.recent.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {q: float('nan') for q in quantiles}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in quantiles}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Registry:
+    def __init__(self, window=1024):
+        self.window = window
+        self._summaries = {}  # (name, labels) -> Summary
+        self._counters = {}   # (name, labels) -> value
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = Summary(self.window)
+            summary.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def quantiles(self, name, **labels):
+        with self._lock:
+            summary = self._summaries.get((name, tuple(sorted(labels.items()))))
+            return summary.quantiles() if summary else None
+
+    def add_collector(self, fn):
+        # fn() -> [(name, type, labels_dict, value)] read at scrape time, for
+        # values other objects already track (cache hits, breaker state, ...)
+        self._collectors.append(fn)
+
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            summaries = sorted(self._summaries.items())
+            counters = sorted(self._counters.items())
+            for (name, labels), summary in summaries:
+                header(name, 'summary')
+                for q, value in summary.quantiles().items():
+                    lines.append(f"{name}{_labels(labels + (('quantile', q),))} {value:.6f}")
+                lines.append(f"{name}_sum{_labels(labels)} {summary.sum:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {summary.count}")
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception:
+                continue
+            for name, kind, labels, value in samples:
+                header(name, kind)
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+registry.describe('luma_stage_seconds', 'Time spent in each stage of a chat reply.')
+registry.describe('luma_replies_total', 'Chat replies by source (retrieval, cache, template, llm, fallback).')
+registry.describe('luma_llm_requests_total', 'LLM requests by outcome (success, empty, error).')
+registry.describe('luma_bypass_decisions_total', 'LLM bypass policy decisions by outcome and reason.')
+registry.describe('luma_model_info', 'Active emotion model version (content hash).')
+registry.describe('luma_model_reloads_total', 'Model hot reloads by result (success, failed, rollback).')
+registry.describe('luma_admission_total', 'Admission control decisions (admitted, rate_limited, at_capacity) by limit.')
+
+
+def serve(registry=registry, port=9100, host='127.0.0.1'):
+    # Minimal /metrics HTTP endpoint on a daemon thread, for frontends that
+    # can't add routes of their own (Streamlit)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='luma-metrics', daemon=True).start()
+    return server
@@ -0,0 +1,68 @@
+import threading
+
+# Decides, per message, whether a local reply is good enough or the LLM is
+# needed. Short messages the classifier is sure about, in a low-risk
+# emotion, are answered from the local templates; anything uncertain,
+# long, negative, flagged by the safety keywords or relabelled by the
+# safety rules goes to the LLM. Thresholds are specific to the model's
+# probability scale (six one-vs-rest classes, so the top class rarely
+# goes much above 0.5): re-tune them with `python -m ml_model.parity`
+# whenever the model changes.
+
+ESCALATE = 'escalate'
+BYPASS = 'bypass'
+
+
+class BypassPolicy:
+    def __init__(self, min_confidence=0.38, min_margin=0.12, max_words=12,
+                 emotions=('Joy', 'Love', 'Surprise'), escalate_flags=('negative', 'crisis', 'question'), enabled=True):
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.max_words = max_words
+        self.emotions = set(emotions)
+        self.escalate_flags = set(escalate_flags)
+        self.decisions = {}  # (decision, reason) -> count
+        self._lock = threading.Lock()
+
+    def decide(self, user_input, emotion, model_emotion, confidence, margin, safety_flags=()):
+        # Returns (decision, reason)
+        if not self.enabled:
+            result = (ESCALATE, 'disabled')
+        elif emotion != model_emotion:
+            result = (ESCALATE, 'rules_override')
+        elif emotion not in self.emotions:
+            result = (ESCALATE, 'emotion')
+        elif self.escalate_flags & set(safety_flags):
+            result = (ESCALATE, 'safety_flag')
+        elif len(user_input.split()) > self.max_words:
+            result = (ESCALATE, 'long')
+        elif confidence < self.min_confidence:
+            result = (ESCALATE, 'low_confidence')
+        elif margin < self.min_margin:
+            result = (ESCALATE, 'low_margin')
+        else:
+            result = (BYPASS, 'confident')
+        with self._lock:
+            self.decisions[result] = self.decisions.get(result, 0) + 1
+        return result
+
+    @property
+    def bypass_rate(self):
+        total = sum(self.decisions.values())
+        bypassed = sum(n for (decision, _), n in self.decisions.items() if decision == BYPASS)
+        return bypassed / total if total else 0.0
+
+
+def make_policy(config=None):
+    # config: {'ENABLED', 'MIN_CONFIDENCE', 'MIN_MARGIN', 'MAX_WORDS',
+    #          'EMOTIONS', 'ESCALATE_FLAGS'}
+    config = config or {}
+    return BypassPolicy(
+        min_confidence=config.get('MIN_CONFIDENCE', 0.38),
+        min_margin=config.get('MIN_MARGIN', 0.12),
+        max_words=config.get('MAX_WORDS', 12),
+        emotions=config.get('EMOTIONS', ('Joy', 'Love', 'Surprise')),
+        escalate_flags=config.get('ESCALATE_FLAGS', ('negative', 'crisis', 'question')),
+        enabled=config.get('ENABLED', True),
+    )
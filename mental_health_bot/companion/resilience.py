@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Guards for the upstream LLM call: a hard per-request deadline, an optional
+# hedged second attempt for tail latency, and a circuit breaker so that
+# during an outage requests go straight to the local fallback instead of
+# each one waiting out the deadline.
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, cooldown=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            # Half-open: let exactly one probe through to test recovery
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self._probing = False
+
+
+class ResilientCaller:
+    def __init__(self, deadline=6.0, hedge_after=None, breaker=None, max_workers=8):
+        self.deadline = deadline
+        # Seconds to wait on the first attempt before firing a second one
+        # (None disables hedging)
+        self.hedge_after = hedge_after
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-call')
+
+    def call(self, fn):
+        # Runs fn() under the deadline/hedging policy. Raises
+        # CircuitOpenError without calling fn while the breaker is open,
+        # DeadlineExceeded on timeout, or whatever fn raised.
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        try:
+            result = self._run(fn)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _run(self, fn):
+        start = time.monotonic()
+        pending = {self._executor.submit(fn)}
+        if self.hedge_after is not None and self.hedge_after < self.deadline:
+            done, _ = wait(pending, timeout=self.hedge_after)
+            if not done:
+                pending.add(self._executor.submit(fn))
+
+        error = None
+        while pending:
+            remaining = self.deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if pending:
+            # Abandoned attempts finish in the background; callers should
+            # also pass the deadline to the client so they don't linger
+            raise DeadlineExceeded(f"LLM call exceeded {self.deadline:.1f}s deadline")
+        raise error
+
+
+def make_caller(config=None):
+    # config: {'DEADLINE': s, 'HEDGE_AFTER': s or None, 'BREAKER_FAILURES': n,
+    #          'BREAKER_COOLDOWN': s, 'MAX_WORKERS': n}
+    config = config or {}
+    return ResilientCaller(
+        deadline=config.get('DEADLINE', 6.0),
+        hedge_after=config.get('HEDGE_AFTER'),
+        breaker=CircuitBreaker(
+            failure_threshold=config.get('BREAKER_FAILURES', 3),
+            cooldown=config.get('BREAKER_COOLDOWN', 30.0),
+        ),
+        max_workers=config.get('MAX_WORKERS', 8),
+    )
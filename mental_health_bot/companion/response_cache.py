@@ -0,0 +1,180 @@
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache of LLM replies keyed on (normalised message, detected emotion).
+# Each key collects several candidate replies before it starts serving hits,
+# and a hit picks one of them at random, so repeated "hi"s don't all get the
+# exact same answer.
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    # "  I'm SAD!! " -> "im sad"
+    text = _NON_WORD.sub('', text.lower())
+    return _SPACES.sub(' ', text).strip()
+
+
+class MemoryBackend:
+    # In-process LRU with a per-entry TTL
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, candidates = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(candidates)
+
+    def set(self, key, candidates):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, list(candidates))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    # On-disk variant, shared by every worker on the host and kept across
+    # restarts. LRU is approximated with an `accessed` column.
+    def __init__(self, path, max_entries=10000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, candidates TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn().execute(
+            "CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT candidates, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            self._conn().execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        self._conn().execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, candidates):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, candidates, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(list(candidates)), now + self.ttl, now),
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+
+    def clear(self):
+        self._conn().execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    def __init__(self, backend=None, candidates=3, max_words=12):
+        self.backend = backend if backend is not None else MemoryBackend()
+        # A key only serves hits once it holds this many distinct replies
+        self.candidates = candidates
+        # Long messages practically never repeat, so they are not cached
+        self.max_words = max_words
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, text, emotion):
+        normalized = normalize_text(text)
+        if not normalized or len(normalized.split()) > self.max_words:
+            return None
+        return f"{emotion}|{normalized}"
+
+    def get(self, text, emotion):
+        key = self.make_key(text, emotion)
+        candidates = self.backend.get(key) if key else None
+        if not candidates or len(candidates) < self.candidates:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return random.choice(candidates)
+
+    def put(self, text, emotion, reply, context=""):
+        # context: the rendered conversation context the reply was written
+        # with. Such replies belong to that conversation (they may repeat
+        # what the user told it), so only context-free ones are shared.
+        key = self.make_key(text, emotion)
+        if not key or not reply or context:
+            return
+        candidates = self.backend.get(key) or []
+        if reply in candidates:
+            return
+        candidates.append(reply)
+        self.backend.set(key, candidates[-self.candidates:])
+
+
+def make_cache(config=None):
+    # config: {'BACKEND': 'memory' | 'sqlite' | 'none', 'PATH': ..., 'MAX_ENTRIES': ...,
+    #          'TTL': seconds, 'CANDIDATES': n, 'MAX_WORDS': n}
+    config = config or {}
+    kind = config.get('BACKEND', 'memory')
+    if kind == 'none':
+        return None
+    if kind == 'sqlite':
+        backend = SQLiteBackend(
+            config.get('PATH', 'response_cache.sqlite3'),
+            max_entries=config.get('MAX_ENTRIES', 10000),
+            ttl=config.get('TTL', 86400),
+        )
+    elif kind == 'memory':
+        backend = MemoryBackend(
+            max_entries=config.get('MAX_ENTRIES', 1000),
+            ttl=config.get('TTL', 3600),
+        )
+    else:
+        raise ValueError(f"Unknown response cache backend '{kind}'")
+    return ResponseCache(
+        backend,
+        candidates=config.get('CANDIDATES', 3),
+        max_words=config.get('MAX_WORDS', 12),
+    )
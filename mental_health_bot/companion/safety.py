@@ -0,0 +1,91 @@
+import re
+
+# Keyword safety nets shared by both frontends. Keywords match whole words
+# ("fire" no longer matches "fireworks"); a trailing '*' makes the last word a
+# prefix ("hurt*" matches "hurting"), and multi-word phrases are allowed.
+# Matching is a single pass over the message's tokens with hash lookups, so
+# its cost depends on the message length, not on how many keywords there are.
+#
+# Messages flagged with an ESCALATION_CATEGORIES category never get a
+# prebuilt reply (vetted, cached or template): they always go to the LLM, or
+# to the local fallback when it is unavailable.
+
+DEFAULT_KEYWORDS = {
+    'negative': [
+        'demote*', 'fire', 'fired', 'firing', 'hate*', 'stupid', 'idiot*', 'kill*',
+        'die', 'died', 'dying', 'angry', 'angrier', 'furious', 'mad', 'boss*', 'bad',
+        'terrible', 'hit', 'hitting', 'punch*', 'hurt*', 'hell', 'damn*', 'wtf',
+    ],
+    'crisis': [
+        'suicid*', 'kill myself', 'killing myself', 'end my life', 'end it all',
+        'want to die', 'wanna die', 'self harm', 'cut myself', 'hurt myself',
+        'no reason to live', 'better off dead', 'overdose*',
+    ],
+    'question': ['what', 'how', 'why', 'when', 'where', 'who', '?'],
+    'positive': [
+        'happy', 'happier', 'good', 'great', 'love', 'loved', 'excellent', 'amazing',
+        'wonderful', 'joy', 'excited', 'better', 'fine', 'ok', 'okay',
+    ],
+}
+
+ESCALATION_CATEGORIES = frozenset({'negative', 'crisis'})
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class KeywordMatcher:
+    def __init__(self, keyword_sets=None):
+        # keyword_sets: {category: [keyword, ...]}
+        keyword_sets = DEFAULT_KEYWORDS if keyword_sets is None else keyword_sets
+        self.categories = tuple(keyword_sets)
+        self._exact = {}
+        self._prefix = {}
+        self._prefix_lengths = set()
+        self.max_words = 1
+        for category, keywords in keyword_sets.items():
+            for keyword in keywords:
+                self.add(category, keyword)
+
+    def add(self, category, keyword):
+        prefix = keyword.endswith('*')
+        tokens = tuple(tokenize(keyword.rstrip('*')))
+        if not tokens:
+            raise ValueError(f"Empty safety keyword in '{category}'")
+        self.max_words = max(self.max_words, len(tokens))
+        if prefix:
+            self._prefix_lengths.add(len(tokens[-1]))
+            self._prefix.setdefault(tokens, set()).add(category)
+        else:
+            self._exact.setdefault(tokens, set()).add(category)
+
+    def scan(self, text):
+        # Returns the set of categories with at least one keyword in text
+        tokens = tokenize(text)
+        found = set()
+        exact, prefix = self._exact, self._prefix
+        prefix_lengths = self._prefix_lengths
+        for i in range(len(tokens)):
+            for n in range(1, min(self.max_words, len(tokens) - i) + 1):
+                phrase = tuple(tokens[i:i + n])
+                hit = exact.get(phrase)
+                if hit:
+                    found |= hit
+                if prefix_lengths:
+                    head, last = phrase[:-1], phrase[-1]
+                    for length in prefix_lengths:
+                        if length <= len(last):
+                            hit = prefix.get(head + (last[:length],))
+                            if hit:
+                                found |= hit
+        return found
+
+
+def needs_escalation(flags):
+    return bool(ESCALATION_CATEGORIES.intersection(flags))
+
+
+default_matcher = KeywordMatcher()
@@ -0,0 +1,401 @@
+import io
+import json
+import logging
+import threading
+import time
+import unittest
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from .admission import ADMITTED, RATE_LIMITED, ConcurrencyLimiter, TokenBucket, make_admission
+from .llm import FakeBackend, LLMGateway
+from .logs import AsyncJsonHandler
+from .policy import BYPASS, ESCALATE, BypassPolicy, make_policy
+from .resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientCaller
+from .safety import KeywordMatcher, default_matcher
+
+
+def shared_store(name):
+    # A Django cache with atomic incr/decr, as Redis is between processes
+    return LocMemCache(name, {})
+
+
+class ConcurrencyLimiterTests(unittest.TestCase):
+    def test_local_limit(self):
+        limiter = ConcurrencyLimiter(2)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+    def test_shared_limit_spans_limiters(self):
+        # Two limiters on one store stand for two worker processes
+        store = shared_store('limiter-spans')
+        first, second = ConcurrencyLimiter(3, store), ConcurrencyLimiter(3, store)
+        self.assertTrue(first.acquire())
+        self.assertTrue(second.acquire())
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.acquire())
+        self.assertEqual((first.in_flight, second.in_flight), (1, 2))
+        second.release()
+        self.assertTrue(first.acquire())
+        self.assertEqual(store.get(first.key), 3)
+
+    def test_shared_limit_under_contention(self):
+        store = shared_store('limiter-contention')
+        limiters = [ConcurrencyLimiter(5, store) for _ in range(4)]
+        admitted = []
+        barrier = threading.Barrier(20)
+
+        def worker(limiter):
+            barrier.wait()
+            admitted.append(limiter.acquire())
+
+        threads = [threading.Thread(target=worker, args=(limiters[i % 4],)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(admitted), 5)
+        self.assertEqual(store.get(limiters[0].key), 5)
+
+    def test_release_without_acquire_is_ignored(self):
+        store = shared_store('limiter-release')
+        limiter = ConcurrencyLimiter(1, store)
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+
+    def test_expired_count_restarts(self):
+        store = shared_store('limiter-expired')
+        limiter = ConcurrencyLimiter(1, store)
+        self.assertTrue(limiter.acquire())
+        store.delete(limiter.key)
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=0.5, burst=3)
+        self.assertEqual([bucket.take('a', now=100.0) for _ in range(4)], [True, True, True, False])
+        # 0.5 tokens/s: one more after two seconds, not before
+        self.assertFalse(bucket.take('a', now=101.9))
+        self.assertTrue(bucket.take('a', now=103.9))
+        self.assertFalse(bucket.take('a', now=103.9))
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=1.0, burst=2)
+        bucket.take('a', now=0.0)
+        bucket.take('a', now=0.0)
+        self.assertEqual([bucket.take('a', now=1000.0) for _ in range(3)], [True, True, False])
+
+    def test_keys_are_independent(self):
+        bucket = TokenBucket(rate=1.0, burst=1)
+        self.assertTrue(bucket.take('a', now=0.0))
+        self.assertFalse(bucket.take('a', now=0.0))
+        self.assertTrue(bucket.take('b', now=0.0))
+
+    def test_buckets_in_a_shared_store(self):
+        # Two workers' buckets over one store see the same tokens
+        store = shared_store('bucket-shared')
+        first, second = TokenBucket(1.0, 2, store), TokenBucket(1.0, 2, store)
+        self.assertTrue(first.take('a', now=0.0))
+        self.assertTrue(second.take('a', now=0.0))
+        self.assertFalse(first.take('a', now=0.0))
+
+    def test_admission_names_the_bucket_that_ran_out(self):
+        admission = make_admission({'SESSION_RATE': 1.0, 'SESSION_BURST': 1, 'IP_RATE': 10.0, 'IP_BURST': 10})
+        self.assertEqual(admission.check({'session': 's', 'ip': '10.0.0.1'}), (ADMITTED, ''))
+        self.assertEqual(admission.check({'session': 's', 'ip': '10.0.0.1'}), (RATE_LIMITED, 'session'))
+        self.assertEqual(admission.results[(RATE_LIMITED, 'session')], 1)
+
+
+class MakeAdmissionTests(unittest.TestCase):
+    def test_unshared_cap_is_split_between_workers(self):
+        admission = make_admission({'MAX_CONCURRENT_LLM': 8, 'WORKERS': 3})
+        self.assertEqual(admission.llm.limit, 3)
+        self.assertIsNone(admission.llm.store)
+        self.assertEqual(make_admission({'MAX_CONCURRENT_LLM': 8, 'WORKERS': 9}).llm.limit, 1)
+
+    def test_shared_cap_is_site_wide(self):
+        store = shared_store('admission-shared')
+        admission = make_admission({'MAX_CONCURRENT_LLM': 8, 'WORKERS': 9, 'SHARED': True}, store)
+        self.assertEqual(admission.llm.limit, 8)
+        self.assertIs(admission.llm.store, store)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ScriptedBackend(FakeBackend):
+    # FakeBackend whose calls take the given latencies (seconds) and fail
+    # where `failures` says so, in order; counts the calls it gets
+    def __init__(self, latencies=(), failures=(), reply="ok"):
+        super().__init__(reply)
+        self.latencies = list(latencies)
+        self.failures = list(failures)
+        self.calls = 0
+
+    def _sample(self):
+        with self._lock:
+            self.calls += 1
+            latency = self.latencies.pop(0) if self.latencies else 0.0
+            fails = self.failures.pop(0) if self.failures else False
+        return latency, fails
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=2, cooldown=30.0, clock=self.clock)
+        self.backend = ScriptedBackend(failures=[True, True])
+        self.gateway = LLMGateway(self.backend, ResilientCaller(deadline=1.0, breaker=self.breaker))
+
+    def test_trips_after_consecutive_failures(self):
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                self.gateway.generate("prompt")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.gateway.generate("prompt")
+        self.assertEqual(self.backend.calls, 2)
+
+    def test_success_resets_the_count(self):
+        self.backend.failures = [True, False, True]
+        for expected in (RuntimeError, None, RuntimeError):
+            if expected:
+                with self.assertRaises(expected):
+                    self.gateway.generate("prompt")
+            else:
+                self.gateway.generate("prompt")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.advance(29.9)
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(0.1)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only the one probe while it is outstanding
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.backend.failures = [True, True, True, False]
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                self.gateway.generate("prompt")
+        self.clock.advance(30.0)
+        with self.assertRaises(RuntimeError):
+            self.gateway.generate("prompt")  # the probe
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.opened_at, 30.0)
+        with self.assertRaises(CircuitOpenError):
+            self.gateway.generate("prompt")
+        self.clock.advance(30.0)
+        self.assertEqual(self.gateway.generate("prompt"), "ok")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.backend.calls, 4)
+
+
+class ResilientCallerTests(unittest.TestCase):
+    def test_hedge_fires_after_hedge_after(self):
+        backend = ScriptedBackend(latencies=[1.0, 0.0])
+        gateway = LLMGateway(backend, ResilientCaller(deadline=2.0, hedge_after=0.05))
+        started = time.monotonic()
+        self.assertEqual(gateway.generate("prompt"), "ok")
+        elapsed = time.monotonic() - started
+        self.assertEqual(backend.calls, 2)
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 0.5)
+
+    def test_no_hedge_for_fast_calls(self):
+        backend = ScriptedBackend(latencies=[0.0])
+        gateway = LLMGateway(backend, ResilientCaller(deadline=2.0, hedge_after=0.2))
+        self.assertEqual(gateway.generate("prompt"), "ok")
+        time.sleep(0.3)
+        self.assertEqual(backend.calls, 1)
+
+    def test_deadline(self):
+        backend = ScriptedBackend(latencies=[1.0])
+        caller = ResilientCaller(deadline=0.1)
+        started = time.monotonic()
+        with self.assertRaises((DeadlineExceeded, TimeoutError)):
+            LLMGateway(backend, caller).generate("prompt")
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(caller.breaker.failures, 1)
+
+
+class CoalescingTests(unittest.TestCase):
+    def run_concurrently(self, gateway, prompts):
+        # -> results (or exceptions) of gateway.generate(prompt), all
+        # started at once
+        results = [None] * len(prompts)
+        barrier = threading.Barrier(len(prompts))
+
+        def worker(i):
+            barrier.wait()
+            try:
+                results[i] = gateway.generate(prompts[i])
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(prompts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_duplicate_prompts_share_one_call(self):
+        backend = ScriptedBackend(latencies=[0.2])
+        gateway = LLMGateway(backend, ResilientCaller(deadline=2.0))
+        results = self.run_concurrently(gateway, ["same"] * 10)
+        self.assertEqual(results, ["ok"] * 10)
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual((gateway.calls, gateway.coalesced), (1, 9))
+        # Once the call is done the next one goes upstream again
+        gateway.generate("same")
+        self.assertEqual(backend.calls, 2)
+
+    def test_followers_get_the_leaders_error(self):
+        backend = ScriptedBackend(latencies=[0.2], failures=[True])
+        gateway = LLMGateway(backend, ResilientCaller(deadline=2.0))
+        results = self.run_concurrently(gateway, ["same"] * 5)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(backend.calls, 1)
+
+    def test_different_prompts_are_not_coalesced(self):
+        backend = ScriptedBackend(latencies=[0.1] * 4)
+        gateway = LLMGateway(backend, ResilientCaller(deadline=2.0))
+        self.run_concurrently(gateway, ["a", "b", "c", "d"])
+        self.assertEqual((backend.calls, gateway.coalesced), (4, 0))
+
+
+class KeywordMatcherTests(unittest.TestCase):
+    def test_whole_words_only(self):
+        matcher = KeywordMatcher({'negative': ['fire', 'hit', 'die']})
+        for text in ("the fireworks were lovely", "a white dress", "i did it", "diet coke", "ceasefire"):
+            with self.subTest(text=text):
+                self.assertEqual(matcher.scan(text), set())
+        self.assertEqual(matcher.scan("There's a FIRE!"), {'negative'})
+        self.assertEqual(matcher.scan("he hit me"), {'negative'})
+
+    def test_prefix_keywords(self):
+        matcher = KeywordMatcher({'negative': ['hurt*']})
+        for text in ("it's hurting", "I was hurt", "hurtful words"):
+            with self.subTest(text=text):
+                self.assertEqual(matcher.scan(text), {'negative'})
+        # Still anchored at the start of the word
+        self.assertEqual(matcher.scan("unhurt and fine"), set())
+        self.assertEqual(matcher.scan("hur"), set())
+
+    def test_phrases(self):
+        matcher = KeywordMatcher({'crisis': ['kill myself', 'end my life', 'self harm*']})
+        self.assertEqual(matcher.scan("sometimes I want to kill myself"), {'crisis'})
+        self.assertEqual(matcher.scan("I want to END   my life."), {'crisis'})
+        self.assertEqual(matcher.scan("self harming again"), {'crisis'})
+        # Every word of the phrase, in order and adjacent
+        self.assertEqual(matcher.scan("kill the spider myself"), set())
+        self.assertEqual(matcher.scan("my life will end"), set())
+
+    def test_categories_and_punctuation(self):
+        matcher = KeywordMatcher({'negative': ['hate*'], 'question': ['why', '?'], 'positive': ['love']})
+        self.assertEqual(matcher.scan("why do I hate mondays?"), {'negative', 'question'})
+        self.assertEqual(matcher.scan("i love it"), {'positive'})
+        with self.assertRaises(ValueError):
+            KeywordMatcher({'negative': ['*']})
+
+    def test_default_keywords(self):
+        self.assertEqual(default_matcher.scan("the fireworks were amazing"), {'positive'})
+        self.assertIn('crisis', default_matcher.scan("i want to die"))
+        self.assertIn('negative', default_matcher.scan("stop hurting me"))
+
+
+class BypassPolicyTests(unittest.TestCase):
+    def setUp(self):
+        self.policy = BypassPolicy(min_confidence=0.38, min_margin=0.12, max_words=12)
+
+    def decide(self, text="i feel great today", emotion='Joy', model_emotion=None, confidence=0.6, margin=0.3, flags=()):
+        return self.policy.decide(text, emotion, model_emotion or emotion, confidence, margin, flags)
+
+    def test_confident_low_risk_message_bypasses(self):
+        self.assertEqual(self.decide(flags={'positive'}), (BYPASS, 'confident'))
+        self.assertEqual(self.decide(emotion='Surprise'), (BYPASS, 'confident'))
+
+    def test_uncertain_messages_escalate(self):
+        self.assertEqual(self.decide(margin=0.05), (ESCALATE, 'low_margin'))
+        self.assertEqual(self.decide(confidence=0.3), (ESCALATE, 'low_confidence'))
+
+    def test_risky_messages_escalate(self):
+        self.assertEqual(self.decide(emotion='Sadness'), (ESCALATE, 'emotion'))
+        for flag in ('negative', 'question', 'crisis'):
+            with self.subTest(flag=flag):
+                self.assertEqual(self.decide(flags={flag, 'positive'}), (ESCALATE, 'safety_flag'))
+
+    def test_safety_relabel_escalates(self):
+        # The rules moved the label (e.g. Joy -> Anger on a negative keyword)
+        self.assertEqual(self.decide(emotion='Anger', model_emotion='Joy'), (ESCALATE, 'rules_override'))
+        self.assertEqual(self.decide(emotion='Neutral', model_emotion='Joy'), (ESCALATE, 'rules_override'))
+
+    def test_max_words(self):
+        self.assertEqual(self.decide(text=' '.join(['happy'] * 12)), (BYPASS, 'confident'))
+        self.assertEqual(self.decide(text=' '.join(['happy'] * 13)), (ESCALATE, 'long'))
+
+    def test_counts_and_config(self):
+        self.decide()
+        self.decide(margin=0.0)
+        self.assertEqual(self.policy.bypass_rate, 0.5)
+        self.assertEqual(make_policy({'ENABLED': False}).decide("hi", 'Joy', 'Joy', 1.0, 1.0), (ESCALATE, 'disabled'))
+        policy = make_policy({'MAX_WORDS': 2, 'ESCALATE_FLAGS': []})
+        self.assertEqual(policy.decide("so so happy", 'Joy', 'Joy', 0.6, 0.3), (ESCALATE, 'long'))
+        self.assertEqual(policy.decide("why happy", 'Joy', 'Joy', 0.6, 0.3, {'question'}), (BYPASS, 'confident'))
+
+
+def captured_log(redact_mode='length', **extra):
+    # Logs one record through an AsyncJsonHandler and returns what it wrote
+    stream = io.StringIO()
+    handler = AsyncJsonHandler(stream=stream, redact_mode=redact_mode)
+    logger = logging.getLogger(f'luma.tests.redaction.{redact_mode}')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        logger.info("reply", extra=extra)
+    finally:
+        logger.removeHandler(handler)
+        handler.stop()  # drains the queue
+    return stream.getvalue()
+
+
+class LogRedactionTests(unittest.TestCase):
+    SECRET = "my sister Anna hurt herself last night"
+
+    def test_user_text_is_reduced_to_its_length(self):
+        output = captured_log(user_input=self.SECRET, reply="I'm so sorry about Anna", emotion='Fear')
+        self.assertNotIn("Anna", output)
+        entry = json.loads(output)
+        self.assertEqual(entry['user_input'], f"[redacted {len(self.SECRET)} chars]")
+        self.assertEqual(entry['reply'], "[redacted 23 chars]")
+        # Other fields are kept as they are
+        self.assertEqual((entry['msg'], entry['emotion']), ("reply", 'Fear'))
+
+    def test_drop_mode(self):
+        output = captured_log('drop', user_input=self.SECRET, prompt=self.SECRET, text=self.SECRET)
+        self.assertNotIn("Anna", output)
+        entry = json.loads(output)
+        self.assertEqual({entry['user_input'], entry['prompt'], entry['text']}, {"[redacted]"})
+
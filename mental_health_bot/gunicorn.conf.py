@@ -0,0 +1,24 @@
+# Multi-worker deployment of the Django site:
+#   cd mental_health_bot && gunicorn -c gunicorn.conf.py mental_health_site.wsgi
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Per-process limits are sized by it (LUMA_ADMISSION in settings)
+os.environ['GUNICORN_WORKERS'] = str(workers)
+
+# Load the app, and with it the emotion model, once in the master so the
+# workers start warm. The model's arrays are mmapped and shared; its vocab
+# dict is copied into each worker page by page as it is used (see
+# ml_model/shared.py).
+preload_app = True
+
+
+def when_ready(server):
+    from chatbot.views import warm_up
+    from ml_model import shared
+    # The LLM client is left to each worker: gRPC channels are not fork-safe
+    warm_up(include_llm=False)
+    shared.preload()
+    server.log.info("Emotion model preloaded in master (pid %s)", os.getpid())
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from companion.logs import logging_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -88,6 +91,58 @@ DATABASES = {
 }
 
 
+# Sessions are signed cookies (no session write per chat turn). They only
+# carry a conversation id; the conversation state itself (last emotion and
+# the recent turns, verbatim, sent to the LLM as context) lives in the
+# 'conversations' cache (chatbot/state.py) and expires LUMA_CONVERSATION_TTL
+# seconds after the conversation's last message. With LUMA_REDIS_URL it is
+# kept in Redis; otherwise in a table of the default database (created by
+# `migrate`), which every worker on the host shares. The database cache is
+# meant for development and single-host demos: on SQLite every write is a
+# transaction that serializes the workers, so set LUMA_REDIS_URL in
+# production.
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+# Redis shared by the worker processes (e.g. redis://127.0.0.1:6379/0;
+# needs the `redis` package), or None
+LUMA_REDIS_URL = os.getenv('LUMA_REDIS_URL') or None
+
+LUMA_CONVERSATION_CACHE = 'conversations'
+LUMA_CONVERSATION_TTL = int(os.getenv('LUMA_CONVERSATION_TTL', str(24 * 60 * 60)))
+# Seconds a worker holds conversation state before writing it, coalescing
+# the turns in between into one write (chatbot/state.py); 0 writes every
+# turn. Other workers see a turn only after the write, so keep it short.
+LUMA_CONVERSATION_WRITE_BEHIND = float(os.getenv('LUMA_CONVERSATION_WRITE_BEHIND', '0' if LUMA_REDIS_URL else '2'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'conversations': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': LUMA_REDIS_URL,
+        'KEY_PREFIX': 'luma-conversations',
+        'TIMEOUT': LUMA_CONVERSATION_TTL,
+    } if LUMA_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'luma_conversation_cache',
+        'TIMEOUT': LUMA_CONVERSATION_TTL,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Token buckets and the in-flight LLM count for LUMA_ADMISSION: shared
+    # by all workers with LUMA_REDIS_URL, else per process
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': LUMA_REDIS_URL,
+        'KEY_PREFIX': 'luma-ratelimit',
+    } if LUMA_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'luma-ratelimit',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -123,3 +178,156 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+
+# Luma: cache of Gemini replies for common messages, keyed on normalised text
+# + detected emotion. BACKEND is 'memory' (per process), 'sqlite' (shared
+# on-disk file) or 'none'. Only replies written without conversation context
+# are stored, so no conversation's reply is ever served to another.
+LUMA_RESPONSE_CACHE = {
+    'BACKEND': 'memory',
+    'PATH': BASE_DIR / 'response_cache.sqlite3',
+    'MAX_ENTRIES': 1000,
+    'TTL': 6 * 60 * 60,
+    'CANDIDATES': 3,
+    'MAX_WORDS': 12,
+}
+
+# Luma: vetted replies served by nearest-neighbour lookup before calling
+# Gemini. Build the index with `python -m ml_model.retrieval`.
+LUMA_RETRIEVAL = {
+    'ENABLED': True,
+    'THRESHOLD': 0.7,
+}
+
+# Luma: LLM gateway shared by all requests (companion/llm.py). BACKEND is
+# 'gemini' or 'fake' (local stand-in). Each request waits at most DEADLINE
+# seconds; HEDGE_AFTER (seconds, or None) fires a second identical request
+# if the first is slow; after BREAKER_FAILURES consecutive failures the LLM is
+# skipped for BREAKER_COOLDOWN seconds before a single probe is let through.
+# FAKE shapes the stand-in for load tests (`manage.py loadtest`): log-normal
+# latency with MEDIAN_MS/P95_MS, ERROR_RATE failed calls and CHUNK_MS per
+# streamed word; LUMA_LLM_BACKEND=fake switches to it without editing this.
+LUMA_LLM = {
+    'BACKEND': os.getenv('LUMA_LLM_BACKEND', 'gemini'),
+    'MODEL': 'gemini-1.5-flash',
+    'DEADLINE': 6.0,
+    'HEDGE_AFTER': None,
+    'BREAKER_FAILURES': 3,
+    'BREAKER_COOLDOWN': 30.0,
+    'FAKE': {
+        'MEDIAN_MS': float(os.getenv('LUMA_FAKE_LLM_MEDIAN_MS', '0')),
+        'P95_MS': float(os.getenv('LUMA_FAKE_LLM_P95_MS', '0')),
+        'ERROR_RATE': float(os.getenv('LUMA_FAKE_LLM_ERROR_RATE', '0')),
+        'CHUNK_MS': float(os.getenv('LUMA_FAKE_LLM_CHUNK_MS', '0')),
+    },
+}
+
+# Luma: emotion model registry (ml_model/registry.py). PATH (default: the
+# bundled artifact, else model_params.json) is polled every POLL_INTERVAL
+# seconds and a changed model is loaded in the background, checked on the
+# CANARY set (it may score at most MAX_ACCURACY_DROP below the active model)
+# and swapped in without a restart; HISTORY versions are kept for rollback.
+# Staff can reload or roll back at /model/; the command reaches the other
+# workers through CONTROL_CACHE, which must be shared by them.
+LUMA_MODEL = {
+    'PATH': os.getenv('LUMA_MODEL_PATH') or None,
+    'POLL_INTERVAL': 10.0,
+    'MAX_ACCURACY_DROP': 0.1,
+    'HISTORY': 3,
+    'CONTROL_CACHE': 'conversations',
+}
+
+# Luma: admission control for chat replies (companion/admission.py). Each
+# conversation may send SESSION_RATE messages per second with bursts of up
+# to SESSION_BURST, each client address IP_RATE/IP_BURST, and at most
+# MAX_CONCURRENT_LLM Gemini calls are in flight. Requests over a limit are
+# answered at once from the local replies instead of waiting. Buckets and
+# the in-flight count are kept in the CACHE alias; they are site-wide when it
+# is SHARED by the workers (LUMA_REDIS_URL). Otherwise the buckets are per
+# worker and each of the WORKERS processes (set by gunicorn.conf.py) may run
+# its share of MAX_CONCURRENT_LLM calls. Only trust X-Forwarded-For
+# (TRUST_X_FORWARDED_FOR) behind a proxy that sets it.
+LUMA_ADMISSION = {
+    'ENABLED': os.getenv('LUMA_ADMISSION', '1') not in ('', '0', 'false', 'False'),
+    'CACHE': 'ratelimit',
+    'SHARED': LUMA_REDIS_URL is not None,
+    'WORKERS': int(os.getenv('GUNICORN_WORKERS') or os.getenv('WEB_CONCURRENCY') or 1),
+    'SESSION_RATE': 0.5,
+    'SESSION_BURST': 5,
+    'IP_RATE': 2.0,
+    'IP_BURST': 20,
+    'MAX_CONCURRENT_LLM': 8,
+    'TRUST_X_FORWARDED_FOR': os.getenv('LUMA_TRUST_X_FORWARDED_FOR', '') not in ('', '0', 'false', 'False'),
+}
+
+# Luma: confidence-gated LLM bypass (companion/policy.py). Messages of at
+# most MAX_WORDS words whose detected emotion is in EMOTIONS (and unchanged
+# by the safety rules), with top-class probability >= MIN_CONFIDENCE and a
+# lead of >= MIN_MARGIN over the runner-up, get a local template reply
+# instead of an LLM call. ESCALATE_FLAGS are safety keyword categories that
+# always go to the LLM. Thresholds are on this model's probability scale;
+# re-tune them when it is retrained.
+LUMA_BYPASS = {
+    'ENABLED': True,
+    'MIN_CONFIDENCE': 0.38,
+    'MIN_MARGIN': 0.12,
+    'MAX_WORDS': 12,
+    'EMOTIONS': ['Joy', 'Love', 'Surprise'],
+    'ESCALATE_FLAGS': ['negative', 'crisis', 'question'],
+}
+
+# Luma: conversation context sent with each LLM prompt (companion/context.py).
+# Recent turns are kept verbatim and older ones folded into a short summary
+# so the whole block stays under MAX_TOKENS (estimated, ~4 chars per token),
+# of which the summary may use up to SUMMARY_TOKENS.
+LUMA_CONTEXT = {
+    'MAX_TOKENS': 600,
+    'SUMMARY_TOKENS': 150,
+}
+
+# Luma: keyword safety nets as {category: [keywords]}. Keywords match whole
+# words; 'hurt*' matches any word starting with "hurt"; phrases are allowed.
+# None uses companion.safety.DEFAULT_KEYWORDS ('negative', 'crisis',
+# 'question', 'positive'). Messages flagged 'negative' or 'crisis' skip
+# retrieval, the response cache and the templates.
+LUMA_SAFETY_KEYWORDS = None
+
+# Luma: the emotion model and LLM client are built on first use. Set
+# LUMA_WARMUP=1 to build them at startup instead (long-running servers);
+# leave it off on serverless cold starts.
+LUMA_WARMUP = os.getenv('LUMA_WARMUP', '') not in ('', '0', 'false', 'False')
+
+# Luma: per-stage timings and counters at /metrics (Prometheus text format;
+# values are per process). Set LUMA_METRICS_TOKEN to require
+# "Authorization: Bearer <token>" on scrapes.
+LUMA_METRICS = {
+    'ENABLED': True,
+    'TOKEN': os.getenv('LUMA_METRICS_TOKEN'),
+}
+
+# Logging: JSON lines on stdout, written by a background thread so logging
+# never blocks a request (companion/logs.py). Per-turn events go to the
+# 'luma.requests' logger, of which LUMA_LOG_SAMPLE_RATE is kept (warnings
+# and errors always are). User text in log fields is replaced by its length
+# ('length'), a fixed marker ('drop') or kept ('none', local debugging only).
+LOGGING = logging_config(
+    level=os.getenv('LUMA_LOG_LEVEL', 'INFO'),
+    sample_rates={'luma.requests': float(os.getenv('LUMA_LOG_SAMPLE_RATE', '0.1'))},
+    redact_mode=os.getenv('LUMA_LOG_REDACT', 'length'),
+)
+
+# Budget for `python manage.py importtime` (cumulative import time of the
+# chat views, in milliseconds)
+LUMA_IMPORT_BUDGET_MS = 500
+
+# Luma: per-turn analytics (chatbot/analytics.py). Turns are queued in memory
+# and written in batches of up to BATCH_SIZE every FLUSH_INTERVAL seconds;
+# when more than MAX_QUEUE are waiting, new ones are dropped. Aggregates are
+# served (to staff) at /stats/emotions/ and /stats/sources/.
+LUMA_ANALYTICS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_QUEUE': 10000,
+}
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# Binary model artifact: a directory holding one .npy file per array (so they
+# can be opened with np.load(mmap_mode='r')), the vocabulary as a newline
+# separated UTF-8 blob in row order, and a small manifest with the format
+# version and a content hash for every file.
+#
+# A running model keeps its arrays mapped, so an artifact directory is
+# written once and never modified: save_artifact() builds it under a
+# temporary name and renames it into place, and refuses a path that already
+# exists. A new version goes into its own directory, and publish() atomically
+# repoints the symlink the registry watches at it.
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+VOCAB_NAME = 'vocab.txt'
+
+DEFAULT_ARTIFACT_DIR = os.path.join(os.path.dirname(__file__), 'model_artifact')
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_artifact(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+def compiled_arrays(idf, coef, intercept):
+    # The tables SGDInference.compile() would otherwise build per process.
+    # Shipping them in the artifact lets every worker mmap the same pages.
+    return {
+        'weights': np.ascontiguousarray((np.asarray(coef, dtype=np.float64) * idf).T, dtype=np.float32),
+        'idf32': np.asarray(idf, dtype=np.float32),
+        'intercept32': np.asarray(intercept, dtype=np.float32),
+    }
+
+
+def save_artifact(out_dir, vocabulary, idf, coef, intercept, classes, model_type='sgd_tfidf', arrays=None, precompile=True, **meta):
+    # vocabulary maps term -> column; store the terms ordered by column so the
+    # dict can be rebuilt with a single split()
+    terms = [None] * len(vocabulary)
+    for term, idx in vocabulary.items():
+        terms[idx] = term
+    if any(t is None for t in terms):
+        raise ArtifactError("Vocabulary indices are not a contiguous range")
+    if any('\n' in t for t in terms):
+        raise ArtifactError("Vocabulary terms must not contain newlines")
+
+    if os.path.lexists(out_dir):
+        raise ArtifactError(f"{out_dir} already exists; write each version to a new directory and publish() it")
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(os.path.abspath(out_dir))}.", dir=parent)
+    try:
+        manifest = _write_files(staging, terms, idf, coef, intercept, classes, model_type, arrays, precompile, meta)
+        os.chmod(staging, 0o755)
+        os.rename(staging, out_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def _write_files(out_dir, terms, idf, coef, intercept, classes, model_type, arrays, precompile, meta):
+    files = {}
+    blob = '\n'.join(terms).encode('utf-8')
+    with open(os.path.join(out_dir, VOCAB_NAME), 'wb') as f:
+        f.write(blob)
+    files[VOCAB_NAME] = hashlib.sha256(blob).hexdigest()
+
+    to_write = {'idf': idf, 'coef': coef, 'intercept': intercept}
+    to_write.update(arrays or {})
+    if precompile:
+        to_write.update(compiled_arrays(idf, coef, intercept))
+    for name, arr in to_write.items():
+        fname = f"{name}.npy"
+        np.save(os.path.join(out_dir, fname), np.ascontiguousarray(arr))
+        files[fname] = _sha256(os.path.join(out_dir, fname))
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'type': model_type,
+        'classes': list(classes),
+        'n_features': len(terms),
+        'precompiled': bool(precompile),
+        'files': files,
+    }
+    manifest.update(meta)
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def publish(version_dir, link):
+    # Points link (the path the registry watches) at version_dir in one
+    # rename, leaving the previous version's files untouched for the
+    # requests and rollbacks still using them
+    if os.path.exists(link) and not os.path.islink(link):
+        raise ArtifactError(f"{link} is a directory, not a symlink; move it into its own version directory and link it once")
+    if not is_artifact(version_dir):
+        raise ArtifactError(f"{version_dir} is not a model artifact")
+    link = os.path.abspath(link)
+    target = os.path.relpath(os.path.abspath(version_dir), os.path.dirname(link))
+    tmp = f"{link}.tmp-{os.getpid()}"
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+
+
+def load_artifact(path, mmap=True, verify=False):
+    # Returns the same dict layout as model_params.json, with the arrays
+    # memory-mapped read-only. The vocabulary blob is always checked against
+    # its hash (it is tiny); verify=True also hashes every array file.
+    with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+
+    version = manifest.get('format_version')
+    if version != FORMAT_VERSION:
+        raise ArtifactError(f"Unsupported artifact format version {version} (expected {FORMAT_VERSION})")
+
+    files = manifest['files']
+    with open(os.path.join(path, VOCAB_NAME), 'rb') as f:
+        blob = f.read()
+    if hashlib.sha256(blob).hexdigest() != files[VOCAB_NAME]:
+        raise ArtifactError(f"Vocabulary hash mismatch in {path}")
+    terms = blob.decode('utf-8').split('\n') if blob else []
+    vocabulary = dict(zip(terms, range(len(terms))))
+
+    data = dict(manifest)
+    data['vocabulary'] = vocabulary
+    mmap_mode = 'r' if mmap else None
+    for fname, digest in files.items():
+        if not fname.endswith('.npy'):
+            continue
+        fpath = os.path.join(path, fname)
+        if verify and _sha256(fpath) != digest:
+            raise ArtifactError(f"Hash mismatch for {fname} in {path}")
+        data[fname[:-len('.npy')]] = np.load(fpath, mmap_mode=mmap_mode)
+
+    # Quantized variants (see quantize.py) are expanded back to float32 so
+    # callers never need to know which variant they opened
+    quantization = manifest.get('quantization', 'none')
+    if quantization == 'float16':
+        data['coef'] = data['coef'].astype(np.float32)
+    elif quantization == 'int8':
+        data['coef'] = data['coef'].astype(np.float32) * data['coef_scale'][:, None]
+    elif quantization != 'none':
+        raise ArtifactError(f"Unknown quantization '{quantization}' in {path}")
+    return data
+
+
+def update_manifest(path, **fields):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    manifest.update(fields)
+    # Replaced in one rename so a reader never sees a partial manifest
+    tmp = f"{manifest_path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+    return manifest
+
+
+def artifact_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def convert_json(json_path, out_dir):
+    with open(json_path, 'r') as f:
+        model_data = json.load(f)
+    return save_artifact(
+        out_dir,
+        model_data['vocabulary'],
+        np.asarray(model_data['idf'], dtype=np.float64),
+        np.asarray(model_data['coef'], dtype=np.float64),
+        np.asarray(model_data['intercept'], dtype=np.float64),
+        model_data['classes'],
+        model_type=model_data.get('type', 'sgd_tfidf'),
+    )
+
+
+if __name__ == "__main__":
+    # python -m ml_model.artifact [model_params.json] [out_dir]
+    src = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'model_params.json')
+    dst = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ARTIFACT_DIR
+    manifest = convert_json(src, dst)
+    print(f"Wrote artifact v{manifest['format_version']} ({manifest['n_features']} features) to {dst}")
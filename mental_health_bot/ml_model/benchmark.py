@@ -0,0 +1,290 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .inference import SGDInference
+from .quantize import synthetic_texts
+from .retrieval import DEFAULT_SEED_PATH, load_entries
+
+# Micro-benchmarks for SGDInference: load time, single-message predict
+# latency by message length, batch throughput, tokenizer cost and peak
+# memory. Corpora are reproducible: synthetic messages drawn from the model
+# vocabulary with a fixed seed, the real messages in retrieval_seed.jsonl,
+# and optionally a sample of a labelled CSV (--data). Results are written as
+# JSON and compared against a committed baseline:
+#
+#   python -m ml_model.benchmark                      # run and compare
+#   python -m ml_model.benchmark --save-baseline      # refresh the baseline
+#
+# Every measurement is repeated and the best round is kept, and the suite
+# itself runs several times keeping each metric's best value, which filters
+# out most scheduler noise. What is left is still a few microseconds on
+# metrics that are only ~15us, so a metric only counts as a regression when
+# it is worse by more than its relative tolerance *and* by more than the
+# absolute noise floor of its unit. Timings depend on the machine: refresh
+# the baseline on the machine that runs the comparison.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+MESSAGE_LENGTHS = (5, 20, 80, 320)
+SEED = 0
+
+# Smallest change, in the metric's unit, that is not timer jitter
+NOISE_FLOORS = {'us': 8.0, 'ms': 1.0, 'MiB': 0.25}
+# Relative tolerance for metrics that swing more than the default between
+# runs of an unchanged tree: p95s (decided by a few slow samples) and the
+# tiny seed-message corpus
+NOISY_TOLERANCE = 0.5
+
+
+def _best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_calibration(repeat=20):
+    # Microseconds for a fixed workload that doesn't touch the model (regex
+    # tokenizing and dict counting, the same kind of work as predict()).
+    # compare() scales the baseline by it, so a machine that is uniformly
+    # slower today (CPU steal, frequency scaling) doesn't read as a regression.
+    rng = random.Random(SEED)
+    words = [''.join(rng.choice('abcdefghij') for _ in range(rng.randint(2, 8))) for _ in range(500)]
+    texts = [' '.join(rng.choice(words) for _ in range(20)) for _ in range(50)]
+    pattern = re.compile(r"(?u)\b\w\w+\b")
+
+    def work():
+        counts = {}
+        for text in texts:
+            for token in pattern.findall(text):
+                counts[token] = counts.get(token, 0) + 1
+        return counts
+
+    return _best_time(work, repeat) * 1e6
+
+
+def build_corpus(model, data_path=None, rows=2000):
+    corpus = {'synthetic': synthetic_texts(model.vocab, n=rows, seed=SEED)}
+    corpus['seed_messages'] = [entry['message'] for entry in load_entries(DEFAULT_SEED_PATH)]
+    if data_path:
+        import pandas as pd
+        df = pd.read_csv(data_path, nrows=rows * 10).dropna(subset=['text'])
+        corpus['data'] = df['text'].astype(str).sample(n=min(rows, len(df)), random_state=SEED).tolist()
+    return corpus
+
+
+def messages_of_length(model, n_words, count=200):
+    rng = random.Random(SEED + n_words)
+    words = sorted(t for t in model.vocab if ' ' not in t)
+    return [' '.join(rng.choice(words) for _ in range(n_words)) for _ in range(count)]
+
+
+def bench_load(model_path, repeat=10):
+    best = _best_time(lambda: SGDInference(model_path), repeat)
+    return best * 1000
+
+
+def bench_predict(model, texts, rounds=5):
+    # Per-message latency of predict() in microseconds: p50 and p95 of the
+    # best of `rounds` passes over texts
+    for text in texts[:10]:
+        model.predict(text)
+    p50 = p95 = float('inf')
+    for _ in range(rounds):
+        timings = []
+        for text in texts:
+            started = time.perf_counter()
+            model.predict(text)
+            timings.append(time.perf_counter() - started)
+        timings = np.array(timings) * 1e6
+        p50 = min(p50, float(np.percentile(timings, 50)))
+        p95 = min(p95, float(np.percentile(timings, 95)))
+    return p50, p95
+
+
+def bench_batch(model, texts, repeat=5):
+    best = _best_time(lambda: model.predict_batch(texts), repeat)
+    return len(texts) / best
+
+
+def bench_tokenizer(model, texts, repeat=5):
+    # Microseconds per message: the fused accumulate() pass used by predict()
+    # and the preprocess() + get_ngrams() pair used by the batch path
+    fused = _best_time(lambda: [model.accumulate(t) for t in texts], repeat)
+    ngrams = _best_time(lambda: [model.get_ngrams(model.preprocess(t)) for t in texts], repeat)
+    return fused / len(texts) * 1e6, ngrams / len(texts) * 1e6
+
+
+def bench_memory(model_path, texts):
+    # Peak Python + numpy allocations (MiB) while loading and scoring a batch
+    gc.collect()
+    tracemalloc.start()
+    model = SGDInference(model_path)
+    _, load_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    model.predict_batch(texts)
+    _, batch_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return load_peak / 2 ** 20, batch_peak / 2 ** 20
+
+
+def run(model_path=None, data_path=None, rows=2000):
+    model = SGDInference(model_path)
+    corpus = build_corpus(model, data_path, rows)
+    results = {}
+
+    def record(name, value, unit, better='lower'):
+        results[name] = {'value': round(value, 4), 'unit': unit, 'better': better}
+
+    # Taken around the timed sections; the fastest is the machine's speed
+    calibration = [bench_calibration()]
+    record('load_ms', bench_load(model_path), 'ms')
+    for n_words in MESSAGE_LENGTHS:
+        p50, p95 = bench_predict(model, messages_of_length(model, n_words))
+        record(f'predict_{n_words}w_p50_us', p50, 'us')
+        record(f'predict_{n_words}w_p95_us', p95, 'us')
+    for name, texts in corpus.items():
+        p50, _ = bench_predict(model, texts)
+        record(f'predict_{name}_p50_us', p50, 'us')
+        record(f'batch_{name}_msgs_per_s', bench_batch(model, texts), 'msgs/s', better='higher')
+    calibration.append(bench_calibration())
+    fused, ngrams = bench_tokenizer(model, corpus['synthetic'])
+    record('tokenize_fused_us', fused, 'us')
+    record('tokenize_ngrams_us', ngrams, 'us')
+    load_peak, batch_peak = bench_memory(model_path, corpus['synthetic'])
+    record('load_peak_mib', load_peak, 'MiB')
+    record('batch_peak_mib', batch_peak, 'MiB')
+    calibration.append(bench_calibration())
+    record('calibration_us', min(calibration), 'us')
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'model_path': os.path.relpath(model.model_path, os.path.dirname(__file__)),
+            'corpus_sizes': {name: len(texts) for name, texts in corpus.items()},
+        },
+        'results': results,
+    }
+
+
+def merge_runs(runs):
+    # Per-metric best value over several full runs of the suite: a slow run
+    # is noise (another process, a frequency dip), a fast one is not
+    merged = dict(runs[0], results={})
+    for name, entry in runs[0]['results'].items():
+        values = [run['results'][name]['value'] for run in runs]
+        best = min(values) if entry['better'] == 'lower' else max(values)
+        merged['results'][name] = dict(entry, value=round(float(best), 4))
+    merged['meta'] = dict(runs[0]['meta'], runs=len(runs))
+    return merged
+
+
+def tolerance(name, threshold):
+    if name.endswith('_p95_us') or '_seed_messages_' in name:
+        return max(threshold, NOISY_TOLERANCE)
+    return threshold
+
+
+def machine_speed(current, baseline):
+    # How much slower this machine ran the calibration workload than the
+    # baseline's. Never below 1.0: the calibration is itself noisy, and it
+    # should only excuse a slow machine, not make the gate stricter.
+    now = current['results'].get('calibration_us', {}).get('value')
+    then = baseline.get('results', {}).get('calibration_us', {}).get('value')
+    return max(1.0, now / then) if now and then else 1.0
+
+
+def compare(current, baseline, threshold=0.25):
+    # Returns [(name, baseline, current, change)] for metrics that got worse
+    # by more than their tolerance (threshold, 0.25 = 25%, or more for noisy
+    # metrics) and by more than their unit's noise floor. Baseline timings
+    # are first scaled by machine_speed(). Metrics missing on either side
+    # are skipped.
+    speed = machine_speed(current, baseline)
+    regressions = []
+    for name, entry in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if name == 'calibration_us' or not base or not base['value']:
+            continue
+        expected = base['value']
+        if entry['unit'] in ('us', 'ms'):
+            expected *= speed
+        elif entry['unit'] == 'msgs/s':
+            expected /= speed
+        delta = entry['value'] - expected
+        if entry['better'] != 'lower':
+            delta = -delta
+        if delta / expected > tolerance(name, threshold) and delta > NOISE_FLOORS.get(entry['unit'], 0.0):
+            regressions.append((name, expected, entry['value'], (entry['value'] - expected) / expected))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SGDInference and compare against a baseline.")
+    parser.add_argument('--model', default=None, help="Artifact directory or model_params.json (default: bundled artifact)")
+    parser.add_argument('--data', default=None, help="CSV with a text column to sample a real corpus from")
+    parser.add_argument('--rows', type=int, default=2000, help="Messages per corpus")
+    parser.add_argument('--runs', type=int, default=5, help="Run the suite this many times and keep each metric's best")
+    parser.add_argument('--confirm', type=int, default=2,
+                        help="On a regression, re-run the suite up to this many more times before failing")
+    parser.add_argument('--out', default=None, help="Write results JSON here")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results as the new baseline")
+    args = parser.parse_args()
+
+    def measure():
+        return [run(args.model, args.data, args.rows) for _ in range(max(args.runs, 1))]
+
+    runs = measure()
+    current = merge_runs(runs)
+    baseline = regressions = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        # Noise rarely survives more rounds of best-of; a real slowdown does
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            print(f"Re-measuring {len(regressions)} suspected regression(s)...")
+            runs += measure()
+            current = merge_runs(runs)
+            regressions = compare(current, baseline, args.threshold)
+
+    for name, entry in current['results'].items():
+        print(f"{name:32s} {entry['value']:>12.2f} {entry['unit']}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        sys.exit(0)
+    print(f"\nMachine speed vs. baseline: {machine_speed(current, baseline):.2f}x the time")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%} (baseline scaled to this machine):")
+        for name, base, value, change in regressions:
+            print(f"  {name}: {base:.2f} -> {value:.2f} ({change:+.0%})")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
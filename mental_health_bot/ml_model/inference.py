@@ -4,23 +4,54 @@ import re
 import os
 import math
 
+from .artifact import DEFAULT_ARTIFACT_DIR, is_artifact, load_artifact
+
+
 class SGDInference:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, compiled=True, verify=False):
         if model_path is None:
-            model_path = os.path.join(os.path.dirname(__file__), 'model_params.json')
-        
-        with open(model_path, 'r') as f:
-            self.model_data = json.load(f)
-            
+            # Prefer the memory-mappable binary artifact, fall back to the JSON export
+            model_path = DEFAULT_ARTIFACT_DIR
+            if not is_artifact(model_path):
+                model_path = os.path.join(os.path.dirname(__file__), 'model_params.json')
+
+        if is_artifact(model_path):
+            self.model_data = load_artifact(model_path, verify=verify)
+        else:
+            with open(model_path, 'r') as f:
+                self.model_data = json.load(f)
+
+        self.model_path = model_path
         self.vocab = self.model_data['vocabulary']
-        self.idf = np.array(self.model_data['idf'])
-        self.coef = np.array(self.model_data['coef'])
-        self.intercept = np.array(self.model_data['intercept'])
+        self.idf = np.asarray(self.model_data['idf'])
+        self.coef = np.asarray(self.model_data['coef'])
+        self.intercept = np.asarray(self.model_data['intercept'])
         self.classes = self.model_data['classes']
         
         # Regex for tokenization (same as CountVectorizer default)
         self.token_pattern = re.compile(r"(?u)\b\w\w+\b")
 
+        self.compiled = compiled
+        if compiled:
+            self.compile()
+
+    def compile(self):
+        # Precompute everything predict() needs so the per-message work is a
+        # dict lookup per token plus one small gather/matmul:
+        #   term -> row dict (unigrams and bigrams, same rows as the vocab)
+        #   (n_terms x n_classes) float32 weights with IDF folded in
+        self.term_rows = self.vocab
+        if self.model_data.get('precompiled'):
+            # Shipped in the artifact: use the read-only mmaps as-is so
+            # forked workers share the pages instead of each holding a copy
+            self.idf32 = np.asarray(self.model_data['idf32'])
+            self.weights = np.asarray(self.model_data['weights'])
+            self.intercept32 = np.asarray(self.model_data['intercept32'])
+            return
+        self.idf32 = np.ascontiguousarray(self.idf, dtype=np.float32)
+        self.weights = np.ascontiguousarray((self.coef * self.idf).T, dtype=np.float32)
+        self.intercept32 = np.ascontiguousarray(self.intercept, dtype=np.float32)
+
     def preprocess(self, text):
         return self.token_pattern.findall(text.lower())
 
@@ -33,67 +64,140 @@ class SGDInference:
                 ngrams.append(f"{tokens[i]} {tokens[i+1]}")
         return ngrams
 
+    def vectorize_batch(self, texts):
+        # Build a CSR-style TF-IDF matrix (indptr, indices, data) for a batch,
+        # matching CountVectorizer(ngram_range=(1, 2)) + TfidfTransformer(norm='l2')
+        indptr = [0]
+        indices = []
+        counts = []
+        vocab = self.vocab
+        for text in texts:
+            term_counts = {}
+            for term in self.get_ngrams(self.preprocess(text)):
+                idx = vocab.get(term)
+                if idx is not None:
+                    term_counts[idx] = term_counts.get(idx, 0) + 1
+            indices.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+            indptr.append(len(indices))
+
+        indptr = np.array(indptr, dtype=np.int64)
+        indices = np.array(indices, dtype=np.int64)
+        # TF * IDF (sklearn's idf_ already includes the +1 smoothing term)
+        data = np.array(counts, dtype=np.float64) * self.idf[indices]
+
+        # Row-wise L2 normalisation
+        row_nnz = np.diff(indptr)
+        non_empty = row_nnz > 0
+        if data.size:
+            sq_norms = np.add.reduceat(data * data, indptr[:-1][non_empty])
+            data /= np.repeat(np.sqrt(sq_norms), row_nnz[non_empty])
+        return indptr, indices, data
+
+    def decision_function_batch(self, texts):
+        # scores = X @ coef.T + intercept, with X sparse: gather the coef columns
+        # for every non-zero, weight them and sum them back per row in one pass
+        indptr, indices, data = self.vectorize_batch(texts)
+        n_rows = len(indptr) - 1
+        scores = np.tile(self.intercept, (n_rows, 1))
+        non_empty = np.diff(indptr) > 0
+        if data.size:
+            contrib = self.coef[:, indices].T * data[:, None]
+            scores[non_empty] += np.add.reduceat(contrib, indptr[:-1][non_empty], axis=0)
+        return scores, non_empty
+
+    @staticmethod
+    def proba_from_scores(scores):
+        # One-vs-rest log-loss probabilities, normalised like sklearn's
+        # SGDClassifier.predict_proba for the multiclass case
+        prob = 1.0 / (1.0 + np.exp(-np.asarray(scores, dtype=np.float64)))
+        return prob / prob.sum(axis=-1, keepdims=True)
+
+    @staticmethod
+    def margin(prob):
+        # Gap between the two most likely classes: how decisive the argmax is
+        top2 = np.partition(prob, -2)[-2:]
+        return float(top2[1] - top2[0])
+
+    def predict_proba_batch(self, texts):
+        scores, _ = self.decision_function_batch(texts)
+        return self.proba_from_scores(scores)
+
+    def predict_batch(self, texts):
+        scores, non_empty = self.decision_function_batch(texts)
+        best = np.argmax(scores, axis=1)
+        # Messages without any known term fall back to the first class,
+        # same as predict()
+        return [self.classes[i] if has_terms else self.classes[0]
+                for i, has_terms in zip(best, non_empty)]
+
+    def accumulate(self, text):
+        # Fused tokenize + n-gram + count pass: bigrams are looked up as they
+        # are formed instead of building the get_ngrams() string list
+        rows = self.term_rows
+        counts = {}
+        prev = None
+        for tok in self.token_pattern.findall(text.lower()):
+            idx = rows.get(tok)
+            if idx is not None:
+                counts[idx] = counts.get(idx, 0) + 1
+            if prev is not None:
+                idx = rows.get(prev + ' ' + tok)
+                if idx is not None:
+                    counts[idx] = counts.get(idx, 0) + 1
+            prev = tok
+        return counts
+
+    def decision_function_compiled(self, text):
+        return self.score_counts(self.accumulate(text))
+
+    def score_counts(self, counts):
+        # Scores for the {term row: count} dict built by accumulate()
+        if not counts:
+            return None
+        n = len(counts)
+        idx = np.fromiter(counts.keys(), dtype=np.intp, count=n)
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=n)
+        # weights already hold coef * idf, so only the L2 norm of the
+        # TF-IDF vector is left to apply
+        tfidf = tf * self.idf32[idx]
+        norm = np.sqrt(tfidf @ tfidf)
+        return (tf @ self.weights[idx]) / norm + self.intercept32
+
+    def predict_proba(self, text):
+        if not self.compiled:
+            return self.predict_proba_batch([text])[0]
+        return self.classify_counts(self.accumulate(text))[1]
+
+    def classify(self, text):
+        # (label, probabilities, margin) in one pass
+        if not self.compiled:
+            scores, non_empty = self.decision_function_batch([text])
+            return self._classified(scores[0] if non_empty[0] else None)
+        return self.classify_counts(self.accumulate(text))
+
+    def classify_counts(self, counts):
+        return self._classified(self.score_counts(counts))
+
+    def _classified(self, scores):
+        if scores is None:
+            # No known words: same fallback label as predict(), and no
+            # confidence to speak of
+            return self.classes[0], self.proba_from_scores(self.intercept), 0.0
+        prob = self.proba_from_scores(scores)
+        return self.classes[int(np.argmax(scores))], prob, self.margin(prob)
+
     def predict(self, text):
-        tokens = self.preprocess(text)
-        ngrams = self.get_ngrams(tokens)
-        
-        # Count vectorizer
-        # We only care about terms in the vocab
-        term_counts = {}
-        for term in ngrams:
-            if term in self.vocab:
-                idx = self.vocab[term]
-                term_counts[idx] = term_counts.get(idx, 0) + 1
-                
-        if not term_counts:
-            # Fallback if no known words found
-            return self.classes[0] # Default to first class or handle gracefully
+        if not self.compiled:
+            return self.predict_batch([text])[0]
+        return self.predict_counts(self.accumulate(text))
 
-        # Create feature vector (sparse representation)
-        indices = list(term_counts.keys())
-        counts = list(term_counts.values())
-        
-        # Apply TF-IDF
-        # TF * (IDF + 1)  (assuming smooth_idf=True which is default)
-        # Note: Scikit-learn TfidfTransformer with norm='l2'
-        
-        # We construct the sparse vector values
-        values = []
-        for idx, count in zip(indices, counts):
-            # tf = count (raw count)
-            # idf = self.idf[idx]
-            val = count * (self.idf[idx]) # Wait, sklearn stores idf_ as log(N/df) + 1 if smooth_idf.
-            # Actually, let's check what idf_ contains.
-            # In TfidfTransformer, idf_ is precomputed.
-            # transform(X) -> X * idf_
-            # So it is just count * idf_ value from the array.
-            values.append(val)
-            
-        values = np.array(values)
-        
-        # L2 Normalization
-        norm = np.linalg.norm(values)
-        if norm > 0:
-            values = values / norm
-            
-        # Prediction: X @ coef.T + intercept
-        # Since X is sparse, we only sum the relevant columns of coef
-        
-        # scores = np.dot(X, coef.T) + intercept
-        # X has non-zero values at 'indices' with 'values'
-        
-        # Efficient sparse dot product
-        # scores[class_k] = sum(X[i] * coef[class_k, i]) + intercept[class_k]
-        
-        scores = np.zeros(len(self.classes))
-        for k in range(len(self.classes)):
-            dot_product = 0
-            for i, val in zip(indices, values):
-                dot_product += val * self.coef[k][i]
-            scores[k] = dot_product + self.intercept[k]
-            
-        best_class_idx = np.argmax(scores)
-        return self.classes[best_class_idx]
+    def predict_counts(self, counts):
+        scores = self.score_counts(counts)
+        if scores is None:
+            # Fallback if no known words found
+            return self.classes[0]
+        return self.classes[int(np.argmax(scores))]
 
 if __name__ == "__main__":
     # Test
@@ -104,5 +208,5 @@ if __name__ == "__main__":
         "I am really worried about the future",
         "I am furious with him"
     ]
-    for t in tests:
-        print(f"'{t}' => {predictor.predict(t)}")
+    for t, label in zip(tests, predictor.predict_batch(tests)):
+        print(f"'{t}' => {label}")
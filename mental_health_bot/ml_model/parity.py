@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from .artifact import DEFAULT_ARTIFACT_DIR
+from .inference import SGDInference
+from .quantize import export_variant, synthetic_texts
+from .retrieval import DEFAULT_SEED_PATH, load_entries
+
+# Parity and accuracy-vs-speed report: runs the same messages through the
+# sklearn pipeline (emotion_model.pkl) and every SGDInference variant (JSON
+# export, memory-mapped artifact with the compiled and batch paths, and
+# float16/int8/pruned artifacts built on the fly), and reports label
+# agreement, probability deltas, accuracy and throughput side by side.
+#
+#   python -m ml_model.parity --data heldout.csv [--variant OUT_DIR ...]
+#
+# Without emotion_model.pkl the reference is a sklearn pipeline rebuilt from
+# the artifact's vocabulary, IDF and weights, which still checks the
+# hand-written tokenizer/TF-IDF/scoring against sklearn's.
+
+DEFAULT_PKL = os.path.join(os.path.dirname(__file__), 'emotion_model.pkl')
+DEFAULT_JSON = os.path.join(os.path.dirname(__file__), 'model_params.json')
+ON_THE_FLY = (
+    ('float16', 'float16', 0.0),
+    ('int8', 'int8', 0.0),
+    ('int8+prune0.01', 'int8', 0.01),
+)
+
+
+def pipeline_from_artifact(model):
+    # sklearn Pipeline with the fitted attributes of an SGDInference model
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+
+    vect = CountVectorizer(ngram_range=(1, 2), vocabulary=dict(model.vocab))
+    tfidf = TfidfTransformer()
+    tfidf.idf_ = np.asarray(model.idf, dtype=np.float64)
+    clf = SGDClassifier(loss='log_loss')
+    clf.coef_ = np.asarray(model.coef, dtype=np.float64)
+    clf.intercept_ = np.asarray(model.intercept, dtype=np.float64)
+    clf.classes_ = np.asarray(model.classes)
+    return Pipeline([('vect', vect), ('tfidf', tfidf), ('clf', clf)])
+
+
+def load_reference(pkl_path=DEFAULT_PKL):
+    if pkl_path and os.path.exists(pkl_path):
+        import joblib
+        return joblib.load(pkl_path), os.path.basename(pkl_path)
+    return pipeline_from_artifact(SGDInference(compiled=False)), 'sklearn rebuilt from artifact'
+
+
+def build_variants(extra_dirs=(), workdir=None, quantized=True):
+    # [(name, SGDInference, predict_fn)]; predict_fn is the single-message
+    # path the frontends use
+    variants = []
+    if os.path.exists(DEFAULT_JSON):
+        model = SGDInference(DEFAULT_JSON)
+        variants.append(('json', model, model.predict))
+    model = SGDInference(DEFAULT_ARTIFACT_DIR)
+    variants.append(('artifact', model, model.predict))
+    model = SGDInference(DEFAULT_ARTIFACT_DIR, compiled=False)
+    variants.append(('artifact/batch', model, model.predict))
+    if quantized:
+        for name, quantization, prune in ON_THE_FLY:
+            out_dir = os.path.join(workdir, name)
+            export_variant(out_dir, DEFAULT_ARTIFACT_DIR, quantization, prune)
+            model = SGDInference(out_dir)
+            variants.append((name, model, model.predict))
+    for path in extra_dirs:
+        model = SGDInference(path)
+        variants.append((os.path.basename(os.path.normpath(path)), model, model.predict))
+    return variants
+
+
+def _throughput(fn, texts):
+    started = time.perf_counter()
+    fn(texts)
+    return len(texts) / (time.perf_counter() - started)
+
+
+def evaluate(reference, variants, texts, labels=None):
+    # SGDInference answers classes[0] for messages without a single known
+    # term where sklearn takes the argmax of the intercepts, so agreement is
+    # also reported over the messages that have known terms
+    known = np.asarray([bool(variants[0][1].accumulate(t)) for t in texts]) if variants else None
+    ref_pred = np.asarray(reference.predict(texts))
+    ref_proba = reference.predict_proba(texts)
+    rows = [{
+        'name': 'reference',
+        'agreement': 1.0,
+        'agreement_known': 1.0,
+        'mean_prob_delta': 0.0,
+        'max_prob_delta': 0.0,
+        'msgs_per_s': _throughput(reference.predict, texts),
+    }]
+    for name, model, predict in variants:
+        pred = np.asarray([predict(t) for t in texts])
+        proba = model.predict_proba_batch(texts)
+        delta = np.abs(proba - ref_proba)
+        rows.append({
+            'name': name,
+            'agreement': float(np.mean(pred == ref_pred)),
+            'agreement_known': float(np.mean(pred[known] == ref_pred[known])),
+            'mean_prob_delta': float(delta.mean()),
+            'max_prob_delta': float(delta.max()),
+            'msgs_per_s': _throughput(lambda batch: [predict(t) for t in batch], texts),
+            'batch_msgs_per_s': _throughput(model.predict_batch, texts),
+        })
+        rows[-1]['_pred'] = pred
+    if labels is not None:
+        labels = np.asarray(labels)
+        rows[0]['accuracy'] = float(np.mean(ref_pred == labels))
+        for row in rows[1:]:
+            row['accuracy'] = float(np.mean(row['_pred'] == labels))
+    for row in rows:
+        row.pop('_pred', None)
+    return rows
+
+
+def load_texts(data_path=None, rows=5000, seed=0):
+    # Labelled sample of a CSV (text, label) or, without one, unlabelled
+    # synthetic + seed messages
+    if data_path:
+        import pandas as pd
+        df = pd.read_csv(data_path).dropna(subset=['text', 'label'])
+        df = df.sample(n=min(rows, len(df)), random_state=seed)
+        return df['text'].astype(str).tolist(), df['label'].astype(int).tolist()
+    model = SGDInference(compiled=False)
+    texts = synthetic_texts(model.vocab, n=rows, seed=seed)
+    texts += [entry['message'] for entry in load_entries(DEFAULT_SEED_PATH)]
+    texts += ["", "zzz qqq"]  # no known terms: fallback path
+    return texts, None
+
+
+def print_report(rows, reference_name, n_texts):
+    print(f"Reference: {reference_name}, {n_texts} messages")
+    columns = ['agreement', 'agreement_known', 'mean_prob_delta', 'max_prob_delta', 'accuracy', 'msgs_per_s', 'batch_msgs_per_s']
+    columns = [c for c in columns if any(c in row for row in rows)]
+    print(f"{'variant':18s}" + ''.join(f"{c:>18s}" for c in columns))
+    for row in rows:
+        cells = []
+        for c in columns:
+            value = row.get(c)
+            if value is None:
+                cells.append(f"{'-':>18s}")
+            elif c.endswith('per_s'):
+                cells.append(f"{value:>18.0f}")
+            else:
+                cells.append(f"{value:>18.6f}")
+        print(f"{row['name']:18s}" + ''.join(cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare SGDInference variants with the sklearn pipeline.")
+    parser.add_argument('--data', default=None, help="Held-out CSV with text/label columns (not used for training)")
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--pkl', default=DEFAULT_PKL, help="sklearn pipeline to use as the reference")
+    parser.add_argument('--variant', action='append', default=[], help="Extra artifact directory to include")
+    parser.add_argument('--no-quantized', action='store_true', help="Skip the float16/int8 variants built on the fly")
+    parser.add_argument('--min-agreement', type=float, default=None,
+                        help="Exit non-zero if a full-precision variant agrees with the reference less than "
+                             "this on messages with known terms")
+    parser.add_argument('--out', default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    reference, reference_name = load_reference(args.pkl)
+    texts, labels = load_texts(args.data, args.rows)
+    with tempfile.TemporaryDirectory() as workdir:
+        variants = build_variants(args.variant, workdir, quantized=not args.no_quantized)
+        rows = evaluate(reference, variants, texts, labels)
+    print_report(rows, reference_name, len(texts))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'reference': reference_name, 'n_texts': len(texts), 'variants': rows}, f, indent=2)
+
+    if args.min_agreement is not None:
+        exact = [row for row in rows if row['name'] in ('json', 'artifact', 'artifact/batch')]
+        failing = [row['name'] for row in exact if row['agreement_known'] < args.min_agreement]
+        if failing:
+            print(f"Agreement below {args.min_agreement} for: {', '.join(failing)}")
+            raise SystemExit(1)
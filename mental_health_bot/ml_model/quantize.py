@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+
+import numpy as np
+
+from .artifact import DEFAULT_ARTIFACT_DIR, artifact_size, save_artifact, update_manifest
+from .inference import SGDInference
+
+# Smaller artifacts for the size-capped lambda: coef stored as float16 or as
+# int8 with a per-class scale, optionally dropping vocabulary entries whose
+# weight vector is near zero. Every export is scored against the full model.
+QUANTIZATIONS = ('none', 'float16', 'int8')
+
+
+def quantize_coef(coef, quantization):
+    coef = np.asarray(coef, dtype=np.float64)
+    if quantization == 'none':
+        return coef, {}
+    if quantization == 'float16':
+        return coef.astype(np.float16), {}
+    if quantization == 'int8':
+        # Symmetric per-class scale so each row uses the full int8 range
+        scale = np.abs(coef).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        q = np.clip(np.rint(coef / scale[:, None]), -127, 127).astype(np.int8)
+        return q, {'coef_scale': scale.astype(np.float32)}
+    raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+
+
+def prune_vocabulary(vocabulary, idf, coef, threshold):
+    # Drop terms whose largest absolute weight across all classes is at or
+    # below `threshold`. Note this also removes them from the TF-IDF L2 norm,
+    # which is why every export is re-scored against the full model.
+    keep = np.abs(coef).max(axis=0) > threshold
+    old_to_new = np.cumsum(keep) - 1
+    pruned_vocab = {term: int(old_to_new[idx]) for term, idx in vocabulary.items() if keep[idx]}
+    return pruned_vocab, np.asarray(idf)[keep], np.asarray(coef)[:, keep]
+
+
+def synthetic_texts(vocabulary, n=2000, seed=0):
+    # Reproducible stand-in corpus when no labelled data is at hand
+    rng = random.Random(seed)
+    words = sorted(t for t in vocabulary if ' ' not in t)
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(3, 25))) for _ in range(n)]
+
+
+def compare_models(full, variant, texts, labels=None):
+    full_pred = full.predict_batch(texts)
+    variant_pred = variant.predict_batch(texts)
+    prob_delta = np.abs(full.predict_proba_batch(texts) - variant.predict_proba_batch(texts))
+    report = {
+        'n_texts': len(texts),
+        'agreement': float(np.mean([a == b for a, b in zip(full_pred, variant_pred)])),
+        'mean_prob_delta': float(prob_delta.mean()),
+        'max_prob_delta': float(prob_delta.max()),
+    }
+    if labels is not None:
+        report['full_accuracy'] = float(np.mean([p == y for p, y in zip(full_pred, labels)]))
+        report['variant_accuracy'] = float(np.mean([p == y for p, y in zip(variant_pred, labels)]))
+    return report
+
+
+def export_variant(out_dir, src_path=None, quantization='int8', prune_threshold=0.0, texts=None, labels=None):
+    full = SGDInference(src_path, compiled=False)
+    vocabulary, idf, coef = full.vocab, full.idf, full.coef
+    if prune_threshold > 0:
+        vocabulary, idf, coef = prune_vocabulary(vocabulary, idf, coef, prune_threshold)
+
+    coef_q, extra = quantize_coef(coef, quantization)
+    save_artifact(
+        out_dir, vocabulary, idf, coef_q, full.intercept, full.classes,
+        arrays=extra, quantization=quantization, prune_threshold=prune_threshold,
+        # A float32 weight table would undo the size saving; quantized
+        # variants compile per process instead
+        precompile=(quantization == 'none'),
+        source=os.path.abspath(full.model_path),
+    )
+
+    if texts is None:
+        texts = synthetic_texts(full.vocab)
+    report = compare_models(full, SGDInference(out_dir, compiled=False), texts, labels)
+    report['n_features'] = len(vocabulary)
+    report['size_bytes'] = artifact_size(out_dir)
+    update_manifest(out_dir, eval_report=report)
+    return report
+
+
+if __name__ == "__main__":
+    # python -m ml_model.quantize OUT_DIR [--quantization int8] [--prune 0.05] [--eval data.csv]
+    parser = argparse.ArgumentParser(description="Export a quantized and/or pruned inference artifact.")
+    parser.add_argument('out')
+    parser.add_argument('--src', default=None, help="Full model to start from (default: the bundled artifact)")
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default='int8')
+    parser.add_argument('--prune', type=float, default=0.0, help="Drop terms whose max |coef| is at or below this")
+    parser.add_argument('--eval', default=None, help="CSV with text/label columns to score the variant on")
+    parser.add_argument('--eval-rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    texts = labels = None
+    if args.eval:
+        import pandas as pd
+        df = pd.read_csv(args.eval, nrows=args.eval_rows).dropna(subset=['text', 'label'])
+        texts, labels = df['text'].astype(str).tolist(), df['label'].tolist()
+
+    src = args.src or DEFAULT_ARTIFACT_DIR
+    full_size = artifact_size(src) if os.path.isdir(src) else os.path.getsize(src)
+    report = export_variant(args.out, args.src, args.quantization, args.prune, texts, labels)
+    print(f"{args.quantization} / prune {args.prune}: {report['n_features']} features, "
+          f"{report['size_bytes']} bytes (full model {full_size} bytes)")
+    print(f"  agreement with full model: {report['agreement']:.4f} on {report['n_texts']} texts")
+    print(f"  prob delta mean {report['mean_prob_delta']:.5f}, max {report['max_prob_delta']:.5f}")
+    if 'variant_accuracy' in report:
+        print(f"  accuracy: full {report['full_accuracy']:.4f}, variant {report['variant_accuracy']:.4f}")
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .artifact import DEFAULT_ARTIFACT_DIR, MANIFEST_NAME, is_artifact
+from .inference import SGDInference
+
+# Hot-swappable emotion model. The registry holds the active ModelVersion
+# behind a single reference; a request reads `registry.current` once and
+# uses that version throughout, so a swap never mixes two models in one
+# reply and in-flight requests finish on the model they started with.
+#
+# New versions are loaded and checked off the request path when
+#   - the watched path changes (the artifact manifest, which is written
+#     last, or model_params.json), polled every POLL_INTERVAL seconds, or
+#   - load() / rollback() is called (the staff /model/ endpoint), which
+#     also posts the new version to the shared control store so the other
+#     worker processes follow on their next poll.
+# A candidate must keep the same classes, give finite probabilities, agree
+# between the compiled and batch paths and score no more than
+# MAX_ACCURACY_DROP below the active model on the canary set
+# (canary.jsonl); otherwise the active model stays in place.
+#
+# Artifacts are memory-mapped: publish a new version into its own
+# directory and repoint the watched path (a symlink) at it rather than
+# overwriting the files a running model has mapped.
+
+DEFAULT_CANARY_PATH = os.path.join(os.path.dirname(__file__), 'canary.jsonl')
+DEFAULT_JSON = os.path.join(os.path.dirname(__file__), 'model_params.json')
+CONTROL_KEY = 'luma:model:control'
+EMOTION_IDS = {'Sadness': 0, 'Joy': 1, 'Love': 2, 'Anger': 3, 'Fear': 4, 'Surprise': 5}
+
+logger = logging.getLogger(__name__)
+
+
+class ModelValidationError(Exception):
+    pass
+
+
+def default_path():
+    # Same choice as SGDInference(): the artifact, else the JSON export
+    return DEFAULT_ARTIFACT_DIR if is_artifact(DEFAULT_ARTIFACT_DIR) else DEFAULT_JSON
+
+
+def _source_file(path):
+    return os.path.join(path, MANIFEST_NAME) if os.path.isdir(path) else path
+
+
+def path_signature(path):
+    # Changes whenever a model is published at path (or path is repointed)
+    try:
+        stat = os.stat(_source_file(path))
+    except OSError:
+        return None
+    return (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def model_version(path):
+    # Short content hash of the manifest (which lists the hash of every
+    # file in the artifact) or of the JSON export
+    h = hashlib.sha256()
+    with open(_source_file(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def load_canary(path=DEFAULT_CANARY_PATH):
+    # JSONL of {"text", "emotion"} -> (texts, class ids)
+    texts, labels = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                texts.append(entry['text'])
+                labels.append(EMOTION_IDS[entry['emotion']])
+    return texts, labels
+
+
+class ModelVersion:
+    def __init__(self, model, version, path, canary_accuracy=None):
+        self.model = model
+        self.version = version
+        self.path = path
+        self.canary_accuracy = canary_accuracy
+        self.loaded_at = time.time()
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def resource(self, name, factory):
+        # Objects derived from this model (e.g. the retrieval index, whose
+        # vectors depend on the vocabulary), built once per version with
+        # factory(model)
+        if name not in self._resources:
+            with self._lock:
+                if name not in self._resources:
+                    self._resources[name] = factory(self.model)
+        return self._resources[name]
+
+    def cached(self, name):
+        return self._resources.get(name)
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': str(self.path),
+            'loaded_at': round(self.loaded_at, 3),
+            'canary_accuracy': self.canary_accuracy,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, path=None, canary_path=DEFAULT_CANARY_PATH, max_accuracy_drop=0.1,
+                 poll_interval=None, control=None, history=3):
+        self.path = path or default_path()
+        self.canary = load_canary(canary_path) if canary_path and os.path.exists(canary_path) else None
+        self.max_accuracy_drop = max_accuracy_drop
+        self.poll_interval = poll_interval
+        self.control = control  # get/set store shared by the workers, or None
+        self.history = history
+        self.current = None
+        self.previous = []  # older versions for rollback, most recent last
+        self.reloads = {}  # result -> count
+        self.last_error = None
+        self._signature = path_signature(self.path)
+        self._pending = None
+        self._control_seq = None
+        self._swap_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self.load(self.path)
+
+    def get(self):
+        version = self.current
+        return version.model if version else None
+
+    def _count(self, result):
+        self.reloads[result] = self.reloads.get(result, 0) + 1
+
+    def validate(self, model):
+        # Returns the canary accuracy, or raises ModelValidationError
+        current = self.current
+        if current is not None and list(model.classes) != list(current.model.classes):
+            raise ModelValidationError(f"Classes changed from {current.model.classes} to {model.classes}")
+        if not self.canary:
+            return None
+        texts, labels = self.canary
+        if not np.all(np.isfinite(model.predict_proba_batch(texts))):
+            raise ModelValidationError("Non-finite probabilities on the canary set")
+        predicted = list(model.predict_batch(texts))
+        if [model.predict(text) for text in texts] != predicted:
+            raise ModelValidationError("Compiled and batch predictions disagree on the canary set")
+        accuracy = float(np.mean(np.asarray(predicted) == np.asarray(labels)))
+        baseline = current.canary_accuracy if current is not None else None
+        if baseline is not None and accuracy < baseline - self.max_accuracy_drop:
+            raise ModelValidationError(
+                f"Canary accuracy {accuracy:.3f} is more than {self.max_accuracy_drop} below "
+                f"the active model's {baseline:.3f}")
+        return accuracy
+
+    def load(self, path=None):
+        # Load, validate and activate the model at path (default: the
+        # watched path). Returns the new ModelVersion; on failure the active
+        # model is kept and the error is raised.
+        path = path or self.path
+        with self._load_lock:
+            try:
+                model = SGDInference(path, verify=True)
+                candidate = ModelVersion(model, model_version(path), os.path.realpath(path), self.validate(model))
+            except Exception as e:
+                self._count('failed')
+                self.last_error = f"{path}: {e}"
+                logger.warning("Model rejected", extra={'path': str(path), 'error': str(e)})
+                raise
+            self.last_error = None
+            if self.current is not None and candidate.version == self.current.version:
+                return self.current
+            initial = self.current is None
+            self._activate(candidate)
+            if not initial:
+                self._count('success')
+            return candidate
+
+    def _activate(self, version):
+        with self._swap_lock:
+            if self.current is not None:
+                self.previous = [v for v in self.previous if v.version != version.version]
+                self.previous.append(self.current)
+                del self.previous[:-self.history]
+            self.current = version
+        logger.info("Model activated", extra=version.describe())
+
+    def rollback(self):
+        # Reactivate the previous version; the current one is discarded
+        with self._swap_lock:
+            if not self.previous:
+                raise ModelValidationError("No previous model version to roll back to")
+            discarded, self.current = self.current, self.previous.pop()
+        self._count('rollback')
+        logger.info("Model rolled back", extra={'from': discarded.version, **self.current.describe()})
+        return self.current
+
+    def publish(self):
+        # Ask the other workers to switch to the current version
+        if self.control is None:
+            return
+        seq = uuid.uuid4().hex
+        self._control_seq = seq
+        self.control.set(CONTROL_KEY, {
+            'seq': seq,
+            'version': self.current.version,
+            'path': str(self.current.path),
+            'ts': time.time(),
+        }, None)
+
+    def _apply(self, command):
+        target = command.get('version')
+        if self.current is not None and target == self.current.version:
+            return
+        # The latest intent wins: a model published at the watched path
+        # after the command (e.g. a deploy after an earlier rollback)
+        # takes precedence over it, also in workers started later
+        signature = path_signature(self.path)
+        if signature is not None and command.get('ts', 0) * 1e9 < signature[1]:
+            return
+        for index, version in enumerate(self.previous):
+            if version.version == target:
+                with self._swap_lock:
+                    self.previous.pop(index)
+                    self.previous.append(self.current)
+                    self.current = version
+                logger.info("Model switched by control command", extra=version.describe())
+                return
+        path = command.get('path')
+        if not path or path_signature(path) is None or model_version(path) != target:
+            logger.warning("Model version from control command is not available here", extra={'version': target})
+            return
+        self._try_load(path)
+
+    def _try_load(self, path):
+        try:
+            self.load(path)
+        except Exception:
+            pass  # logged and counted by load(); the active model stays
+
+    def poll(self):
+        if self.control is not None:
+            command = self.control.get(CONTROL_KEY)
+            if command and command.get('seq') != self._control_seq:
+                self._control_seq = command.get('seq')
+                self._apply(command)
+        signature = path_signature(self.path)
+        if signature is None or signature == self._signature:
+            self._pending = None
+            return
+        # Act once the path has stayed the same for a whole interval, so a
+        # file that is still being written is not picked up
+        if signature != self._pending:
+            self._pending = signature
+            return
+        self._signature, self._pending = signature, None
+        if self.current is None or model_version(self.path) != self.current.version:
+            self._try_load(self.path)
+
+    def watch(self):
+        # Starts the polling thread (again after a fork, which doesn't copy
+        # threads); a no-op without poll_interval or when already running
+        if not self.poll_interval:
+            return
+        if self._watcher_pid == os.getpid() and self._watcher is not None and self._watcher.is_alive():
+            return
+        with self._swap_lock:
+            if self._watcher_pid == os.getpid() and self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher_pid = os.getpid()
+            self._watcher = threading.Thread(target=self._watch_loop, name='luma-model-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Model watcher poll failed")
+
+    def status(self):
+        return {
+            'path': str(self.path),
+            'current': self.current.describe() if self.current else None,
+            'previous': [v.describe() for v in reversed(self.previous)],
+            'reloads': dict(self.reloads),
+            'last_error': self.last_error,
+        }
+
+
+def make_registry(config=None, control=None):
+    # config: {'PATH', 'POLL_INTERVAL', 'CANARY', 'MAX_ACCURACY_DROP', 'HISTORY'}
+    config = config or {}
+    return ModelRegistry(
+        path=config.get('PATH'),
+        canary_path=config.get('CANARY', DEFAULT_CANARY_PATH),
+        max_accuracy_drop=config.get('MAX_ACCURACY_DROP', 0.1),
+        poll_interval=config.get('POLL_INTERVAL'),
+        control=control,
+        history=config.get('HISTORY', 3),
+    )
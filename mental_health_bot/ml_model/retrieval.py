@@ -0,0 +1,183 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+
+import numpy as np
+
+from .inference import SGDInference
+
+# Nearest-neighbour lookup of vetted replies. Each entry is a representative
+# user message plus a reply written/approved offline; messages are embedded
+# with the classifier's own TF-IDF vectors (L2-normalised, so a dot product
+# is the cosine similarity) and stored as an inverted index: for every
+# feature, the entries that contain it and their weights.
+INDEX_VERSION = 1
+DEFAULT_SEED_PATH = os.path.join(os.path.dirname(__file__), 'retrieval_seed.jsonl')
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(__file__), 'retrieval_index')
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalIndexError(Exception):
+    pass
+
+
+def vocab_fingerprint(vocab):
+    # Index vectors are only meaningful for the vocabulary they were built with
+    terms = sorted(vocab, key=vocab.get)
+    return hashlib.sha256('\n'.join(terms).encode('utf-8')).hexdigest()
+
+
+def load_entries(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                entries.append({
+                    'message': entry['message'],
+                    'reply': entry['reply'],
+                    'emotion': entry.get('emotion'),
+                })
+    return entries
+
+
+def index_arrays(entries, model):
+    # -> (indexed entries, skipped messages, postings ptr, entry, weight).
+    # Messages with no term in the model vocabulary can never be retrieved.
+    indptr, _, _ = model.vectorize_batch([e['message'] for e in entries])
+    skipped = [e['message'] for e, n in zip(entries, np.diff(indptr)) if n == 0]
+    if skipped:
+        entries = [e for e, n in zip(entries, np.diff(indptr)) if n > 0]
+    indptr, indices, data = model.vectorize_batch([e['message'] for e in entries])
+
+    # CSR (entry -> features) to postings (feature -> entries)
+    rows = np.repeat(np.arange(len(entries)), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    postings_ptr = np.zeros(len(model.vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=len(model.vocab)), out=postings_ptr[1:])
+    return entries, skipped, postings_ptr, rows[order].astype(np.int32), data[order].astype(np.float32)
+
+
+def build_index(entries, model, out_dir=DEFAULT_INDEX_DIR):
+    # A seed message with no term in the vocabulary would never match, so
+    # the build fails rather than quietly leaving it out
+    entries, skipped, ptr, entry, weight = index_arrays(entries, model)
+    if skipped:
+        raise RetrievalIndexError(f"{len(skipped)} messages have no term in the model vocabulary: {skipped}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.savez(os.path.join(out_dir, 'postings.npz'), ptr=ptr, entry=entry, weight=weight)
+    with open(os.path.join(out_dir, 'entries.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': INDEX_VERSION,
+            'vocab_fingerprint': vocab_fingerprint(model.vocab),
+            'entries': entries,
+        }, f, indent=1, ensure_ascii=False)
+    return len(entries)
+
+
+class ReplyIndex:
+    # source: 'index' when loaded from a built index, 'seed' when built in
+    # memory from the seed file
+    def __init__(self, model, index_dir=DEFAULT_INDEX_DIR, threshold=0.7):
+        with open(os.path.join(index_dir, 'entries.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise RetrievalIndexError(f"Unsupported retrieval index version {meta.get('version')}")
+        if meta['vocab_fingerprint'] != vocab_fingerprint(model.vocab):
+            raise RetrievalIndexError("Retrieval index was built for a different model vocabulary; rebuild it")
+        postings = np.load(os.path.join(index_dir, 'postings.npz'))
+        self._setup(model, meta['entries'], postings['ptr'], postings['entry'], postings['weight'], threshold)
+        self.source = 'index'
+
+    @classmethod
+    def from_entries(cls, model, entries, threshold=0.7):
+        # Built in memory for this model's vocabulary, without touching disk
+        index = cls.__new__(cls)
+        entries, skipped, ptr, entry, weight = index_arrays(entries, model)
+        if skipped:
+            logger.warning("Retrieval entries with no known terms skipped", extra={'count': len(skipped), 'messages': skipped})
+        index._setup(model, entries, ptr, entry, weight, threshold)
+        index.source = 'seed'
+        return index
+
+    def _setup(self, model, entries, ptr, entry, weight, threshold):
+        self.model = model
+        self.threshold = threshold
+        self.entries = entries
+        self.entry_emotions = np.array([e['emotion'] or '' for e in self.entries])
+        self.ptr = ptr
+        self.entry = entry
+        self.weight = weight
+        self.hits = 0
+        self.misses = 0
+
+    def similarities(self, text):
+        indptr, indices, data = self.model.vectorize_batch([text])
+        if not data.size:
+            return None
+        starts, ends = self.ptr[indices], self.ptr[indices + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return None
+        # Gather the postings of every query feature in one go
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = self.weight[offsets] * np.repeat(data, lengths)
+        return np.bincount(self.entry[offsets], weights=weights, minlength=len(self.entries))
+
+    def query(self, text, emotion=None):
+        # Returns (reply, similarity) for the closest entry above the
+        # threshold, or None. Entries tagged with an emotion only match that
+        # emotion; ties pick at random so duplicate messages rotate replies.
+        sims = self.similarities(text)
+        if sims is not None and emotion is not None:
+            sims[(self.entry_emotions != '') & (self.entry_emotions != emotion)] = 0.0
+        if sims is None or sims.max() < self.threshold:
+            self.misses += 1
+            return None
+        best = sims.max()
+        candidates = np.flatnonzero(sims >= best - 1e-6)
+        self.hits += 1
+        return self.entries[int(random.choice(candidates))]['reply'], float(best)
+
+
+def load_reply_index(model, index_dir=DEFAULT_INDEX_DIR, threshold=0.7, seed_path=DEFAULT_SEED_PATH):
+    # None when there is no index, so callers simply skip retrieval. An
+    # index built for another vocabulary (e.g. after a hot reload to a
+    # retrained model) is rebuilt in memory from seed_path; without a seed
+    # file retrieval is disabled.
+    if model is None or not os.path.exists(os.path.join(index_dir, 'entries.json')):
+        return None
+    try:
+        return ReplyIndex(model, index_dir, threshold)
+    except RetrievalIndexError as e:
+        if not seed_path or not os.path.exists(seed_path):
+            logger.warning("Retrieval index disabled", extra={'error': str(e)})
+            return None
+        logger.warning("Retrieval index rebuilt from the seed file", extra={'error': str(e), 'seed': seed_path})
+        return ReplyIndex.from_entries(model, load_entries(seed_path), threshold)
+
+
+if __name__ == "__main__":
+    # python -m ml_model.retrieval [--seed retrieval_seed.jsonl] [--out retrieval_index] [--query TEXT]
+    parser = argparse.ArgumentParser(description="Build or query the vetted-reply retrieval index.")
+    parser.add_argument('--seed', default=DEFAULT_SEED_PATH, help="JSONL of {message, reply, emotion}")
+    parser.add_argument('--out', default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--model', default=None, help="Model artifact / JSON (default: bundled)")
+    parser.add_argument('--query', action='append', help="Query the existing index instead of building")
+    parser.add_argument('--threshold', type=float, default=0.7)
+    args = parser.parse_args()
+
+    model = SGDInference(args.model)
+    if args.query:
+        index = ReplyIndex(model, args.out, args.threshold)
+        for q in args.query:
+            print(f"'{q}' => {index.query(q)}")
+    else:
+        n = build_index(load_entries(args.seed), model, args.out)
+        print(f"Indexed {n} replies into {args.out}")
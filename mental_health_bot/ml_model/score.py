@@ -0,0 +1,238 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .inference import SGDInference
+from .registry import EMOTION_IDS
+
+# Offline bulk scoring of CSV / JSONL files (exported chat logs, datasets):
+#
+#   python -m ml_model.score chats.csv --out scored.csv [--workers 8]
+#   python -m ml_model.score chats.jsonl --text-col message --keep id --out scored.jsonl
+#
+# The input is read as a stream in batches of --batch-size rows. Batches
+# are scored and formatted in a pool of worker processes, each with its own
+# SGDInference over the same memory-mapped artifact, and written in input
+# order as they complete. At most --max-pending batches are in flight, so
+# memory stays flat however large the file. Each output row
+# holds the --keep columns, the label (emotion name), label_id, margin and
+# one p_<Emotion> probability column per class. Progress and the final
+# rows/s and peak memory go to stderr.
+
+EMOTION_NAMES = {v: k for k, v in EMOTION_IDS.items()}
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+_model = None
+_formatter = None
+
+
+def _init_worker(model_path, fmt, keep):
+    global _model, _formatter
+    _model = SGDInference(model_path, compiled=False)
+    _formatter = Formatter(fmt, keep, _model.classes)
+
+
+def score_batch(texts, model=None):
+    # -> (class ids, probabilities (n x n_classes), margins); messages
+    # without a known term get classes[0] like SGDInference.predict()
+    model = model or _model
+    scores, non_empty = model.decision_function_batch(texts)
+    proba = model.proba_from_scores(scores)
+    best = np.where(non_empty, np.argmax(scores, axis=1), 0)
+    top2 = np.partition(proba, -2, axis=1)[:, -2:]
+    margins = np.where(non_empty, top2[:, 1] - top2[:, 0], 0.0)
+    labels = [model.classes[i] for i in best]
+    return labels, proba, margins
+
+
+def score_chunk(texts, kept, expected=None, model=None, formatter=None):
+    # Scores a batch and formats its output rows, so the parent process
+    # only has to read input and write strings. Returns (output text,
+    # labelled rows, correct labels).
+    labels, proba, margins = score_batch(texts, model)
+    labelled = correct = 0
+    if expected is not None:
+        for label, truth in zip(labels, expected):
+            if truth not in (None, ''):
+                labelled += 1
+                correct += int(str(truth) == str(label))
+    return (formatter or _formatter).format(kept, labels, proba, margins), labelled, correct
+
+
+def _format_of(path, override=None):
+    if override:
+        return override
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def iter_rows(f, fmt):
+    # Yields dicts, one per input row
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Formatter:
+    def __init__(self, fmt, keep, classes):
+        self.fmt = fmt
+        self.keep = list(keep)
+        self.prob_cols = [f"p_{EMOTION_NAMES.get(int(c), c)}" for c in classes]
+        self.columns = self.keep + ['label', 'label_id', 'margin'] + self.prob_cols
+
+    def header(self):
+        if self.fmt != 'csv':
+            return ''
+        buf = io.StringIO()
+        csv.writer(buf).writerow(self.columns)
+        return buf.getvalue()
+
+    def format(self, kept, labels, proba, margins):
+        # kept: one list of --keep values per row
+        buf = io.StringIO()
+        writer = csv.writer(buf) if self.fmt == 'csv' else None
+        margins = [f"{m:.4f}" for m in margins.tolist()]
+        probs = [[f"{p:.4f}" for p in row] for row in proba.tolist()]
+        for values, label, margin, row_probs in zip(kept, labels, margins, probs):
+            row = values + [EMOTION_NAMES.get(int(label), label), int(label), margin] + row_probs
+            if writer:
+                writer.writerow(row)
+            else:
+                record = dict(zip(self.columns, row))
+                record['margin'] = float(margin)
+                for col, p in zip(self.prob_cols, row_probs):
+                    record[col] = float(p)
+                buf.write(json.dumps(record) + '\n')
+        return buf.getvalue()
+
+
+def peak_rss_mib():
+    # (this process, largest finished child) in MiB, or Nones where the
+    # platform can't tell; ru_maxrss is in KiB on Linux, bytes on macOS
+    if resource is None:
+        return None, None
+    divisor = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor)
+
+
+def score_file(in_path, out, text_col='text', keep=(), label_col=None, model_path=None,
+               workers=None, batch_size=5000, max_pending=None, fmt=None, out_fmt='csv',
+               progress_every=5.0, log=sys.stderr):
+    # Returns a stats dict: rows, seconds, rows_per_s, peak memory and, with
+    # label_col, accuracy against it
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    model = SGDInference(model_path, compiled=False)
+    formatter = Formatter(out_fmt, keep, model.classes)
+    out.write(formatter.header())
+    stats = {'rows': 0, 'correct': 0, 'labelled': 0}
+    started = last_report = time.perf_counter()
+
+    def split(rows):
+        texts = [str(row.get(text_col) or '') for row in rows]
+        kept = [[row.get(c, '') for c in formatter.keep] for row in rows]
+        expected = [row.get(label_col) for row in rows] if label_col else None
+        return texts, kept, expected
+
+    def flush(n_rows, result):
+        nonlocal last_report
+        text, labelled, correct = result
+        out.write(text)
+        stats['rows'] += n_rows
+        stats['labelled'] += labelled
+        stats['correct'] += correct
+        now = time.perf_counter()
+        if now - last_report >= progress_every:
+            last_report = now
+            print(f"{stats['rows']:,} rows, {stats['rows'] / (now - started):,.0f} rows/s", file=log)
+
+    with open(in_path, 'r', encoding='utf-8', newline='') as f:
+        batches = iter_batches(iter_rows(f, _format_of(in_path, fmt)), batch_size)
+        if workers == 1:
+            for rows in batches:
+                flush(len(rows), score_chunk(*split(rows), model=model, formatter=formatter))
+        else:
+            pending = deque()
+            initargs = (model.model_path, out_fmt, formatter.keep)
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+                for rows in batches:
+                    pending.append((len(rows), pool.submit(score_chunk, *split(rows))))
+                    # Write finished batches in order; block on the oldest
+                    # once max_pending are queued so reading can't run ahead
+                    while pending and (len(pending) >= max_pending or pending[0][1].done()):
+                        n_rows, future = pending.popleft()
+                        flush(n_rows, future.result())
+                while pending:
+                    n_rows, future = pending.popleft()
+                    flush(n_rows, future.result())
+
+    seconds = time.perf_counter() - started
+    own, children = peak_rss_mib()
+    result = {
+        'rows': stats['rows'],
+        'seconds': round(seconds, 3),
+        'rows_per_s': round(stats['rows'] / seconds, 1) if seconds else 0.0,
+        'workers': workers,
+        'peak_rss_mib': round(own, 1) if own is not None else None,
+        'peak_worker_rss_mib': round(children, 1) if children is not None else None,
+    }
+    if label_col and stats['labelled']:
+        result['accuracy'] = round(stats['correct'] / stats['labelled'], 4)
+        result['labelled'] = stats['labelled']
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a CSV/JSONL file with the emotion model.")
+    parser.add_argument('input', help="CSV or JSONL file")
+    parser.add_argument('--out', default='-', help="Output file (.csv or .jsonl; default: CSV on stdout)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help="Input format (default: from the extension)")
+    parser.add_argument('--text-col', default='text')
+    parser.add_argument('--keep', default='', help="Comma-separated input columns to copy to the output")
+    parser.add_argument('--label-col', default=None, help="Column with true class ids; reports accuracy")
+    parser.add_argument('--model', default=None, help="Artifact directory or model_params.json (default: bundled)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores; 1 = no pool)")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--max-pending', type=int, default=None, help="Batches in flight (default: 2 per worker)")
+    args = parser.parse_args()
+
+    keep = [c for c in args.keep.split(',') if c]
+    out_fmt = 'jsonl' if args.out.endswith(('.jsonl', '.ndjson')) else 'csv'
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8', newline='')
+    try:
+        stats = score_file(
+            args.input, out, text_col=args.text_col, keep=keep, label_col=args.label_col,
+            model_path=args.model, workers=args.workers, batch_size=args.batch_size,
+            max_pending=args.max_pending, fmt=args.format, out_fmt=out_fmt,
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps(stats), file=sys.stderr)
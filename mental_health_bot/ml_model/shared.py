@@ -0,0 +1,42 @@
+import gc
+import threading
+
+from .registry import make_registry
+
+# One model registry (and so one active SGDInference) per process. Under a
+# pre-forking server (see gunicorn.conf.py) it is built in the master
+# before fork, which saves each worker loading it. Only the arrays are
+# really shared: they are read-only mmaps of the artifact, served from the
+# page cache. The vocab dict and the other Python objects are inherited
+# copy-on-write, but every lookup updates the refcounts of the objects it
+# touches, so each worker gradually ends up with its own copy of those
+# pages. A version hot-loaded later in a worker is private to that worker.
+_registry = None
+_lock = threading.Lock()
+
+
+def get_registry(config=None, control=None):
+    # config and control (see registry.make_registry) only apply to the
+    # first call in the process
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = make_registry(config, control)
+    return _registry
+
+
+def get_model():
+    return get_registry().get()
+
+
+def preload():
+    # Call in the master just before forking workers. gc.freeze() moves
+    # everything allocated so far into the permanent generation, so the
+    # collector in each worker doesn't also write to those objects' headers.
+    # It can't stop refcount updates, so this only slows how fast a worker
+    # copies the vocab pages.
+    model = get_model()
+    gc.collect()
+    gc.freeze()
+    return model
@@ -2,6 +2,9 @@ import joblib
 import os
 import sys
 
+# The model's six classes (nelgiriyewithana/emotions), same mapping as the apps
+EMOTION_MAP = {0: 'Sadness', 1: 'Joy', 2: 'Love', 3: 'Anger', 4: 'Fear', 5: 'Surprise'}
+
 def test_model():
     model_path = os.path.join(os.path.dirname(__file__), 'emotion_model.pkl')
     
@@ -16,22 +19,22 @@ def test_model():
         print(f"❌ Error loading model: {e}")
         return
 
-    # Test cases covering all categories
+    # Test cases covering all six classes the model can predict
     test_cases = [
-        ("I feel so alone and sad", "Sad/Depressed"),
-        ("I am super excited about the news!", "Happy/Positive"),
-        ("I am really worried about the exam", "Anxious/Stressed"),
-        ("I am so angry at him", "Anger/Frustration"),
-        ("I'm scared of the dark", "Fear/Panic"),
-        ("I feel guilty for what I said", "Guilt/Shame"),
-        ("I have no friends", "Lonely/Isolated"),
-        ("I am just walking to the park", "Neutral"),
+        ("I feel so alone and sad", "Sadness"),
+        ("I have no friends", "Sadness"),
+        ("I am super excited about the news!", "Joy"),
+        ("I love spending time with my family", "Love"),
+        ("I am so angry at him", "Anger"),
+        ("I am really worried about the exam", "Fear"),
+        ("I'm scared of the dark", "Fear"),
+        ("I was so shocked and amazed by the news", "Surprise"),
     ]
 
     print("\n--- Testing Model Predictions ---")
     correct = 0
     for text, expected in test_cases:
-        prediction = model.predict([text])[0]
+        prediction = EMOTION_MAP.get(int(model.predict([text])[0]), "Unknown")
         match = "✅" if prediction == expected else "❌"
         if prediction == expected:
             correct += 1
@@ -0,0 +1,313 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from .artifact import DEFAULT_ARTIFACT_DIR, ArtifactError, load_artifact, publish, save_artifact
+from .benchmark import compare
+from .inference import SGDInference
+from .quantize import synthetic_texts
+from .registry import CONTROL_KEY, ModelRegistry, ModelValidationError, model_version
+from .retrieval import DEFAULT_SEED_PATH, RetrievalIndexError, build_index, load_entries, load_reply_index
+
+
+class DictStore:
+    # Stand-in for the cache the workers share
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+
+def save_variant(out_dir, coef_scale=1.0, shuffle=False, reorder=False):
+    # A copy of the bundled model: with scaled coefficients (a new version
+    # with the same predictions), shuffled ones (a broken model) or its
+    # vocabulary columns reversed (a "retrained" vocabulary, same predictions)
+    d = load_artifact(DEFAULT_ARTIFACT_DIR, mmap=False)
+    vocabulary, idf, coef = d['vocabulary'], np.asarray(d['idf']), np.asarray(d['coef']) * coef_scale
+    if shuffle:
+        coef = np.random.default_rng(0).permutation(coef, axis=1)
+    if reorder:
+        order = np.arange(len(vocabulary))[::-1]
+        vocabulary = {term: len(vocabulary) - 1 - idx for term, idx in vocabulary.items()}
+        idf, coef = idf[order], coef[:, order]
+    save_artifact(out_dir, vocabulary, idf, coef, d['intercept'], d['classes'])
+    return out_dir
+
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "!!! ??",
+    "a b c",  # no token of two or more characters
+    "zxqv blorptastic wubwub",  # only out-of-vocabulary words
+    "sad sad sad sad sad",
+    "happy happy joy joy happy",
+    "I feel so alone and sad",
+    "I AM SO ANGRY AT HIM!!!",
+]
+
+
+class InferenceTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = SGDInference()
+        # The original float64 path: predict() through vectorize_batch
+        cls.reference = SGDInference(compiled=False)
+        cls.texts = EDGE_CASES + synthetic_texts(cls.model.vocab, n=300, seed=1)
+
+
+class BatchPathTests(InferenceTestCase):
+    def test_batch_matches_one_at_a_time(self):
+        labels = self.model.predict_batch(self.texts)
+        self.assertEqual(labels, [self.model.predict(t) for t in self.texts])
+        self.assertEqual(labels, [self.reference.predict(t) for t in self.texts])
+        np.testing.assert_allclose(
+            self.model.predict_proba_batch(self.texts),
+            np.array([self.reference.predict_proba(t) for t in self.texts]), rtol=0, atol=1e-12)
+
+    def test_messages_without_known_terms(self):
+        empty = EDGE_CASES[:5]
+        indptr, indices, data = self.model.vectorize_batch(empty + ["I feel sad"] + empty)
+        self.assertEqual(np.diff(indptr).tolist()[:5], [0] * 5)
+        self.assertEqual(np.diff(indptr).tolist()[6:], [0] * 5)
+        self.assertTrue(np.diff(indptr)[5] > 0)
+        self.assertEqual(self.model.predict_batch(empty), [self.model.classes[0]] * len(empty))
+        fallback = self.model.proba_from_scores(self.model.intercept)
+        for prob in self.model.predict_proba_batch(empty):
+            np.testing.assert_allclose(prob, fallback)
+
+    def test_repeated_tokens_are_counted(self):
+        indptr, indices, data = self.model.vectorize_batch(["sad", "sad sad sad sad sad"])
+        sad = self.model.vocab['sad']
+        self.assertEqual(indices[indptr[0]:indptr[1]].tolist(), [sad])
+        self.assertEqual(self.model.accumulate("sad sad sad sad sad"), {sad: 5})
+        # Rows are L2-normalised whatever the counts
+        for start, end in zip(indptr[:-1], indptr[1:]):
+            self.assertAlmostEqual(float(np.sum(data[start:end] ** 2)), 1.0)
+
+
+class CompiledScoringTests(InferenceTestCase):
+    def check_against_reference(self, model):
+        for text in self.texts:
+            label, prob, margin = model.classify(text)
+            ref_label, ref_prob, ref_margin = self.reference.classify(text)
+            with self.subTest(text=text):
+                self.assertEqual(label, ref_label)
+                self.assertEqual(model.predict(text), ref_label)
+                # float32 weights: agreement to ~1e-6 on probabilities
+                np.testing.assert_allclose(prob, ref_prob, rtol=0, atol=1e-5)
+                self.assertAlmostEqual(margin, ref_margin, delta=2e-5)
+
+    def test_precompiled_artifact_matches_original_predict(self):
+        self.assertTrue(self.model.model_data.get('precompiled'))
+        self.check_against_reference(self.model)
+
+    def test_compiled_in_process_matches_original_predict(self):
+        self.check_against_reference(SGDInference(os.path.join(os.path.dirname(__file__), 'model_params.json')))
+
+
+class ClassifyTests(InferenceTestCase):
+    def test_classify_agrees_with_predict_and_predict_proba(self):
+        for model in (self.model, self.reference):
+            # (messages without known terms are covered below)
+            for text in self.texts[5:65]:
+                label, prob, margin = model.classify(text)
+                with self.subTest(text=text, compiled=model.compiled):
+                    self.assertEqual(label, model.predict(text))
+                    np.testing.assert_allclose(prob, model.predict_proba(text))
+                    self.assertAlmostEqual(float(prob.sum()), 1.0, places=6)
+                    top = np.sort(prob)[::-1]
+                    self.assertAlmostEqual(margin, float(top[0] - top[1]), places=6)
+                    self.assertGreaterEqual(margin, 0.0)
+
+    def test_margin(self):
+        self.assertAlmostEqual(SGDInference.margin(np.array([0.2, 0.5, 0.3])), 0.2)
+        self.assertEqual(SGDInference.margin(np.array([0.4, 0.4, 0.2])), 0.0)
+
+    def test_no_known_terms(self):
+        label, prob, margin = self.model.classify("zxqv blorptastic")
+        self.assertEqual((label, margin), (self.model.classes[0], 0.0))
+        np.testing.assert_allclose(prob, self.model.proba_from_scores(self.model.intercept))
+
+
+class RegistryTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.v1 = os.path.join(cls.root, 'v1')
+        shutil.copytree(DEFAULT_ARTIFACT_DIR, cls.v1)
+        cls.v2 = save_variant(os.path.join(cls.root, 'v2'), coef_scale=1.01)
+        cls.bad = save_variant(os.path.join(cls.root, 'bad'), shuffle=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.link = os.path.join(self.root, f'current-{self.id()}')
+        os.symlink(self.v1, self.link)
+        self.addCleanup(os.remove, self.link)
+
+    def point(self, target):
+        # Repoint the watched symlink, as a deploy would
+        publish(target, self.link)
+
+
+class ArtifactPublishTests(RegistryTestCase):
+    def test_existing_artifact_is_never_overwritten(self):
+        before = model_version(self.v1)
+        with self.assertRaises(ArtifactError):
+            save_variant(self.v1, coef_scale=2.0)
+        with self.assertRaises(ArtifactError):
+            save_variant(self.link, coef_scale=2.0)
+        self.assertEqual(model_version(self.v1), before)
+        # Nothing left behind by the refused writes
+        self.assertEqual(sorted(n for n in os.listdir(self.root) if n.startswith('.')), [])
+
+    def test_publish_repoints_the_link(self):
+        self.point(self.v2)
+        self.assertEqual(os.path.realpath(self.link), os.path.realpath(self.v2))
+        self.assertEqual(model_version(self.link), model_version(self.v2))
+        with self.assertRaises(ArtifactError):
+            publish(self.v2, self.v1)
+
+
+class ModelRegistryTests(RegistryTestCase):
+    def test_swap_on_poll(self):
+        registry = ModelRegistry(self.link)
+        first = registry.current
+        self.point(self.v2)
+        registry.poll()  # change seen, waits for it to settle
+        self.assertIs(registry.current, first)
+        registry.poll()
+        self.assertEqual(registry.current.version, model_version(self.v2))
+        self.assertEqual(registry.previous, [first])
+        self.assertEqual(registry.reloads, {'success': 1})
+        # A request holding the old version still has a working model
+        self.assertEqual(first.model.predict("I feel sad"), registry.get().predict("I feel sad"))
+
+    def test_canary_rejection_keeps_active_model(self):
+        registry = ModelRegistry(self.link)
+        first = registry.current
+        with self.assertRaises(ModelValidationError), self.assertLogs('ml_model.registry', 'WARNING'):
+            registry.load(self.bad)
+        self.assertIs(registry.current, first)
+        self.assertEqual(registry.reloads, {'failed': 1})
+        self.assertIn('Canary accuracy', registry.last_error)
+
+        self.point(self.bad)
+        with self.assertLogs('ml_model.registry', 'WARNING'):
+            registry.poll()
+            registry.poll()
+        self.assertIs(registry.current, first)
+
+    def test_rollback(self):
+        registry = ModelRegistry(self.link)
+        first = registry.current
+        registry.load(self.v2)
+        registry.rollback()
+        self.assertIs(registry.current, first)
+        self.assertEqual(registry.previous, [])
+        self.assertEqual(registry.reloads, {'success': 1, 'rollback': 1})
+        with self.assertRaises(ModelValidationError):
+            registry.rollback()
+
+
+class ControlCommandTests(RegistryTestCase):
+    def test_other_workers_follow(self):
+        store = DictStore()
+        admin, worker = ModelRegistry(self.link, control=store), ModelRegistry(self.link, control=store)
+        admin.load(self.v2)
+        admin.publish()
+        worker.poll()
+        self.assertEqual(worker.current.version, model_version(self.v2))
+        # ... and back, from the versions it keeps
+        admin.rollback()
+        admin.publish()
+        worker.poll()
+        self.assertEqual(worker.current.version, model_version(self.v1))
+
+    def test_newer_deploy_wins_over_command(self):
+        store = DictStore()
+        admin = ModelRegistry(self.link, control=store)
+        admin.load(self.v2)
+        admin.publish()
+        time.sleep(0.01)
+        # Deployed after the command: a worker started now keeps it
+        v3 = save_variant(os.path.join(self.root, f'v3-{self.id()}'), coef_scale=1.02)
+        self.addCleanup(shutil.rmtree, v3)
+        self.point(v3)
+        worker = ModelRegistry(self.link, control=store)
+        worker.poll()
+        self.assertEqual(worker.current.version, model_version(v3))
+
+    def test_newer_command_wins_over_deploy(self):
+        store = DictStore()
+        admin = ModelRegistry(self.link, control=store)
+        admin.load(self.v2)
+        admin.publish()
+        worker = ModelRegistry(self.link, control=store)
+        self.assertEqual(worker.current.version, model_version(self.v1))
+        worker.poll()
+        self.assertEqual(worker.current.version, model_version(self.v2))
+        self.assertEqual(store.get(CONTROL_KEY)['version'], model_version(self.v2))
+
+
+class RetrievalReloadTests(RegistryTestCase):
+    def test_index_rebuilt_for_new_vocabulary(self):
+        retrained = SGDInference(save_variant(os.path.join(self.root, 'retrained'), reorder=True))
+        with self.assertLogs('ml_model.retrieval', 'WARNING'):
+            index = load_reply_index(retrained)
+        self.assertEqual(index.source, 'seed')
+        bundled = load_reply_index(SGDInference(self.v1))
+        self.assertEqual(bundled.source, 'index')
+        self.assertEqual(len(index.entries), len(bundled.entries))
+        self.assertIsNotNone(index.query("hey how are you"))
+
+    def test_disabled_without_seed(self):
+        retrained = SGDInference(save_variant(os.path.join(self.root, 'retrained-noseed'), reorder=True))
+        with self.assertLogs('ml_model.retrieval', 'WARNING'):
+            self.assertIsNone(load_reply_index(retrained, seed_path=None))
+
+    def test_build_rejects_unindexable_messages(self):
+        entries = load_entries(DEFAULT_SEED_PATH) + [{'message': "hi", 'reply': "Hi!", 'emotion': None}]
+        with self.assertRaises(RetrievalIndexError):
+            build_index(entries, SGDInference(self.v1), os.path.join(self.root, 'index'))
+        # The bundled seed indexes in full
+        self.assertEqual(build_index(entries[:-1], SGDInference(self.v1), os.path.join(self.root, 'index')), len(entries) - 1)
+
+
+def bench(calibration=100.0, **values):
+    results = {name: {'value': value, 'unit': 'msgs/s' if name.startswith('batch') else 'us',
+                      'better': 'higher' if name.startswith('batch') else 'lower'}
+               for name, value in values.items()}
+    results['calibration_us'] = {'value': calibration, 'unit': 'us', 'better': 'lower'}
+    return {'results': results}
+
+
+class BenchmarkCompareTests(unittest.TestCase):
+    def test_jitter_under_the_noise_floor_is_ignored(self):
+        baseline = bench(predict_5w_p50_us=15.8)
+        self.assertEqual(compare(bench(predict_5w_p50_us=22.7), baseline), [])
+        self.assertEqual([r[0] for r in compare(bench(predict_5w_p50_us=32.0), baseline)], ['predict_5w_p50_us'])
+
+    def test_noisy_metrics_get_a_wider_tolerance(self):
+        baseline = bench(predict_320w_p50_us=200.0, predict_320w_p95_us=200.0)
+        current = bench(predict_320w_p50_us=280.0, predict_320w_p95_us=280.0)
+        self.assertEqual([r[0] for r in compare(current, baseline)], ['predict_320w_p50_us'])
+
+    def test_baseline_scaled_to_a_slower_machine(self):
+        baseline = bench(predict_320w_p50_us=200.0, batch_synthetic_msgs_per_s=50000.0)
+        slower = bench(calibration=150.0, predict_320w_p50_us=290.0, batch_synthetic_msgs_per_s=35000.0)
+        self.assertEqual(compare(slower, baseline), [])
+        # A faster calibration never tightens the gate
+        faster = bench(calibration=50.0, predict_320w_p50_us=240.0, batch_synthetic_msgs_per_s=45000.0)
+        self.assertEqual(compare(faster, baseline), [])
@@ -1,54 +1,103 @@
+import argparse
+import heapq
+from collections import Counter
+
+import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 from sklearn.linear_model import SGDClassifier
 from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import normalize
 import joblib
 import os
+import time
+
+try:
+    from .artifact import publish, save_artifact
+except ImportError:
+    # Run as a script: python train_model.py from inside ml_model/
+    from artifact import publish, save_artifact
 
 # Define paths
 current_dir = os.path.dirname(__file__)
 data_path = os.path.join(current_dir, 'data', 'text.csv')
 model_path = os.path.join(current_dir, 'emotion_model.pkl')
+# Each training run writes a new artifact here; running models keep theirs
+releases_dir = os.path.join(current_dir, 'releases')
+
+MAX_FEATURES = 5000
+NGRAM_RANGE = (1, 2)
+
+
+def normalize_columns(df):
+    # Verify columns
+    if 'text' not in df.columns or 'label' not in df.columns:
+        if 'text' not in df.columns:
+            text_col = [c for c in df.columns if 'text' in c.lower()]
+            if text_col:
+                df = df.rename(columns={text_col[0]: 'text'})
+        if 'label' not in df.columns:
+            label_col = [c for c in df.columns if 'label' in c.lower()]
+            if label_col:
+                df = df.rename(columns={label_col[0]: 'label'})
+    return df
+
+
+def new_release_dir():
+    return os.path.join(releases_dir, time.strftime('%Y%m%d-%H%M%S'))
+
+
+def export_pipeline(text_clf, out_dir):
+    # Write a fitted CountVectorizer/TfidfTransformer/SGDClassifier pipeline
+    # as the artifact SGDInference loads
+    vect = text_clf.named_steps['vect']
+    tfidf = text_clf.named_steps['tfidf']
+    clf = text_clf.named_steps['clf']
+    vocabulary = {term: int(idx) for term, idx in vect.vocabulary_.items()}
+    return save_artifact(
+        out_dir, vocabulary, tfidf.idf_, clf.coef_, clf.intercept_,
+        clf.classes_.tolist(), source='pipeline',
+    )
 
-def train_model():
+
+def train_model(path=data_path, export_dir=None, publish_to=None):
+    export_dir = export_dir or new_release_dir()
+    if os.path.lexists(export_dir):
+        print(f"Error: {export_dir} already exists; choose a new --out directory")
+        return
     print("Loading dataset...")
     try:
         # Check if data file exists
-        if not os.path.exists(data_path):
-            print(f"Error: Data file not found at {data_path}")
+        if not os.path.exists(path):
+            print(f"Error: Data file not found at {path}")
             return
 
-        df = pd.read_csv(data_path)
-        # Verify columns
-        if 'text' not in df.columns or 'label' not in df.columns:
-            print("Columns found:", df.columns)
-            if 'text' not in df.columns:
-                text_col = [c for c in df.columns if 'text' in c.lower()]
-                if text_col:
-                    df.rename(columns={text_col[0]: 'text'}, inplace=True)
-            if 'label' not in df.columns:
-                label_col = [c for c in df.columns if 'label' in c.lower()]
-                if label_col:
-                    df.rename(columns={label_col[0]: 'label'}, inplace=True)
-        
+        df = normalize_columns(pd.read_csv(path))
+
         X = df['text']
         y = df['label']
-        
+
         print(f"Training on {len(df)} samples...")
-        
+
         # Create Pipeline with reduced max_features for smaller model size
         text_clf = Pipeline([
-            ('vect', CountVectorizer(ngram_range=(1, 2), max_features=5000)),
+            ('vect', CountVectorizer(ngram_range=NGRAM_RANGE, max_features=MAX_FEATURES)),
             ('tfidf', TfidfTransformer()),
             ('clf', SGDClassifier(loss='log_loss', penalty='l2', alpha=1e-3, random_state=42, max_iter=5, tol=None)),
         ])
-        
+
         text_clf.fit(X, y)
-        
+
         # Save Model
         joblib.dump(text_clf, model_path)
         print(f"Model saved to {model_path}")
-        
+
+        export_pipeline(text_clf, export_dir)
+        print(f"Inference artifact written to {export_dir}")
+        if publish_to:
+            publish(export_dir, publish_to)
+            print(f"{publish_to} now points at it")
+
         # Test a few examples
         test_sentences = [
             "I feel really down and hopeless",
@@ -58,9 +107,9 @@ def train_model():
             "I feel so romantic and loved",
             "Wow, I didn't expect that!"
         ]
-        
+
         predicted = text_clf.predict(test_sentences)
-        
+
         emotion_map = {
             0: 'sadness',
             1: 'joy',
@@ -69,12 +118,142 @@ def train_model():
             4: 'fear',
             5: 'surprise'
         }
-        
+
         for text, label in zip(test_sentences, predicted):
             print(f"'{text}' => {emotion_map.get(label, label)}")
-            
+
     except Exception as e:
         print(f"Error during training: {e}")
 
+
+def iter_chunks(path, chunksize):
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk = normalize_columns(chunk)
+        chunk = chunk.dropna(subset=['text', 'label'])
+        yield chunk['text'].astype(str), chunk['label']
+
+
+def iter_shuffled(path, chunksize, buffer_size, rng):
+    # iter_chunks in random order, as far as a bounded buffer allows: rows
+    # pool up to `buffer_size` and each batch is a random draw of `chunksize`
+    # of them, the rest staying in the pool for later batches. With a buffer
+    # no bigger than a chunk this is a plain shuffle within each chunk.
+    buffer_size = max(buffer_size, chunksize)
+    pool_x = pool_y = None
+    for texts, y in iter_chunks(path, chunksize):
+        texts, y = texts.to_numpy(dtype=object), y.to_numpy()
+        if pool_x is None:
+            pool_x, pool_y = texts, y
+        else:
+            pool_x, pool_y = np.concatenate([pool_x, texts]), np.concatenate([pool_y, y])
+        while len(pool_x) >= buffer_size:
+            order = rng.permutation(len(pool_x))
+            pool_x, pool_y = pool_x[order], pool_y[order]
+            yield pool_x[:chunksize], pool_y[:chunksize]
+            pool_x, pool_y = pool_x[chunksize:], pool_y[chunksize:]
+    if pool_x is not None and len(pool_x):
+        order = rng.permutation(len(pool_x))
+        for start in range(0, len(order), chunksize):
+            batch = order[start:start + chunksize]
+            yield pool_x[batch], pool_y[batch]
+
+
+def build_vocabulary(path, chunksize, max_features=MAX_FEATURES, prune_at=2_000_000):
+    # Streaming equivalent of CountVectorizer(max_features=...): keep the most
+    # frequent n-grams by corpus count, plus their document frequencies for
+    # the IDF. The counters are pruned to the top `prune_at` terms whenever
+    # they outgrow it so memory stays bounded on very large corpora.
+    analyzer = CountVectorizer(ngram_range=NGRAM_RANGE).build_analyzer()
+    term_counts = Counter()
+    doc_freq = Counter()
+    n_docs = 0
+    labels = set()
+    for texts, y in iter_chunks(path, chunksize):
+        labels.update(y.unique().tolist())
+        for text in texts:
+            terms = analyzer(text)
+            term_counts.update(terms)
+            doc_freq.update(set(terms))
+            n_docs += 1
+        if len(term_counts) > prune_at:
+            keep = dict(heapq.nlargest(prune_at // 2, term_counts.items(), key=lambda kv: kv[1]))
+            term_counts = Counter(keep)
+            doc_freq = Counter({t: doc_freq[t] for t in keep})
+
+    # Ties broken alphabetically, and columns assigned in sorted order like sklearn
+    top = heapq.nsmallest(max_features, term_counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    vocabulary = {term: i for i, term in enumerate(sorted(t for t, _ in top))}
+    df = np.array([doc_freq[t] for t in sorted(vocabulary, key=vocabulary.get)], dtype=np.float64)
+    # TfidfTransformer(smooth_idf=True)
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+    return vocabulary, idf, sorted(labels), n_docs
+
+
+def train_streaming(path=data_path, export_dir=None, chunksize=50_000, epochs=5,
+                    shuffle_buffer=200_000, seed=42, publish_to=None):
+    # Out-of-core training: the CSV is only ever held a few chunks at a time.
+    # Pass 1 fixes the vocabulary and IDF, then every epoch streams the file
+    # again through SGDClassifier.partial_fit. SGD fed the file in order
+    # drifts towards whatever label it saw last (fatal on a file sorted by
+    # label), so each epoch goes through iter_shuffled with a fresh order.
+    if not os.path.exists(path):
+        print(f"Error: Data file not found at {path}")
+        return None
+    export_dir = export_dir or new_release_dir()
+    if os.path.lexists(export_dir):
+        print(f"Error: {export_dir} already exists; choose a new --out directory")
+        return None
+
+    print("Building vocabulary...")
+    vocabulary, idf, classes, n_docs = build_vocabulary(path, chunksize)
+    print(f"{len(vocabulary)} features from {n_docs} samples, classes {classes}")
+
+    vect = CountVectorizer(ngram_range=NGRAM_RANGE, vocabulary=vocabulary)
+    clf = SGDClassifier(loss='log_loss', penalty='l2', alpha=1e-3, random_state=42)
+    rng = np.random.RandomState(seed)
+    warned = False
+    for epoch in range(epochs):
+        seen = 0
+        for texts, y in iter_shuffled(path, chunksize, shuffle_buffer, rng):
+            if not warned and len(classes) > 1 and len(y) >= len(classes) * 100 and len(np.unique(y)) == 1:
+                # The buffer is too small for how the file is ordered
+                print("Warning: a shuffled batch holds a single label; shuffle the file "
+                      "or raise --shuffle-buffer")
+                warned = True
+            X = normalize(vect.transform(texts).multiply(idf).tocsr())
+            clf.partial_fit(X, y, classes=classes)
+            seen += len(y)
+        print(f"Epoch {epoch + 1}/{epochs}: {seen} samples")
+
+    manifest = save_artifact(
+        export_dir, vocabulary, idf, clf.coef_, clf.intercept_,
+        clf.classes_.tolist(), source='streaming', n_samples=n_docs,
+    )
+    print(f"Inference artifact written to {export_dir}")
+    if publish_to:
+        publish(export_dir, publish_to)
+        print(f"{publish_to} now points at it")
+    return manifest
+
+
 if __name__ == "__main__":
-    train_model()
+    # python -m ml_model.train_model [--stream] [--data PATH] [--out DIR] [--publish LINK]
+    # (from mental_health_bot/), or python train_model.py ... from ml_model/
+    parser = argparse.ArgumentParser(description="Train the emotion classifier and export the inference artifact.")
+    parser.add_argument('--stream', action='store_true', help="Out-of-core training with partial_fit over CSV chunks")
+    parser.add_argument('--data', default=data_path)
+    parser.add_argument('--out', default=None, help="New artifact directory to write (default: ml_model/releases/<timestamp>)")
+    parser.add_argument('--publish', default=None, metavar='LINK',
+                        help="Then repoint this symlink (the model path the apps watch) at it")
+    parser.add_argument('--chunksize', type=int, default=50_000)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--shuffle-buffer', type=int, default=200_000,
+                        help="Rows pooled for shuffling in --stream mode (memory vs. mixing)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.stream:
+        train_streaming(args.data, args.out, chunksize=args.chunksize, epochs=args.epochs,
+                        shuffle_buffer=args.shuffle_buffer, seed=args.seed, publish_to=args.publish)
+    else:
+        train_model(args.data, args.out, publish_to=args.publish)